@@ -1,6 +1,7 @@
 import asyncio
 import base64
 import logging
+import math
 import re
 import traceback
 from configparser import ConfigParser
@@ -11,10 +12,10 @@ from typing import Optional, List
 import discord
 from discord.ext import commands
 
+from anubis.async_database import AsyncDatabase
 from anubis.customizations import Anubis
-from anubis.database import Database
 from anubis.errors import AnticipatedError, PleaseRestate, Unauthorized
-from anubis.models import Guild
+from anubis.storage import open_storage
 
 config = ConfigParser()
 config.read("./anubis.cfg")
@@ -33,7 +34,7 @@ intents.members = True
 intents.message_content = True
 
 # noinspection PyTypeChecker
-database: Database = Database(config)
+database: AsyncDatabase = AsyncDatabase(open_storage(config))
 
 bot = Anubis(
     config,
@@ -60,25 +61,34 @@ def process_docstrings(text) -> str:
 
 @bot.event
 async def on_ready():
-    for guild in bot.guilds:
-        fetched_guild = bot.database.guilds.get_settings(guild.id)
-        if fetched_guild is None:
-            bot.database.guilds.save(Guild(guild.id, 3, 15, 50, 5, 0, 0))
+    provisioned = await bot.database.guilds.ensure_defaults(
+        guild.id for guild in bot.guilds
+    )
+    if provisioned:
+        bot.log.info(f"Created default settings for {provisioned} guilds")
 
 
 @bot.event
 async def on_guild_join(guild: discord.guild):
-    fetched_guild = bot.database.guilds.get_settings(guild.id)
-    if fetched_guild is None:
-        bot.database.guilds.save(Guild(guild.id, 3, 15, 50, 5, 0, 0))
+    await bot.database.guilds.ensure_defaults([guild.id])
 
 
 @bot.command()
 @bot.has_guild_manage_message_or_in_user_bot_channel()
 async def ping(ctx):
-    embed = discord.Embed(
-        title="**Ping**", description=f"Pong! {round(bot.latency * 1000)}ms"
-    )
+    lines = [f"Pong! {round(bot.latency * 1000)}ms"]
+    for shard_id, latency in bot.latencies:
+        stats = bot.stats_of_shard(shard_id)
+        line = (
+            f"Shard {shard_id}: "
+            f"{f'{round(latency * 1000)}ms' if math.isfinite(latency) else 'offline'}, "
+            f"{stats.rate.per_second():.1f} events/s, "
+            f"p99 {stats.handlers.merged().quantile(0.99) * 1000:.1f}ms handlers"
+        )
+        if ctx.guild and ctx.guild.shard_id == shard_id:
+            line = f"**{line}**"
+        lines.append(line)
+    embed = discord.Embed(title="**Ping**", description="\n".join(lines)[:4096])
     embed.set_author(name=f"{bot.user.name}", icon_url=bot.user.display_avatar.url)
     await ctx.send(embed=embed)
 
@@ -0,0 +1,239 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Callable, FrozenSet, Iterable, List, Optional, Tuple, TypeVar
+
+from anubis.storage import Storage
+from anubis.metrics import add_database_time
+from anubis.models import *
+
+T = TypeVar("T")
+
+
+class AsyncDatabase:
+    """
+    Runs the blocking repository calls of a Storage backend off the event loop.
+    Writes are serialised on a single writer thread, reads go to a small pool of reader threads
+    which, with SQLite, use the Database's read-only connections.
+    """
+
+    def __init__(self, database: Storage):
+        self.database = database
+        self.config = database.config
+        self.log = database.log
+        self.writer = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="anubis-db-writer"
+        )
+        self.readers = ThreadPoolExecutor(
+            max_workers=self.config["database"].getint("readers", fallback=4),
+            thread_name_prefix="anubis-db-reader",
+        )
+
+        # Called with the kind of data, guild id and user id after every write that changes
+        # something processes other than this one may have cached, see WorkerPool.
+        self.change_listeners: List[Callable[[str, int, Optional[int]], None]] = []
+
+        self.guilds = AsyncGuilds(self)
+        self.users = AsyncUsers(self)
+        self.rewards = AsyncRewards(self)
+        self.ignored_channels = AsyncIgnoredChannels(self)
+        self.ignored_roles = AsyncIgnoredRoles(self)
+
+    def run_write(self, function: Callable[..., T], *args) -> T:
+        with self.database.writing():
+            return function(*args)
+
+    async def read(self, function: Callable[..., T], *args) -> T:
+        start = perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.readers, function, *args
+            )
+        finally:
+            add_database_time(perf_counter() - start)
+
+    async def write(self, function: Callable[..., T], *args) -> T:
+        start = perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.writer, self.run_write, function, *args
+            )
+        finally:
+            add_database_time(perf_counter() - start)
+
+    def changed(self, kind: str, guild_id: int, user_id: Optional[int] = None) -> None:
+        for listener in self.change_listeners:
+            listener(kind, guild_id, user_id)
+
+    def close(self) -> None:
+        self.readers.shutdown()
+        self.writer.shutdown()
+        self.database.close()
+
+
+class AsyncGuilds:
+    def __init__(self, database: AsyncDatabase):
+        self.database = database
+        self.guilds = database.database.guilds
+
+    async def get_settings(self, guild_id: int) -> Guild:
+        return self.guilds.get_cached(guild_id) or await self.database.read(
+            self.guilds.get_settings, guild_id
+        )
+
+    async def save(self, guild: Guild) -> Guild:
+        saved_guild = await self.database.write(self.guilds.save, guild)
+        self.database.changed("guild", guild.id)
+        return saved_guild
+
+    async def ensure_defaults(self, guild_ids: Iterable[int]) -> int:
+        return await self.database.write(self.guilds.ensure_defaults, list(guild_ids))
+
+
+class AsyncUsers:
+    def __init__(self, database: AsyncDatabase):
+        self.database = database
+        self.users = database.database.users
+
+    @property
+    def write_behind(self) -> bool:
+        return self.users.write_behind
+
+    @property
+    def flush_interval(self) -> float:
+        return self.users.flush_interval
+
+    def on_cooldown(self, user_id: int, guild_id: int, now: datetime) -> bool:
+        return self.users.on_cooldown(user_id, guild_id, now)
+
+    async def get(self, user_id: int, guild_id: int) -> User:
+        return await self.database.read(self.users.get, user_id, guild_id)
+
+    async def get_all_ignored(self, guild_id: int) -> List[User]:
+        return await self.database.read(self.users.get_all_ignored, guild_id)
+
+    async def save(self, user: User) -> User:
+        saved_user = await self.database.write(self.users.save, user)
+        self.database.changed("user", user.guild.id, user.id)
+        return saved_user
+
+    async def grant_xp(
+        self, user_id: int, guild_id: int, now: datetime
+    ) -> Optional[Tuple[int, User]]:
+        return await self.database.write(self.users.grant_xp, user_id, guild_id, now)
+
+    async def adjust_xp(
+        self, user_id: int, guild_id: int, amount: Optional[int]
+    ) -> Optional[Tuple[int, User]]:
+        return await self.database.write(
+            self.users.adjust_xp, user_id, guild_id, amount
+        )
+
+    async def adjust_xp_many(
+        self, user_ids: Iterable[int], guild_id: int, amount: Optional[int]
+    ) -> Tuple[int, int]:
+        return await self.database.write(
+            self.users.adjust_xp_many, user_ids, guild_id, amount
+        )
+
+    async def flush(self) -> int:
+        return await self.database.write(self.users.flush)
+
+    async def get_ranked_users(self, guild_id: int) -> RankedUsers:
+        return await self.database.read(self.users.get_ranked_users, guild_id)
+
+    async def get_ranked_page(
+        self, guild_id: int, limit: int, offset: int = 0
+    ) -> List[User]:
+        return await self.database.read(
+            self.users.get_ranked_page, guild_id, limit, offset
+        )
+
+    async def count(self, guild_id: int) -> int:
+        return await self.database.read(self.users.count, guild_id)
+
+    async def get_rank(self, user: User) -> int:
+        return await self.database.read(self.users.get_rank, user)
+
+
+class AsyncRewards:
+    def __init__(self, database: AsyncDatabase):
+        self.database = database
+        self.rewards = database.database.rewards
+
+    async def get_index(self, guild_id: int) -> RewardIndex:
+        index = self.rewards.get_cached(guild_id)
+        if index is None:
+            index = await self.database.read(self.rewards.get_index, guild_id)
+        return index
+
+    async def get(self, guild_id: int, role_id: int) -> Reward:
+        return await self.database.read(self.rewards.get, guild_id, role_id)
+
+    async def get_all(self, guild_id: int) -> List[Reward]:
+        return await self.database.read(self.rewards.get_all, guild_id)
+
+    async def save(self, reward: Reward) -> Reward:
+        saved_reward = await self.database.write(self.rewards.save, reward)
+        self.database.changed("rewards", reward.guild.id)
+        return saved_reward
+
+    async def delete(self, guild_id: int, role_id: int) -> None:
+        await self.database.write(self.rewards.delete, guild_id, role_id)
+        self.database.changed("rewards", guild_id)
+
+
+class AsyncIgnoredChannels:
+    def __init__(self, database: AsyncDatabase):
+        self.database = database
+        self.ignored_channels = database.database.ignored_channels
+
+    async def get_ids(self, guild_id: int) -> FrozenSet[int]:
+        ids = self.ignored_channels.get_cached(guild_id)
+        if ids is None:
+            ids = await self.database.read(self.ignored_channels.get_ids, guild_id)
+        return ids
+
+    async def get(self, channel_id: int, guild_id: int) -> IgnoredChannel:
+        return await self.database.read(self.ignored_channels.get, channel_id, guild_id)
+
+    async def get_all(self, guild_id: int) -> List[IgnoredChannel]:
+        return await self.database.read(self.ignored_channels.get_all, guild_id)
+
+    async def save(self, ignored_channel: IgnoredChannel) -> IgnoredChannel:
+        saved_channel = await self.database.write(
+            self.ignored_channels.save, ignored_channel
+        )
+        self.database.changed("ignored_channels", ignored_channel.guild.id)
+        return saved_channel
+
+    async def delete(self, channel_id: int, guild_id: int) -> None:
+        await self.database.write(self.ignored_channels.delete, channel_id, guild_id)
+        self.database.changed("ignored_channels", guild_id)
+
+
+class AsyncIgnoredRoles:
+    def __init__(self, database: AsyncDatabase):
+        self.database = database
+        self.ignored_roles = database.database.ignored_roles
+
+    async def get_ids(self, guild_id: int) -> FrozenSet[int]:
+        ids = self.ignored_roles.get_cached(guild_id)
+        if ids is None:
+            ids = await self.database.read(self.ignored_roles.get_ids, guild_id)
+        return ids
+
+    async def get(self, role_id: int, guild_id: int) -> IgnoredRole:
+        return await self.database.read(self.ignored_roles.get, role_id, guild_id)
+
+    async def get_all(self, guild_id: int) -> List[IgnoredRole]:
+        return await self.database.read(self.ignored_roles.get_all, guild_id)
+
+    async def save(self, ignored_role: IgnoredRole) -> IgnoredRole:
+        saved_role = await self.database.write(self.ignored_roles.save, ignored_role)
+        self.database.changed("ignored_roles", ignored_role.guild.id)
+        return saved_role
+
+    async def delete(self, role_id: int, guild_id: int) -> None:
+        await self.database.write(self.ignored_roles.delete, role_id, guild_id)
+        self.database.changed("ignored_roles", guild_id)
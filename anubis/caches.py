@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict
+from math import inf
+from time import monotonic, time
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class CooldownIndex:
+    """
+    Remembers until when each user of each guild is on cooldown, as a POSIX timestamp keyed by a
+    single packed integer. Expired entries are swept out once the index grows past max_size.
+    """
+
+    def __init__(self, max_size: int = 250_000):
+        self.max_size = max_size
+        self.expiries: Dict[int, float] = {}
+
+    @staticmethod
+    def key(guild_id: int, user_id: int) -> int:
+        return guild_id << 64 | user_id
+
+    def on_cooldown(self, guild_id: int, user_id: int, now: float) -> bool:
+        return self.expiries.get(self.key(guild_id, user_id), -inf) >= now
+
+    def set(self, guild_id: int, user_id: int, expiry: float) -> None:
+        self.expiries[self.key(guild_id, user_id)] = expiry
+        if len(self.expiries) > self.max_size:
+            self.sweep()
+
+    def forget(self, guild_id: int, user_id: int) -> None:
+        self.expiries.pop(self.key(guild_id, user_id), None)
+
+    def sweep(self, now: Optional[float] = None) -> None:
+        """Drop expired entries, then the oldest ones if the index is still too large."""
+        now = time() if now is None else now
+        for key, expiry in list(self.expiries.items()):
+            if expiry < now:
+                self.expiries.pop(key, None)
+        overflow = len(self.expiries) - self.max_size * 3 // 4
+        if overflow > 0:
+            for key in list(self.expiries)[:overflow]:
+                self.expiries.pop(key, None)
+
+
+class Generations:
+    """
+    Counts the invalidations of each guild's entry in a cache filled by reader threads. A
+    reader notes the generation before querying and only stores what it read if no write
+    invalidated the entry in the meantime, so a slow read can't put back stale data.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts: Dict[int, int] = {}
+
+    def of(self, guild_id: int) -> int:
+        return self.counts.get(guild_id, 0)
+
+    def invalidate(self, cache: Dict[int, Any], guild_id: int) -> None:
+        with self.lock:
+            self.counts[guild_id] = self.counts.get(guild_id, 0) + 1
+            cache.pop(guild_id, None)
+
+    def store(
+        self, cache: Dict[int, Any], guild_id: int, generation: int, value: Any
+    ) -> None:
+        with self.lock:
+            if self.counts.get(guild_id, 0) == generation:
+                cache[guild_id] = value
+
+
+class TTLCache:
+    """
+    A least-recently-used cache of at most max_size entries, each of which also expires ttl
+    seconds after it was stored.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+        expiry, value = entry
+        if expiry < monotonic():
+            del self.entries[key]
+            return default
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self.entries[key] = (monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
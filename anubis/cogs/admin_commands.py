@@ -15,15 +15,13 @@ class AdminCommands(Anubis.Cog):
         if amount < 0:
             await ctx.reply("Please enter a positive amount.", color=ctx.Color.BAD)
             return
-        retrieved_user = ctx.database.users.get(user.id, ctx.guild.id)
-        if not retrieved_user:
+        adjusted = await ctx.database.users.adjust_xp(user.id, ctx.guild.id, amount)
+        if not adjusted:
             await ctx.reply(
                 f"{user.mention} was not found in database. Have they been on the server before?",
                 color=ctx.Color.BAD,
             )
             return
-        retrieved_user.grant_xp(amount)
-        ctx.database.users.save(retrieved_user)
         await ctx.reply(
             f"{user.mention} has been awarded {amount} xp", color=ctx.Color.GOOD
         )
@@ -37,34 +35,133 @@ class AdminCommands(Anubis.Cog):
         """Removes the provided xp from the user.
         `user` is the user to remove xp from. This can be an Id, Mention, or Name.
         `amount` is the amount to remove. `all` will remove all xp."""
-        retrieved_user = ctx.database.users.get(user.id, ctx.guild.id)
-        if not retrieved_user:
+        if isinstance(amount, int) and amount < 0:
+            await ctx.reply("Please enter a positive number.", color=ctx.Color.BAD)
+            return
+        if isinstance(amount, str) and amount.lower() != "all":
+            await ctx.reply("Please enter a valid number.", color=ctx.Color.BAD)
+            return
+        adjusted = await ctx.database.users.adjust_xp(
+            user.id, ctx.guild.id, None if isinstance(amount, str) else -amount
+        )
+        if not adjusted:
             await ctx.reply(
                 f"{user.mention} was not found in database. Have they been on the server before?",
                 color=ctx.Color.BAD,
             )
             return
+        previous_xp, retrieved_user = adjusted
+        amount = previous_xp - retrieved_user.xp
+        await ctx.reply(
+            f"{user.mention} has had {amount} xp reclaimed", color=ctx.Color.BAD
+        )
+        await self.bot.post_log(
+            retrieved_user.guild,
+            f"{user.mention} has had {amount} xp reclaimed by {ctx.author.mention}",
+            color=ctx.Color.BAD,
+        )
+
+    # Characters of mentions a bulk log entry names its targets with, the rest are counted.
+    MENTION_BUDGET = 1000
+
+    @classmethod
+    def mentions_of(
+        cls, targets: List[typing.Union[discord.Role, discord.User]]
+    ) -> str:
+        """The targets' mentions for a log entry, ending in how many more there are."""
+        mentions = []
+        length = 0
+        for index, target in enumerate(targets):
+            if length + len(target.mention) > cls.MENTION_BUDGET:
+                mentions.append(f"and {len(targets) - index} more")
+                break
+            mentions.append(target.mention)
+            length += len(target.mention) + 1
+        return " ".join(mentions)
+
+    @staticmethod
+    def members_of(
+        targets: List[typing.Union[discord.Role, discord.User]],
+    ) -> typing.Set[int]:
+        """The ids of the given users and of every member of the given roles, bots left out."""
+        user_ids = set()
+        for target in targets:
+            if isinstance(target, discord.Role):
+                user_ids.update(
+                    member.id for member in target.members if not member.bot
+                )
+            elif not target.bot:
+                user_ids.add(target.id)
+        return user_ids
+
+    @commands.command()
+    @commands.has_guild_permissions(manage_messages=True)
+    async def bulkaward(
+        self,
+        ctx: Anubis.Context,
+        amount: int,
+        targets: Greedy[typing.Union[discord.Role, discord.User]],
+    ):
+        """Awards every given user and every member of the given roles with the provided xp.
+        `amount` is the amount to reward each of them.
+        `targets` is a space separated list of users and roles, as Mentions or Ids."""
+        if amount < 0:
+            await ctx.reply("Please enter a positive amount.", color=ctx.Color.BAD)
+            return
+        user_ids = self.members_of(targets)
+        if not user_ids:
+            await ctx.reply(
+                "Please name users or roles with members.", color=ctx.Color.BAD
+            )
+            return
+        found, _ = await ctx.database.users.adjust_xp_many(
+            user_ids, ctx.guild.id, amount
+        )
+        summary = f"{found} users have been awarded {amount} xp each"
+        missing = len(user_ids) - found
+        if missing:
+            summary += f", {missing} were not found in database"
+        await ctx.reply(summary, color=ctx.Color.GOOD)
+        await self.bot.post_log(
+            ctx.guild,
+            f"**Mod:**{ctx.author.mention}\n" f"{self.mentions_of(targets)}\n{summary}",
+            color=ctx.Color.GOOD,
+        )
+
+    @commands.command()
+    @commands.has_guild_permissions(manage_messages=True)
+    async def bulkreclaim(
+        self,
+        ctx: Anubis.Context,
+        amount: typing.Union[int, str],
+        targets: Greedy[typing.Union[discord.Role, discord.User]],
+    ):
+        """Removes the provided xp from every given user and every member of the given roles.
+        `amount` is the amount to remove from each of them. `all` will remove all xp.
+        `targets` is a space separated list of users and roles, as Mentions or Ids."""
         if isinstance(amount, int) and amount < 0:
             await ctx.reply("Please enter a positive number.", color=ctx.Color.BAD)
             return
-        if isinstance(amount, str) and amount.lower() == "all":
-            amount = retrieved_user.xp
-            retrieved_user.xp = 0
-        elif isinstance(amount, str):
+        if isinstance(amount, str) and amount.lower() != "all":
             await ctx.reply("Please enter a valid number.", color=ctx.Color.BAD)
             return
-        else:
-            retrieved_user.xp -= amount
-        if retrieved_user.xp < 0:
-            amount += retrieved_user.xp
-            retrieved_user.xp = 0
-        ctx.database.users.save(retrieved_user)
-        await ctx.reply(
-            f"{user.mention} has had {amount} xp reclaimed", color=ctx.Color.BAD
+        user_ids = self.members_of(targets)
+        if not user_ids:
+            await ctx.reply(
+                "Please name users or roles with members.", color=ctx.Color.BAD
+            )
+            return
+        found, change = await ctx.database.users.adjust_xp_many(
+            user_ids, ctx.guild.id, None if isinstance(amount, str) else -amount
         )
+        summary = f"{found} users have had {-change} xp reclaimed in total"
+        missing = len(user_ids) - found
+        if missing:
+            summary += f", {missing} were not found in database"
+        await ctx.reply(summary, color=ctx.Color.BAD)
         await self.bot.post_log(
-            retrieved_user.guild,
-            f"{user.mention} has had {amount} xp reclaimed by {ctx.author.mention}",
+            ctx.guild,
+            f"**Mod:**{ctx.author.mention}\n" f"{self.mentions_of(targets)}\n{summary}",
             color=ctx.Color.BAD,
         )
 
@@ -83,18 +180,18 @@ class AdminCommands(Anubis.Cog):
         and might cause issues"""
         mention_list = ""
         failed_list = ""
-        guild = ctx.database.guilds.get_settings(ctx.guild.id)
+        guild = await ctx.database.guilds.get_settings(ctx.guild.id)
         for arg in args:
             if isinstance(arg, discord.User):
-                user = ctx.database.users.get(arg.id, ctx.guild.id)
+                user = await ctx.database.users.get(arg.id, ctx.guild.id)
                 user.ignore_xp_gain = True
-                ctx.database.users.save(user)
+                await ctx.database.users.save(user)
                 mention_list += f"{arg.mention} "
             if isinstance(arg, discord.TextChannel):
-                ctx.database.ignored_channels.save(IgnoredChannel(guild, arg.id))
+                await ctx.database.ignored_channels.save(IgnoredChannel(guild, arg.id))
                 mention_list += f"{arg.mention} "
             if isinstance(arg, discord.Role):
-                ctx.database.ignored_roles.save(IgnoredRole(guild, arg.id))
+                await ctx.database.ignored_roles.save(IgnoredRole(guild, arg.id))
                 mention_list += f"{arg.mention} "
             if isinstance(arg, str):
                 failed_list += " " + arg
@@ -127,15 +224,15 @@ class AdminCommands(Anubis.Cog):
         failed_list = ""
         for arg in args:
             if isinstance(arg, discord.User):
-                user = ctx.database.users.get(arg.id, ctx.guild.id)
+                user = await ctx.database.users.get(arg.id, ctx.guild.id)
                 user.ignore_xp_gain = False
-                ctx.database.users.save(user)
+                await ctx.database.users.save(user)
                 mention_list += f"{arg.mention} "
             if isinstance(arg, discord.TextChannel):
-                ctx.database.ignored_channels.delete(arg.id, ctx.guild.id)
+                await ctx.database.ignored_channels.delete(arg.id, ctx.guild.id)
                 mention_list += f"{arg.mention} "
             if isinstance(arg, discord.Role):
-                ctx.database.ignored_roles.delete(arg.id, ctx.guild.id)
+                await ctx.database.ignored_roles.delete(arg.id, ctx.guild.id)
                 mention_list += f"{arg.mention} "
             if isinstance(arg, str):
                 failed_list += " " + arg
@@ -156,9 +253,9 @@ class AdminCommands(Anubis.Cog):
     @commands.has_guild_permissions(manage_messages=True)
     async def showignored(self, ctx: Anubis.Context):
         """Displays all the rewards for this server."""
-        channels = ctx.database.ignored_channels.get_all(ctx.guild.id)
-        roles = ctx.database.ignored_roles.get_all(ctx.guild.id)
-        users = ctx.database.users.get_all_ignored(ctx.guild.id)
+        channels = await ctx.database.ignored_channels.get_all(ctx.guild.id)
+        roles = await ctx.database.ignored_roles.get_all(ctx.guild.id)
+        users = await ctx.database.users.get_all_ignored(ctx.guild.id)
         if not channels and not roles and not users:
             await ctx.reply(
                 "This guild does not have any ignored roles, users, or channels."
@@ -170,7 +267,9 @@ class AdminCommands(Anubis.Cog):
             if retrieved_channel:
                 channel_msg.append(f"{retrieved_channel.mention}\n")
             else:
-                ctx.database.ignored_channels.delete(channel.channel, ctx.guild)
+                await ctx.database.ignored_channels.delete(
+                    channel.channel, ctx.guild.id
+                )
 
         role_msg = []
         for role in roles:
@@ -178,10 +277,13 @@ class AdminCommands(Anubis.Cog):
             if retrieved_role:
                 role_msg.append(f"{retrieved_role.mention}\n")
             else:
-                ctx.database.ignored_roles.delete(role.role, ctx.guild.id)
+                await ctx.database.ignored_roles.delete(role.role, ctx.guild.id)
         user_msg = []
+        retrieved_users = await self.bot.resolve_users(
+            ctx.guild, [user.id for user in users]
+        )
         for user in users:
-            retrieved_user = await self.bot.fetch_user(user.id)
+            retrieved_user = retrieved_users.get(user.id)
             if retrieved_user:
                 user_msg.append(f"{retrieved_user.mention}\n")
         embeds: List[discord.Embed] = []
@@ -196,6 +298,30 @@ class AdminCommands(Anubis.Cog):
         for embed in embeds:
             await ctx.reply(embed=embed)
 
+    @commands.command()
+    @commands.is_owner()
+    async def stats(self, ctx: Anubis.Context, limit: int = 5):
+        """Displays the database statements that take the most time.
+        `limit` is how many statements to show per ranking."""
+        query_stats = ctx.database.database.query_stats
+        if not query_stats.statements:
+            await ctx.reply("No statements have been recorded.")
+            return
+        lines = []
+        for title, key in (
+            ("Total time", "total"),
+            ("Calls", "count"),
+            ("p99 over the last hour", "p99"),
+        ):
+            lines.append(f"**{title}**")
+            for statement in query_stats.top(key, limit):
+                lines.append(
+                    f"`{statement.method}` {statement.count} calls, "
+                    f"{statement.total * 1000:.1f} ms total, p99 {statement.p99 * 1000:.2f} ms"
+                    f"\n`{statement.sql[:100]}`"
+                )
+        await ctx.reply("\n".join(lines), title="Database Statements")
+
     @staticmethod
     def construct_ignored_embed(
         embeds: List[discord.Embed], name: str, values: List[str]
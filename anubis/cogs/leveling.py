@@ -1,94 +1,150 @@
+import time
 from datetime import datetime, timezone
+from typing import Iterable, List
 
 import discord
 from discord.ext import commands
 
-from anubis import Anubis, User
+from anubis import Anubis
+from anubis.models import Guild
+from anubis.workers import MessageEvent, Outcome
 
 
 class Leveling(Anubis.Cog):
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
-        ignored_channels = [
-            channel.channel
-            for channel in self.bot.database.ignored_channels.get_all(message.guild.id)
-        ]
-        ignored_roles = [
-            role.role
-            for role in self.bot.database.ignored_roles.get_all(message.guild.id)
-        ]
-        if (
-            message.author.bot
-            or message.is_system()
-            or message.channel.id in ignored_channels
-            or any(item.id in ignored_roles for item in message.author.roles)
-        ):
+        if message.author.bot or message.is_system() or not message.guild:
             return
-        user = self.bot.database.users.get(message.author.id, message.guild.id)
-        if not user:
-            self.bot.database.users.save(
-                User(
+        if self.bot.workers:
+            self.bot.workers.submit(
+                MessageEvent(
+                    message.guild.id,
+                    message.channel.id,
                     message.author.id,
-                    self.bot.database.guilds.get_settings(message.guild.id),
-                    0,
-                    datetime.now(timezone.utc),
-                    False,
+                    tuple(role.id for role in message.author.roles),
+                    time.time(),
                 )
             )
             return
-        if user.ignore_xp_gain:
+        now = datetime.now(timezone.utc)
+        if self.bot.database.users.on_cooldown(
+            message.author.id, message.guild.id, now
+        ):
+            return
+        if message.channel.id in await self.bot.database.ignored_channels.get_ids(
+            message.guild.id
+        ):
+            return
+        ignored_roles = await self.bot.database.ignored_roles.get_ids(message.guild.id)
+        if ignored_roles and any(
+            role.id in ignored_roles for role in message.author.roles
+        ):
+            return
+        granted = await self.bot.database.users.grant_xp(
+            message.author.id, message.guild.id, now
+        )
+        if granted:
+            previous_xp, user = granted
+            previous_level = user.guild.levels.level(previous_xp)
+            leveled_up = user.level > previous_level
+            if not leveled_up and previous_xp:
+                return
+            # Rewards are only looked at when a level is crossed, or on the first XP ever
+            # granted so that rewards for the starting level are handed out too.
+            reward_index = await self.bot.database.rewards.get_index(message.guild.id)
+            await self.announce(
+                message.guild,
+                message.author,
+                user.guild,
+                user.level,
+                leveled_up,
+                reward_index.earned(previous_level if previous_xp else 0, user.level),
+            )
+
+    @commands.Cog.listener()
+    async def on_xp_outcome(self, outcome: Outcome):
+        """Carry out what an XP worker decided for a message."""
+        guild = self.bot.get_guild(outcome.guild_id)
+        if not guild:
+            return
+        member = guild.get_member(outcome.user_id)
+        if not member:
+            try:
+                member = await guild.fetch_member(outcome.user_id)
+            except discord.HTTPException:
+                return
+        await self.announce(
+            guild,
+            member,
+            await self.bot.database.guilds.get_settings(outcome.guild_id),
+            outcome.level,
+            outcome.leveled_up,
+            outcome.roles,
+        )
+
+    async def announce(
+        self,
+        guild: discord.Guild,
+        member: discord.Member,
+        settings: Guild,
+        level: int,
+        leveled_up: bool,
+        role_ids: Iterable[int],
+    ):
+        """Log a level up and hand out the reward roles the member doesn't have yet."""
+        if leveled_up:
+            embed = discord.Embed(
+                description=f"{member.mention} has leveled to level {level}.",
+                color=self.bot.Context.Color.AUTOMATIC_BLUE,
+            )
+            embed.set_author(name=f"{member.name}#{member.discriminator}")
+            embed.set_footer(text=f"{member.id}")
+            await self.bot.post_log(
+                settings, embed=embed, timestamp=discord.utils.utcnow()
+            )
+        roles: List[discord.Role] = [
+            role
+            for role in map(guild.get_role, role_ids)
+            if role and role not in member.roles
+        ]
+        if not roles:
             return
-        elif user.timeout < datetime.now(timezone.utc):
-            previous_level = user.level
-            user.grant_xp()
-            self.bot.database.users.save(user)
-            rewards = self.bot.database.rewards.get_all(message.guild.id)
-            if user.level > previous_level:
-                embed = discord.Embed(
-                    description=f"{message.author.mention} has leveled to level {user.level}.",
+        try:
+            await member.add_roles(*roles, reason="Earned by leveling.")
+            embed = (
+                discord.Embed(
+                    description=f"{member.mention} has earned {' '.join([role.mention for role in roles])}",
                     color=self.bot.Context.Color.AUTOMATIC_BLUE,
                 )
-                embed.set_author(
-                    name=f"{message.author.name}#{message.author.discriminator}"
-                )
-                embed.set_footer(text=f"{message.author.id}")
-                await self.bot.post_log(
-                    user.guild, embed=embed, timestamp=discord.utils.utcnow()
-                )
-            if rewards:
-                roles: List[discord.Role] = []
-                for reward in rewards:
-                    role = message.guild.get_role(reward.role)
-                    if role in message.author.roles:
-                        pass
-                    elif reward.level <= user.level:
-                        roles.append(role)
-                if not roles:
-                    return
-                try:
-                    await message.author.add_roles(*roles, reason="Earned by leveling.")
-                    embed = (
-                        discord.Embed(
-                            description=f"{message.author.mention} has earned {' '.join([role.mention for role in roles])}",
-                            color=self.bot.Context.Color.AUTOMATIC_BLUE,
-                        )
-                        .set_author(
-                            name=f"{message.author.name}#{message.author.discriminator}"
-                        )
-                        .set_footer(text=f"{message.author.id}")
-                    )
-                    await self.bot.post_log(
-                        user.guild,
-                        embed=embed,
-                        timestamp=discord.utils.utcnow(),
-                    )
-                except discord.Forbidden:
-                    await self.bot.post_log(
-                        user.guild,
-                        msg=f"Anubis does not have permission to add this role: {role.mention}",
-                        color=self.bot.Context.Color.BAD,
-                        timestamp=discord.utils.utcnow(),
-                    )
+                .set_author(name=f"{member.name}#{member.discriminator}")
+                .set_footer(text=f"{member.id}")
+            )
+            await self.bot.post_log(
+                settings,
+                embed=embed,
+                timestamp=discord.utils.utcnow(),
+            )
+        except discord.Forbidden:
+            await self.bot.post_log(
+                settings,
+                msg=f"Anubis does not have permission to add these roles: {' '.join([role.mention for role in roles])}",
+                color=self.bot.Context.Color.BAD,
+                timestamp=discord.utils.utcnow(),
+            )
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        if channel.id in await self.bot.database.ignored_channels.get_ids(
+            channel.guild.id
+        ):
+            await self.bot.database.ignored_channels.delete(
+                channel.id, channel.guild.id
+            )
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        if role.id in await self.bot.database.ignored_roles.get_ids(role.guild.id):
+            await self.bot.database.ignored_roles.delete(role.id, role.guild.id)
 
 
 async def setup(bot):
@@ -10,11 +10,13 @@ class Rewards(Anubis.Cog):
         """Adds or updates a leveling reward.
         `role` is the role that is to be rewarded. This can be a mention, id or name.
         `role_level` is the level that the role should be awarded at."""
-        retrieved_reward = ctx.database.rewards.get(ctx.guild.id, role.id)
+        retrieved_reward = await ctx.database.rewards.get(ctx.guild.id, role.id)
         if not retrieved_reward:
-            ctx.database.rewards.save(
+            await ctx.database.rewards.save(
                 Reward(
-                    ctx.database.guilds.get_settings(ctx.guild.id), role.id, role_level
+                    await ctx.database.guilds.get_settings(ctx.guild.id),
+                    role.id,
+                    role_level,
                 )
             )
             await ctx.reply(
@@ -23,7 +25,7 @@ class Rewards(Anubis.Cog):
             )
         else:
             retrieved_reward.level = role_level
-            ctx.database.rewards.save(retrieved_reward)
+            await ctx.database.rewards.save(retrieved_reward)
             await ctx.reply(
                 f"Updated {role.mention} reward to level {role_level}",
                 color=ctx.Color.GOOD,
@@ -34,14 +36,14 @@ class Rewards(Anubis.Cog):
     async def remove(self, ctx: Anubis.Context, role: discord.Role):
         """Removes a reward from the database.
         `role` is the role that is to be removed. This can be a mention, id or name."""
-        ctx.database.rewards.delete(ctx.guild.id, role.id)
+        await ctx.database.rewards.delete(ctx.guild.id, role.id)
         await ctx.reply(f"Removed {role.mention} reward", color=ctx.Color.I_GUESS)
 
     @commands.command()
     @Anubis.has_guild_manage_message_or_in_user_bot_channel()
     async def showrewards(self, ctx: Anubis.Context):
         """Displays all the rewards for this server."""
-        rewards = ctx.database.rewards.get_all(ctx.guild.id)
+        rewards = await ctx.database.rewards.get_all(ctx.guild.id)
         if not rewards:
             await ctx.reply("This guild does not have any rewards.")
             return
@@ -17,7 +17,7 @@ class Settings(Anubis.Cog):
         """Adjusts the settings for the server. If no options are provided then it will post the settings.
         `Setting` is the option to adjust.
         `Value` is the new value."""
-        guild = ctx.database.guilds.get_settings(ctx.guild.id)
+        guild = await ctx.database.guilds.get_settings(ctx.guild.id)
         if value == "view":
             user_channel = ctx.guild.get_channel(guild.user_channel)
             if user_channel is None:
@@ -73,7 +73,7 @@ class Settings(Anubis.Cog):
                 await ctx.reply(f"Log Channel now set to {value.mention}.")
         else:
             raise commands.UserInputError(f"{setting} is not a valid setting option.")
-        ctx.database.guilds.save(guild)
+        await ctx.database.guilds.save(guild)
 
 
 async def setup(bot):
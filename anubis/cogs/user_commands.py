@@ -9,7 +9,7 @@ class UserCommands(Anubis.Cog):
         `User` is the user to lookup. This can be an Id, Mention, or Name."""
         if user == "me":
             user = ctx.author
-        retrieved_user = ctx.database.users.get(user.id, ctx.guild.id)
+        retrieved_user = await ctx.database.users.get(user.id, ctx.guild.id)
         if not retrieved_user:
             await ctx.reply(
                 msg="That user could not be found.",
@@ -18,7 +18,7 @@ class UserCommands(Anubis.Cog):
             )
             return
         user_level = retrieved_user.level
-        rewards = ctx.database.rewards.get_all(ctx.guild.id)
+        rewards = await ctx.database.rewards.get_all(ctx.guild.id)
         next_reward = Reward(retrieved_user.guild, 0, 0)
         for reward1 in rewards:
             if reward1.level <= user_level:
@@ -60,58 +60,45 @@ class UserCommands(Anubis.Cog):
         """Posts the xp leaderboard.
         `User` is the user to lookup. This can be an Id, Mention, Name or `Me` for yourself.
         This is optional. If no user is provided than it will post the top 10."""
-        ranked_users = ctx.database.users.get_ranked_users(ctx.guild.id)
+        total_users = await ctx.database.users.count(ctx.guild.id)
         if isinstance(user, str) and user.lower() == "me":
             user = ctx.author
         if isinstance(user, str) and user.lower() == "all":
-            leader_board_text = ""
-            i = 0
-            while i < 10 and i < len(ranked_users):
-                retrieved_user = await self.bot.fetch_user(ranked_users[i].id)
-                if retrieved_user:
-                    leader_board_text += f"**{i + 1}** {retrieved_user.mention} **XP:** {ranked_users[i].xp}\n"
-                i += 1
-            await ctx.reply(
-                title="LeaderBoard",
-                msg=leader_board_text,
-                color=ctx.Color.AUTOMATIC_BLUE,
-                subtitle=f"Total Users {len(ranked_users)}",
-            )
-            return
-        if isinstance(user, discord.User) or isinstance(user, discord.Member):
-            requesting_user = ctx.database.users.get(user.id, ctx.guild.id)
+            start_index = 0
+        elif isinstance(user, discord.User) or isinstance(user, discord.Member):
+            requesting_user = await ctx.database.users.get(user.id, ctx.guild.id)
             if not requesting_user:
                 await ctx.reply(
                     msg="That user could not be found.",
                     color=ctx.Color.BAD,
-                    subtitle=f"Total Users {len(ranked_users)}",
+                    subtitle=f"Total Users {total_users}",
                     timestamp=discord.utils.utcnow(),
                 )
                 return
-            leader_board_text = ""
-            i = 0
-            user_index = ranked_users.index(requesting_user)
-            if user_index - 5 < 0:
-                start_index = 0
-            else:
-                start_index = user_index - 5
-
-            while i < 10 and i < len(ranked_users) and start_index < len(ranked_users):
-                retrieved_user = await self.bot.fetch_user(ranked_users[start_index].id)
-                if retrieved_user:
-                    leader_board_text += (
-                        f"**{start_index + 1}** {retrieved_user.mention} "
-                        f"**XP:** {ranked_users[start_index].xp}\n"
-                    )
-                i += 1
-                start_index += 1
-            await ctx.reply(
-                title="LeaderBoard",
-                msg=leader_board_text,
-                color=ctx.Color.AUTOMATIC_BLUE,
-                subtitle=f"Total Users {len(ranked_users)}",
-            )
+            user_index = await ctx.database.users.get_rank(requesting_user)
+            start_index = max(user_index - 5, 0)
+        else:
             return
+        ranked_users = await ctx.database.users.get_ranked_page(
+            ctx.guild.id, 10, start_index
+        )
+        retrieved_users = await self.bot.resolve_users(
+            ctx.guild, [ranked_user.id for ranked_user in ranked_users]
+        )
+        leader_board_text = ""
+        for position, ranked_user in enumerate(ranked_users, start=start_index + 1):
+            retrieved_user = retrieved_users.get(ranked_user.id)
+            if retrieved_user:
+                leader_board_text += (
+                    f"**{position}** {retrieved_user.mention} "
+                    f"**XP:** {ranked_user.xp}\n"
+                )
+        await ctx.reply(
+            title="LeaderBoard",
+            msg=leader_board_text,
+            color=ctx.Color.AUTOMATIC_BLUE,
+            subtitle=f"Total Users {total_users}",
+        )
 
 
 async def setup(bot):
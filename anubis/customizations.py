@@ -1,6 +1,10 @@
+import asyncio
 import enum
+import functools
 import logging
+import math
 import random
+import time
 import typing
 from copy import copy
 from datetime import datetime, timezone
@@ -11,10 +15,21 @@ from anubis.models import Guild
 from discord import Activity, ActivityType
 from discord.ext import commands
 
-from anubis.database import Database
-
-
-class Anubis(commands.Bot):
+from anubis.async_database import AsyncDatabase
+from anubis.caches import TTLCache
+from anubis.log_dispatcher import LogDispatcher
+from anubis.metrics import (
+    LatencyRegistry,
+    ShardStats,
+    Timing,
+    add_discord_time,
+    current_timing,
+    dispatched_at,
+)
+from anubis.workers import WorkerPool
+
+
+class Anubis(commands.AutoShardedBot):
     """
     This Class is mostly just a standard discord.py bot class but sets up additional configuration needed for this bot.
     """
@@ -42,7 +57,7 @@ class Anubis(commands.Bot):
             return self.cog.log.getChild(name)
 
         @property
-        def database(self) -> Database:
+        def database(self) -> AsyncDatabase:
             """Return the bot's database connection"""
             return self.bot.database
 
@@ -127,18 +142,26 @@ class Anubis(commands.Bot):
 
     class Cog(commands.Cog):
         """
-        A cog with a logger attached to it.
+        A cog with a logger attached to it, whose listeners are timed.
         """
 
         def __init__(self, bot):
             self.bot: Anubis = bot
             self.log = bot.log.getChild(self.__class__.__name__)
+            # The listeners are looked up on the instance when the cog is added and removed,
+            # so shadowing them here times every run.
+            for event, method_name in self.__cog_listeners__:
+                setattr(
+                    self,
+                    method_name,
+                    bot.timed_listener(getattr(self, method_name), event, self),
+                )
 
-    def __init__(self, config, database: Database, **kwargs):
+    def __init__(self, config, database: AsyncDatabase, **kwargs):
         self.config = config
         self.log = logging.getLogger("Anubis")
         self.log.setLevel(logging.INFO)
-        self.database: Database = database
+        self.database: AsyncDatabase = database
         self.initial_extensions = [
             "anubis.cogs.admin_commands",
             "anubis.cogs.leveling",
@@ -147,17 +170,214 @@ class Anubis(commands.Bot):
             "anubis.cogs.user_commands",
         ]
         self.session = None
-        super().__init__(command_prefix=config["discord"]["prefix"], **kwargs)
+        self.flush_task = None
+        # Users that had to be fetched from the API because they aren't cached by discord.py,
+        # e.g. members that left. None marks users Discord doesn't know anymore.
+        self.fetched_users = TTLCache(max_size=4096, ttl=3600.0)
+        self.fetch_limit = asyncio.Semaphore(5)
+        self.log_dispatcher = LogDispatcher(
+            self.log.getChild("LogDispatcher"),
+            window=config["log"].getfloat("batch_window", fallback=2.0),
+            queue_size=config["log"].getint("queue_size", fallback=100),
+        )
+        self.timings = LatencyRegistry()
+        self.timings.collectors.append(self.collect_shard_stats)
+        self.timings.collectors.append(self.collect_log_stats)
+        self.metrics_runner = None
+        self.shard_stats: typing.Dict[int, ShardStats] = {}
+        # Messages are handed to separate processes for XP if [workers] count is set.
+        self.workers: typing.Optional[WorkerPool] = None
+        worker_count = config.getint("workers", "count", fallback=0)
+        if worker_count > 0:
+            if not database.database.shared:
+                raise ValueError(
+                    "XP workers need a database other processes can open, "
+                    "not an in-memory one"
+                )
+            if database.users.write_behind:
+                # XP buffered here would overwrite what the workers wrote in the meantime.
+                self.log.warning("write_behind is turned off while XP workers are used")
+                database.database.users.write_behind = False
+            self.workers = WorkerPool(
+                config,
+                worker_count,
+                queue_size=config.getint("workers", "queue_size", fallback=10_000),
+            )
+            database.change_listeners.append(self.workers.invalidate)
+        shard_count = config["discord"].get("shard_count", "auto")
+        super().__init__(
+            command_prefix=config["discord"]["prefix"],
+            http_trace=self.discord_trace(),
+            shard_count=None if shard_count in ("", "auto") else int(shard_count),
+            **kwargs,
+        )
+        self.before_invoke(self.start_command_timing)
+        self.after_invoke(self.finish_command_timing)
 
     async def setup_hook(self):
         self.session = aiohttp.ClientSession()
+        if self.database.users.write_behind:
+            self.flush_task = asyncio.create_task(self.flush_users())
+        if self.config.getboolean("metrics", "enabled", fallback=False):
+            host = self.config.get("metrics", "host", fallback="127.0.0.1")
+            port = self.config.getint("metrics", "port", fallback=9464)
+            self.metrics_runner = await self.timings.serve(host, port)
+            self.log.info(f"Serving metrics on http://{host}:{port}/metrics")
+        if self.workers:
+            self.workers.start(lambda outcome: self.dispatch("xp_outcome", outcome))
         for ext in self.initial_extensions:
             await self.load_extension(ext)
 
     async def close(self):
+        await self.log_dispatcher.close()
         await super().close()
+        if self.workers:
+            await asyncio.get_running_loop().run_in_executor(None, self.workers.close)
+        if self.flush_task:
+            self.flush_task.cancel()
+        if self.metrics_runner:
+            await self.metrics_runner.cleanup()
+        await self.database.users.flush()
+        self.database.close()
         await self.session.close()
 
+    @staticmethod
+    def shard_of(args: tuple) -> typing.Optional[int]:
+        """The shard an event came in on, if it belongs to a guild."""
+        if not args:
+            return None
+        guild = (
+            args[0]
+            if isinstance(args[0], discord.Guild)
+            else getattr(args[0], "guild", None)
+        )
+        return getattr(guild, "shard_id", None)
+
+    def stats_of_shard(self, shard_id: int) -> ShardStats:
+        stats = self.shard_stats.get(shard_id)
+        if stats is None:
+            stats = self.shard_stats[shard_id] = ShardStats()
+        return stats
+
+    def dispatch(self, event_name: str, /, *args, **kwargs):
+        shard_id = self.shard_of(args)
+        if shard_id is not None:
+            stats = self.stats_of_shard(shard_id)
+            stats.events += 1
+            stats.rate.add()
+        # Handlers are scheduled as tasks, which inherit the dispatch time from this context.
+        token = dispatched_at.set(time.perf_counter())
+        try:
+            super().dispatch(event_name, *args, **kwargs)
+        finally:
+            dispatched_at.reset(token)
+
+    @staticmethod
+    def discord_trace() -> aiohttp.TraceConfig:
+        """Add the time of every Discord API request to the command or listener that made it."""
+
+        async def on_request_start(session, context, params):
+            context.start = time.perf_counter()
+
+        async def on_request_end(session, context, params):
+            add_discord_time(time.perf_counter() - context.start)
+
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(on_request_start)
+        trace.on_request_end.append(on_request_end)
+        trace.on_request_exception.append(on_request_end)
+        return trace
+
+    def timed_listener(
+        self, listener: typing.Callable, event: str, cog: commands.Cog
+    ) -> typing.Callable:
+        @functools.wraps(listener)
+        async def timed(*args, **kwargs):
+            timing = Timing()
+            token = current_timing.set(timing)
+            try:
+                return await listener(*args, **kwargs)
+            finally:
+                current_timing.reset(token)
+                self.timings.record(
+                    "anubis_listener_seconds",
+                    {"event": event, "cog": cog.qualified_name},
+                    timing,
+                )
+                shard_id = self.shard_of(args)
+                if shard_id is not None:
+                    elapsed = time.perf_counter() - timing.start
+                    self.stats_of_shard(shard_id).handlers.observe(elapsed)
+                    self.timings.observe(
+                        "anubis_shard_handler_seconds",
+                        {"shard": str(shard_id)},
+                        elapsed,
+                    )
+
+        return timed
+
+    def collect_shard_stats(self):
+        for shard_id, latency in self.latencies:
+            if math.isfinite(latency):
+                self.timings.set_value(
+                    "anubis_shard_gateway_latency_seconds",
+                    "gauge",
+                    {"shard": str(shard_id)},
+                    latency,
+                )
+        for shard_id, stats in self.shard_stats.items():
+            labels = {"shard": str(shard_id)}
+            self.timings.set_value(
+                "anubis_shard_events_total", "counter", labels, stats.events
+            )
+            self.timings.set_value(
+                "anubis_shard_events_per_second",
+                "gauge",
+                labels,
+                stats.rate.per_second(),
+            )
+
+    def collect_log_stats(self):
+        dispatcher = self.log_dispatcher
+        self.timings.set_value("anubis_log_queue_depth", "gauge", {}, dispatcher.depth)
+        self.timings.set_value(
+            "anubis_log_queue_max_depth", "gauge", {}, dispatcher.max_depth
+        )
+        self.timings.set_value(
+            "anubis_log_dropped_total", "counter", {}, dispatcher.dropped_total
+        )
+        # Every channel that ever had a queue, so drained ones go back to 0.
+        for channel_id, queue in dispatcher.queues.items():
+            self.timings.set_value(
+                "anubis_log_channel_queue_depth",
+                "gauge",
+                {"channel": str(channel_id)},
+                len(queue),
+            )
+
+    async def start_command_timing(self, ctx: Context):
+        current_timing.set(Timing())
+
+    async def finish_command_timing(self, ctx: Context):
+        timing = current_timing.get()
+        if timing is None:
+            return
+        current_timing.set(None)
+        self.timings.record(
+            "anubis_command_seconds",
+            {
+                "command": ctx.command.qualified_name,
+                "cog": ctx.cog.qualified_name if ctx.cog else "",
+            },
+            timing,
+        )
+
+    async def flush_users(self):
+        """Periodically write buffered XP to the database."""
+        while True:
+            await asyncio.sleep(self.database.users.flush_interval)
+            await self.database.users.flush()
+
     async def get_context(self, message, *, cls=Context):
         return await super().get_context(message, cls=cls)
 
@@ -220,19 +440,90 @@ class Anubis(commands.Bot):
 
         return await to.send("", embed=embed, delete_after=delete_after)
 
+    async def resolve_users(
+        self, guild: discord.Guild, user_ids: typing.Iterable[int]
+    ) -> typing.Dict[int, typing.Union[discord.Member, discord.User]]:
+        """
+        Look up users by id, preferring the guild's members and the client cache over the
+        API. Anything not cached is fetched concurrently, a few requests at a time.
+        Users that could not be found are left out of the result.
+        """
+        resolved = {}
+        missing = []
+        not_fetched = object()
+        for user_id in user_ids:
+            user = guild.get_member(user_id) or self.get_user(user_id)
+            if not user:
+                user = self.fetched_users.get(user_id, not_fetched)
+                if user is not_fetched:
+                    missing.append(user_id)
+                    continue
+            if user:
+                resolved[user_id] = user
+
+        async def fetch(user_id: int):
+            async with self.fetch_limit:
+                try:
+                    user = await self.fetch_user(user_id)
+                except discord.NotFound:
+                    user = None
+                except discord.HTTPException as e:
+                    self.log.warning(f"Could not fetch user {user_id}: {e}")
+                    return
+            self.fetched_users.set(user_id, user)
+            if user:
+                resolved[user_id] = user
+
+        await asyncio.gather(*(fetch(user_id) for user_id in missing))
+        return resolved
+
     async def post_log(self, guild: discord.Guild, *args, **kwargs):
-        """Post a log entry to a guild, usage same as ctx.reply"""
-        configuration = self.database.guilds.get_settings(guild.id)
+        """
+        Queue a log entry for a guild's log channel, usage same as ctx.reply.
+        Entries are posted in batches by the log dispatcher, so delete_after is ignored.
+        """
+        configuration = await self.database.guilds.get_settings(guild.id)
         if not configuration:
             return
         channel = self.get_channel(configuration.log_channel)
         if channel:
-            await self.Context.reply(channel, *args, **kwargs)
+            self.log_dispatcher.submit(channel, self.log_embeds(*args, **kwargs))
+
+    @staticmethod
+    def log_embeds(
+        msg: str = None,
+        title: str = None,
+        subtitle: str = None,
+        color: Context.Color = Context.Color.GOOD,
+        embed: discord.Embed = None,
+        delete_after: float = None,
+        timestamp: datetime = None,
+    ) -> typing.List[discord.Embed]:
+        """Build the embeds ctx.reply would send for a log entry."""
+        if embed:
+            return [embed]
+        if timestamp is None:
+            timestamp = discord.utils.utcnow()
+
+        embeds = []
+        buf = ""
+        for line in str(msg).split("\n"):
+            if buf and len(buf + line) + 1 > 2048:
+                embeds.append(buf)
+                buf = ""
+            buf += line + "\n"
+        embeds.append(buf)
+        return [
+            discord.Embed(
+                color=color, description=description, title=title, timestamp=timestamp
+            ).set_footer(text=subtitle or None)
+            for description in embeds
+        ]
 
     @staticmethod
     def has_guild_manage_message_or_in_user_bot_channel():
         async def predicate(ctx: Anubis.Context):
-            guild = ctx.database.guilds.get_settings(ctx.guild.id)
+            guild = await ctx.database.guilds.get_settings(ctx.guild.id)
             return (
                 ctx.author.guild_permissions.manage_messages
                 or guild.user_channel == ctx.channel.id
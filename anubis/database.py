@@ -1,23 +1,100 @@
+import json
 import logging
 import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from copy import copy
+from math import inf
 from pathlib import Path
-from typing import List
+from queue import SimpleQueue
+from time import perf_counter
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple
 
+from anubis.caches import CooldownIndex, Generations
+from anubis.metrics import QueryStats
 from anubis.models import *
 
 
+def calling_method() -> str:
+    """Name the repository method that issued the statement being executed."""
+    frame = sys._getframe(1)
+    while frame:
+        code = frame.f_code
+        if code.co_filename == __file__ and code not in PLUMBING:
+            return getattr(code, "co_qualname", code.co_name)
+        frame = frame.f_back
+    return "unknown"
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Adds the time spent fetching rows to the statement that produced them."""
+
+    def fetchone(self):
+        start = perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self.connection.stats.record(
+                self.method, self.statement, perf_counter() - start, executed=False
+            )
+
+    def fetchall(self):
+        start = perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self.connection.stats.record(
+                self.method, self.statement, perf_counter() - start, executed=False
+            )
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    A connection that counts and times every statement it executes, grouped by the
+    repository method it was called from. An executemany counts as one statement.
+    """
+
+    stats: QueryStats
+
+    def execute(self, sql: str, parameters: Any = ()) -> InstrumentedCursor:
+        return self.instrumented(sqlite3.Cursor.execute, sql, parameters)
+
+    def executemany(self, sql: str, parameters: Any) -> InstrumentedCursor:
+        return self.instrumented(sqlite3.Cursor.executemany, sql, parameters)
+
+    def instrumented(self, execute, sql: str, parameters: Any) -> InstrumentedCursor:
+        cursor = self.cursor(InstrumentedCursor)
+        cursor.statement = sql
+        cursor.method = calling_method()
+        start = perf_counter()
+        try:
+            execute(cursor, sql, parameters)
+        finally:
+            self.stats.record(cursor.method, sql, perf_counter() - start)
+        return cursor
+
+
 class Database:
+    JOURNAL_MODES = ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF")
+    SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA")
+    TEMP_STORES = ("DEFAULT", "FILE", "MEMORY")
+
     def __init__(self, config):
         self.config = config
         self.log = logging.getLogger("anubis")
         self.log.setLevel(logging.INFO)
 
-        self.conn = sqlite3.connect(
-            config["database"]["path"],
-            isolation_level=None,
-            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
-        )
+        # Statement counts and timings of every connection, see the stats command.
+        self.query_stats = QueryStats()
+        self.instrument = config["database"].getboolean("instrument", fallback=True)
+        self.conn = self.connect(config["database"]["path"], isolation_level=None)
+        # Other processes can open the same file, but not the same in-memory database.
+        self.shared = config["database"]["path"] != ":memory:"
+        # Writes all go through this connection, one thread at a time.
+        self.lock = threading.RLock()
         self.conn.row_factory = sqlite3.Row
+        self.apply_pragmas()
         last_migration_number = 0
         try:
             last_migration_number = self.conn.execute(
@@ -39,54 +116,276 @@ class Database:
                 )
                 self.log.info(f"Applied migration {number}")
 
-        self.guilds = Guilds(self.conn)
+        # With a write-ahead log readers don't block the writer, so reads get read-only
+        # connections of their own. Waits are accounted per connection, the writer being 0.
+        self.readers: SimpleQueue[Tuple[int, sqlite3.Connection]] = SimpleQueue()
+        reader_count = 0
+        if (
+            self.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            and config["database"]["path"] != ":memory:"
+        ):
+            reader_count = config["database"].getint("readers", fallback=4)
+        for number in range(1, reader_count + 1):
+            self.readers.put((number, self.connect_reader()))
+        self.wait_times = [0.0] * (reader_count + 1)
+        self.acquisitions = [0] * (reader_count + 1)
+
+        self.guilds = Guilds(self.conn, self)
         self.users = Users(self.conn, self)
         self.rewards = Rewards(self.conn, self)
         self.ignored_channels = IgnoredChannels(self.conn, self)
         self.ignored_roles = IgnoredRoles(self.conn, self)
 
+    def connect(self, database: str, **kwargs) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            database,
+            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+            check_same_thread=False,
+            cached_statements=self.config["database"].getint(
+                "cached_statements", fallback=256
+            ),
+            factory=InstrumentedConnection if self.instrument else sqlite3.Connection,
+            **kwargs,
+        )
+        if self.instrument:
+            conn.stats = self.query_stats
+        return conn
+
+    def connect_reader(self) -> sqlite3.Connection:
+        conn = self.connect(
+            Path(self.config["database"]["path"]).absolute().as_uri() + "?mode=ro",
+            uri=True,
+        )
+        conn.row_factory = sqlite3.Row
+        self.apply_connection_pragmas(conn)
+        return conn
+
+    @contextmanager
+    def writing(self) -> Iterator[sqlite3.Connection]:
+        start = perf_counter()
+        with self.lock:
+            self.wait_times[0] += perf_counter() - start
+            self.acquisitions[0] += 1
+            yield self.conn
+
+    @contextmanager
+    def reading(self) -> Iterator[sqlite3.Connection]:
+        if not self.acquisitions[1:]:
+            with self.writing() as conn:
+                yield conn
+            return
+        start = perf_counter()
+        number, conn = self.readers.get()
+        self.wait_times[number] += perf_counter() - start
+        self.acquisitions[number] += 1
+        try:
+            yield conn
+        finally:
+            self.readers.put((number, conn))
+
+    @contextmanager
+    def batch(self) -> Iterator[sqlite3.Connection]:
+        """
+        Write everything done while this is held in one transaction, or nothing of it if an
+        error escapes. Only for repository methods that don't begin transactions of their own,
+        such as Users.grant_xp.
+        """
+        with self.writing() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                if conn.in_transaction:
+                    conn.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+
+    def close(self) -> None:
+        while not self.readers.empty():
+            self.readers.get()[1].close()
+        self.conn.close()
+
+    def query(self, sql: str, parameters: Any = ()) -> List[sqlite3.Row]:
+        with self.reading() as conn:
+            return conn.execute(sql, parameters).fetchall()
+
+    def query_one(self, sql: str, parameters: Any = ()) -> Optional[sqlite3.Row]:
+        with self.reading() as conn:
+            return conn.execute(sql, parameters).fetchone()
+
+    def apply_pragmas(self) -> None:
+        """Apply the tuning options of the [database] section to the writer connection."""
+        settings = self.config["database"]
+        journal_mode = settings.get("journal_mode", "WAL").upper()
+        synchronous = settings.get("synchronous", "NORMAL").upper()
+        if journal_mode not in self.JOURNAL_MODES:
+            raise ValueError(f"Unknown journal_mode {journal_mode}")
+        if synchronous not in self.SYNCHRONOUS_LEVELS:
+            raise ValueError(f"Unknown synchronous level {synchronous}")
+
+        self.conn.execute(f"PRAGMA journal_mode={journal_mode}")
+        self.conn.execute(f"PRAGMA synchronous={synchronous}")
+        self.apply_connection_pragmas(self.conn)
+
+        effective = {
+            pragma: self.conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+            for pragma in (
+                "journal_mode",
+                "synchronous",
+                "temp_store",
+                "cache_size",
+                "mmap_size",
+            )
+        }
+        effective["synchronous"] = self.SYNCHRONOUS_LEVELS[effective["synchronous"]]
+        effective["temp_store"] = self.TEMP_STORES[effective["temp_store"]]
+        effective["cached_statements"] = settings.getint(
+            "cached_statements", fallback=256
+        )
+        self.log.info(
+            "SQLite pragmas: "
+            + " ".join(f"{pragma}={value}" for pragma, value in effective.items())
+        )
+
+    def apply_connection_pragmas(self, conn: sqlite3.Connection) -> None:
+        """Apply the tuning options that SQLite keeps per connection rather than per file."""
+        settings = self.config["database"]
+        temp_store = settings.get("temp_store", "MEMORY").upper()
+        if temp_store not in self.TEMP_STORES:
+            raise ValueError(f"Unknown temp_store {temp_store}")
+
+        conn.execute(f"PRAGMA temp_store={temp_store}")
+        conn.execute(
+            f"PRAGMA cache_size={settings.getint('cache_size', fallback=-65536)}"
+        )
+        conn.execute(
+            f"PRAGMA mmap_size={settings.getint('mmap_size', fallback=268435456)}"
+        )
+
+
+# The functions between a repository method and the connection.
+PLUMBING = {
+    function.__code__
+    for function in (
+        InstrumentedConnection.execute,
+        InstrumentedConnection.executemany,
+        InstrumentedConnection.instrumented,
+        Database.query,
+        Database.query_one,
+    )
+}
+
 
 class Guilds:
-    def __init__(self, conn: sqlite3.Connection):
+    def __init__(self, conn: sqlite3.Connection, database: Database):
         self.conn = conn
+        self.database = database
+        # Settings are read several times per message but almost never change,
+        # so they are kept in memory and refreshed whenever save() writes them.
+        self.cache: Dict[int, Guild] = {}
+        self.generations = Generations()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def get_cached(self, guild_id: int) -> Optional[Guild]:
+        cached_guild = self.cache.get(guild_id)
+        if not cached_guild:
+            return None
+        self.cache_hits += 1
+        return copy(cached_guild)
 
     def get_settings(self, guild_id: int) -> Guild:
+        cached_guild = self.get_cached(guild_id)
+        if cached_guild:
+            return cached_guild
+        self.cache_misses += 1
+        generation = self.generations.of(guild_id)
         guild = None
         try:
-            guild = self.conn.execute(
+            guild = self.database.query_one(
                 "SELECT * FROM level_settings WHERE guild_id=:guild_id",
                 {"guild_id": guild_id},
-            ).fetchone()
+            )
         except sqlite3.DatabaseError:
             pass
         finally:
-            return (
-                Guild(
-                    guild["guild_id"],
-                    guild["text_time"],
-                    guild["base"],
-                    guild["modifier"],
-                    guild["amount"],
-                    guild["user_channel"],
-                    guild["log_channel"],
-                )
-                if guild
-                else None
+            if not guild:
+                return None
+            settings = Guild(
+                guild["guild_id"],
+                guild["text_time"],
+                guild["base"],
+                guild["modifier"],
+                guild["amount"],
+                guild["user_channel"],
+                guild["log_channel"],
             )
+            self.generations.store(self.cache, guild_id, generation, settings)
+            return copy(settings)
+
+    def invalidate(self, guild_id: int) -> None:
+        self.generations.invalidate(self.cache, guild_id)
 
     def save(self, guild: Guild) -> Guild:
-        retrieved_guild = self.get_settings(guild.id)
-        if retrieved_guild:
-            try:
-                self.conn.execute(
-                    "UPDATE level_settings "
-                    "SET text_time=:text_time,"
-                    "base=:base,"
-                    "modifier=:modifier,"
-                    "amount=:amount,"
-                    "user_channel=:user_channel,"
-                    "log_channel=:log_channel "
-                    "WHERE guild_id=:guild_id",
+        saved_guild = None
+        try:
+            saved_guild = self.conn.execute(
+                "INSERT INTO level_settings (guild_id, text_time, base, modifier, amount, user_channel, "
+                "log_channel) VALUES(:guild_id,:text_time,:base,:modifier,:amount,:user_channel,:log_channel) "
+                "ON CONFLICT(guild_id) DO UPDATE "
+                "SET text_time=excluded.text_time,"
+                "base=excluded.base,"
+                "modifier=excluded.modifier,"
+                "amount=excluded.amount,"
+                "user_channel=excluded.user_channel,"
+                "log_channel=excluded.log_channel "
+                "RETURNING *",
+                {
+                    "text_time": guild.get_text_timeout(),
+                    "base": guild.base,
+                    "modifier": guild.modifier,
+                    "amount": guild.reward_amount,
+                    "user_channel": guild.user_channel,
+                    "log_channel": guild.log_channel,
+                    "guild_id": guild.id,
+                },
+            ).fetchone()
+        except sqlite3.DatabaseError:
+            pass
+        self.invalidate(guild.id)
+        if not saved_guild:
+            return None
+        self.cache[guild.id] = Guild(
+            saved_guild["guild_id"],
+            saved_guild["text_time"],
+            saved_guild["base"],
+            saved_guild["modifier"],
+            saved_guild["amount"],
+            saved_guild["user_channel"],
+            saved_guild["log_channel"],
+        )
+        return copy(self.cache[guild.id])
+
+    def ensure_defaults(self, guild_ids: Iterable[int]) -> int:
+        """Give every guild without settings the default ones and return how many were missing."""
+        try:
+            missing = [
+                Guild.default(row["value"])
+                for row in self.conn.execute(
+                    "SELECT DISTINCT value FROM json_each(:guild_ids) "
+                    "WHERE value NOT IN (SELECT guild_id FROM level_settings)",
+                    {"guild_ids": json.dumps(list(guild_ids))},
+                )
+            ]
+            if not missing:
+                return 0
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT INTO level_settings (guild_id, text_time, base, modifier, amount, user_channel, "
+                "log_channel) VALUES(:guild_id,:text_time,:base,:modifier,:amount,:user_channel,:log_channel) "
+                "ON CONFLICT(guild_id) DO NOTHING",
+                [
                     {
                         "text_time": guild.get_text_timeout(),
                         "base": guild.base,
@@ -95,68 +394,95 @@ class Guilds:
                         "user_channel": guild.user_channel,
                         "log_channel": guild.log_channel,
                         "guild_id": guild.id,
-                    },
-                )
-                self.conn.commit()
-            except sqlite3.DatabaseError:
-                pass
-        else:
-            try:
-                values = (
-                    guild.id,
-                    guild.get_text_timeout(),
-                    guild.base,
-                    guild.modifier,
-                    guild.reward_amount,
-                    guild.user_channel,
-                    guild.log_channel,
-                )
-                sql = (
-                    "INSERT INTO level_settings (guild_id, text_time, base, modifier, amount, user_channel, "
-                    "log_channel) VALUES(?,?,?,?,?,?,?)"
-                )
-                self.conn.execute(sql, values)
-                self.conn.commit()
-            except sqlite3.DatabaseError:
-                pass
-        return self.get_settings(guild.id)
+                    }
+                    for guild in missing
+                ],
+            )
+            self.conn.execute("COMMIT")
+        except sqlite3.DatabaseError as e:
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK")
+            self.database.log.error(f"Could not provision guild settings: {e}")
+            return 0
+        for guild in missing:
+            self.cache[guild.id] = guild
+        return len(missing)
 
 
 class Users:
+    UPSERT = (
+        "INSERT INTO user_levels (guild_id, user_id, xp, timeout, ignore_xp_gain) "
+        "VALUES(:guild_id,:user_id,:xp,:timeout,:ignore_xp_gain) "
+        "ON CONFLICT(guild_id, user_id) DO UPDATE "
+        "SET xp=excluded.xp,"
+        "timeout=excluded.timeout,"
+        "ignore_xp_gain=excluded.ignore_xp_gain"
+    )
+
     def __init__(self, conn: sqlite3.Connection, database: Database):
         self.conn = conn
         self.database = database
+        # In write-behind mode save() only records the user here and flush()
+        # writes all of them at once, every flush_interval seconds or as soon
+        # as flush_threshold users are waiting.
+        settings = database.config["database"]
+        self.write_behind = settings.getboolean("write_behind", fallback=False)
+        self.flush_interval = settings.getfloat("flush_interval", fallback=10.0)
+        self.flush_threshold = settings.getint("flush_threshold", fallback=500)
+        self.dirty: Dict[Tuple[int, int], User] = {}
+        # Filled in as users are read and saved, so messages from users that are still on
+        # cooldown (or ignored) can be dropped without a query.
+        self.cooldowns = CooldownIndex()
+
+    def on_cooldown(self, user_id: int, guild_id: int, now: datetime) -> bool:
+        return self.cooldowns.on_cooldown(guild_id, user_id, now.timestamp())
+
+    def invalidate(self, user_id: int, guild_id: int) -> None:
+        """Forget what is cached about a user, for when another process changed them."""
+        self.cooldowns.forget(guild_id, user_id)
+
+    def remember_cooldown(self, user: User) -> None:
+        self.cooldowns.set(
+            user.guild.id,
+            user.id,
+            inf if user.ignore_xp_gain else user.timeout.timestamp(),
+        )
 
     def get(self, user_id: int, guild_id: int) -> User:
+        buffered_user = self.dirty.get((guild_id, user_id))
+        if buffered_user:
+            user = copy(buffered_user)
+            user.guild = self.database.guilds.get_settings(guild_id)
+            return user
         user = None
         try:
-            user = self.conn.execute(
+            user = self.database.query_one(
                 "SELECT * FROM user_levels WHERE user_id=:user_id AND guild_id=:guild_id",
                 {"user_id": user_id, "guild_id": guild_id},
-            ).fetchone()
+            )
         except sqlite3.DatabaseError:
             pass
-        finally:
-            return (
-                User(
-                    user["user_id"],
-                    self.database.guilds.get_settings(user["guild_id"]),
-                    user["xp"],
-                    user["timeout"].replace(tzinfo=timezone.utc),
-                    bool(user["ignore_xp_gain"]),
-                )
-                if user
-                else None
-            )
+        if not user:
+            return None
+        retrieved_user = User(
+            user["user_id"],
+            self.database.guilds.get_settings(user["guild_id"]),
+            user["xp"],
+            user["timeout"].replace(tzinfo=timezone.utc),
+            bool(user["ignore_xp_gain"]),
+        )
+        self.remember_cooldown(retrieved_user)
+        return retrieved_user
 
     def get_all_ignored(self, guild_id: int) -> List[User]:
+        self.flush()
         users = None
         guild = self.database.guilds.get_settings(guild_id)
         try:
-            users = self.conn.execute(
+            users = self.database.query(
                 "SELECT * FROM user_levels WHERE guild_id=:guild_id AND ignore_xp_gain=:ignore_xp_gain",
                 {"guild_id": guild_id, "ignore_xp_gain": True},
-            ).fetchall()
+            )
         except sqlite3.DatabaseError:
             pass
         finally:
@@ -171,53 +497,240 @@ class Users:
                 for user in users
             ]
 
+    @staticmethod
+    def to_parameters(user: User) -> dict:
+        return {
+            "xp": user.xp,
+            "timeout": user.timeout,
+            "ignore_xp_gain": user.ignore_xp_gain,
+            "user_id": user.id,
+            "guild_id": user.guild.id,
+        }
+
     def save(self, user: User) -> User:
-        retrieved_user = self.get(user.id, user.guild.id)
-        if retrieved_user:
+        self.remember_cooldown(user)
+        if self.write_behind:
+            self.dirty[(user.guild.id, user.id)] = copy(user)
+            if len(self.dirty) >= self.flush_threshold:
+                self.flush()
+            return copy(user)
+        saved_user = None
+        try:
+            saved_user = self.conn.execute(
+                self.UPSERT + " RETURNING *", self.to_parameters(user)
+            ).fetchone()
+        except sqlite3.DatabaseError:
+            pass
+        return (
+            User(
+                saved_user["user_id"],
+                user.guild,
+                saved_user["xp"],
+                saved_user["timeout"].replace(tzinfo=timezone.utc),
+                bool(saved_user["ignore_xp_gain"]),
+            )
+            if saved_user
+            else None
+        )
+
+    def grant_xp(
+        self, user_id: int, guild_id: int, now: datetime
+    ) -> Optional[Tuple[int, User]]:
+        """
+        Give a user their guild's reward amount of XP and start their cooldown, unless they
+        are still on cooldown or ignored. Users seen for the first time are created without XP.
+        The check and the increment happen in a single statement, so concurrent messages can't
+        lose XP. Returns the XP the user had before and the updated user, or None.
+        """
+        guild = self.database.guilds.get_settings(guild_id)
+        if self.write_behind:
+            # Buffered users are only ever changed on the writer thread, which this runs on.
+            user = self.get(user_id, guild_id)
+            if not user:
+                self.save(User(user_id, guild, 0, now, False))
+                return None
+            if user.ignore_xp_gain or user.timeout >= now:
+                return None
+            previous_xp = user.xp
+            user.xp += guild.reward_amount
+            user.timeout = now + guild.text_timeout
+            return previous_xp, self.save(user)
+
+        granted_user = None
+        try:
+            granted_user = self.conn.execute(
+                "UPDATE user_levels SET xp=xp + :amount, timeout=:timeout "
+                "WHERE guild_id=:guild_id AND user_id=:user_id "
+                "AND timeout < :now AND NOT ignore_xp_gain "
+                "RETURNING *",
+                {
+                    "amount": guild.reward_amount,
+                    "timeout": now + guild.text_timeout,
+                    "now": now,
+                    "guild_id": guild_id,
+                    "user_id": user_id,
+                },
+            ).fetchone()
+            if not granted_user:
+                created_user = self.conn.execute(
+                    "INSERT INTO user_levels (guild_id, user_id, xp, timeout, ignore_xp_gain) "
+                    "VALUES(:guild_id,:user_id,0,:now,FALSE) "
+                    "ON CONFLICT(guild_id, user_id) DO NOTHING RETURNING *",
+                    {"guild_id": guild_id, "user_id": user_id, "now": now},
+                ).fetchone()
+                if created_user:
+                    self.remember_cooldown(User(user_id, guild, 0, now, False))
+                else:
+                    # On cooldown or ignored without us knowing, get() will remember which.
+                    self.get(user_id, guild_id)
+                return None
+        except sqlite3.DatabaseError:
+            return None
+        user = User(
+            granted_user["user_id"],
+            guild,
+            granted_user["xp"],
+            granted_user["timeout"].replace(tzinfo=timezone.utc),
+            bool(granted_user["ignore_xp_gain"]),
+        )
+        self.remember_cooldown(user)
+        return user.xp - guild.reward_amount, user
+
+    def adjust_xp(
+        self, user_id: int, guild_id: int, amount: Optional[int]
+    ) -> Optional[Tuple[int, User]]:
+        """
+        Add amount XP to a user, or take it away if it is negative, without going below 0.
+        An amount of None takes away all of their XP. Returns the XP the user had before and
+        the updated user, or None if the user doesn't exist.
+        """
+        if self.write_behind:
+            user = self.get(user_id, guild_id)
+            if not user:
+                return None
+            previous_xp = user.xp
+            user.xp = 0 if amount is None else max(user.xp + amount, 0)
+            return previous_xp, self.save(user)
+
+        parameters = {"amount": amount, "guild_id": guild_id, "user_id": user_id}
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+            previous = self.conn.execute(
+                "SELECT xp FROM user_levels WHERE guild_id=:guild_id AND user_id=:user_id",
+                parameters,
+            ).fetchone()
+            adjusted_user = self.conn.execute(
+                "UPDATE user_levels SET xp=CASE WHEN :amount IS NULL THEN 0 "
+                "ELSE MAX(xp + :amount, 0) END "
+                "WHERE guild_id=:guild_id AND user_id=:user_id "
+                "RETURNING *",
+                parameters,
+            ).fetchone()
+            self.conn.execute("COMMIT")
+        except sqlite3.DatabaseError:
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK")
+            return None
+        if not adjusted_user:
+            return None
+        user = User(
+            adjusted_user["user_id"],
+            self.database.guilds.get_settings(guild_id),
+            adjusted_user["xp"],
+            adjusted_user["timeout"].replace(tzinfo=timezone.utc),
+            bool(adjusted_user["ignore_xp_gain"]),
+        )
+        return previous["xp"], user
+
+    def adjust_xp_many(
+        self, user_ids: Iterable[int], guild_id: int, amount: Optional[int]
+    ) -> Tuple[int, int]:
+        """
+        adjust_xp for many users of a guild in one transaction. Returns how many of them exist
+        and by how much their XP changed in total; users that don't exist are skipped.
+        """
+        # The update goes straight to the table, so nothing buffered may be written after it.
+        self.flush()
+        user_ids = list(set(user_ids))
+        totals = (
+            "SELECT COUNT(*), COALESCE(SUM(xp), 0) FROM user_levels "
+            "WHERE guild_id=:guild_id AND user_id IN (SELECT value FROM json_each(:user_ids))"
+        )
+        parameters = {"guild_id": guild_id, "user_ids": json.dumps(user_ids)}
+        with self.database.writing():
             try:
-                self.conn.execute(
-                    "UPDATE user_levels "
-                    "SET xp=:xp,"
-                    "timeout=:timeout,"
-                    "ignore_xp_gain=:ignore_xp_gain "
-                    "WHERE user_id=:user_id "
-                    "AND guild_id=:guild_id",
-                    {
-                        "xp": user.xp,
-                        "timeout": user.timeout,
-                        "ignore_xp_gain": user.ignore_xp_gain,
-                        "user_id": user.id,
-                        "guild_id": user.guild.id,
-                    },
+                self.conn.execute("BEGIN IMMEDIATE")
+                found, previous_xp = self.conn.execute(totals, parameters).fetchone()
+                self.conn.executemany(
+                    "UPDATE user_levels SET xp=CASE WHEN :amount IS NULL THEN 0 "
+                    "ELSE MAX(xp + :amount, 0) END "
+                    "WHERE guild_id=:guild_id AND user_id=:user_id",
+                    [
+                        {"amount": amount, "guild_id": guild_id, "user_id": user_id}
+                        for user_id in user_ids
+                    ],
                 )
-            except sqlite3.DatabaseError:
-                pass
-        else:
-            try:
-                values = (
-                    user.guild.id,
-                    user.id,
-                    user.xp,
-                    user.timeout,
-                    user.ignore_xp_gain,
+                _, xp = self.conn.execute(totals, parameters).fetchone()
+                self.conn.execute("COMMIT")
+            except sqlite3.DatabaseError as e:
+                if self.conn.in_transaction:
+                    self.conn.execute("ROLLBACK")
+                self.database.log.error(
+                    f"Could not adjust the XP of {len(user_ids)} users: {e}"
                 )
-                sql = (
-                    "INSERT INTO user_levels (guild_id, user_id, xp, timeout, ignore_xp_gain) "
-                    "VALUES(?,?,?,?,?)"
+                return 0, 0
+        return found, xp - previous_xp
+
+    def flush(self) -> int:
+        """Write all buffered users in one transaction and return how many."""
+        if not self.dirty:
+            return 0
+        with self.database.writing():
+            pending = list(self.dirty.items())
+            try:
+                self.conn.execute("BEGIN")
+                self.conn.executemany(
+                    self.UPSERT, [self.to_parameters(user) for _, user in pending]
                 )
-                self.conn.execute(sql, values)
-                self.conn.commit()
-            except sqlite3.DatabaseError:
-                pass
-        return self.get(user.id, user.guild.id)
+                self.conn.execute("COMMIT")
+            except sqlite3.DatabaseError as e:
+                if self.conn.in_transaction:
+                    self.conn.execute("ROLLBACK")
+                self.database.log.error(f"Could not flush {len(pending)} users: {e}")
+                return 0
+        # Anything saved again while we were writing stays buffered for the next flush.
+        for key, user in pending:
+            if self.dirty.get(key) is user:
+                del self.dirty[key]
+        return len(pending)
 
-    def get_ranked_users(self, guild_id: int) -> List[User]:
-        users = self.conn.execute(
-            "SELECT * FROM user_levels WHERE guild_id=:guild_id ORDER BY xp DESC",
-            {"guild_id": guild_id},
-        ).fetchall()
+    def get_ranked_users(self, guild_id: int) -> RankedUsers:
+        self.flush()
+        ranked_users = RankedUsers(self.database.guilds.get_settings(guild_id))
+        with self.database.reading() as conn:
+            # Letting SQLite turn the timeouts into POSIX timestamps is much cheaper than
+            # parsing a datetime per row, and they are stored as timestamps anyway.
+            cursor = conn.execute(
+                "SELECT user_id, xp, (julianday(timeout) - 2440587.5) * 86400.0, "
+                "ignore_xp_gain FROM user_levels "
+                "WHERE guild_id=:guild_id ORDER BY xp DESC",
+                {"guild_id": guild_id},
+            )
+            # Plain tuples, the rows go straight into the columns.
+            cursor.row_factory = None
+            for user_id, xp, timeout, ignore_xp_gain in cursor:
+                ranked_users.append(user_id, xp, timeout, ignore_xp_gain)
+        return ranked_users
+
+    def get_ranked_page(self, guild_id: int, limit: int, offset: int = 0) -> List[User]:
+        self.flush()
+        users = self.database.query(
+            "SELECT * FROM user_levels WHERE guild_id=:guild_id "
+            "ORDER BY xp DESC, user_id LIMIT :limit OFFSET :offset",
+            {"guild_id": guild_id, "limit": limit, "offset": offset},
+        )
         guild = self.database.guilds.get_settings(guild_id)
-        objectified_users: List[User] = [
+        return [
             User(
                 user["user_id"],
                 guild,
@@ -227,21 +740,63 @@ class Users:
             )
             for user in users
         ]
-        return objectified_users
+
+    def count(self, guild_id: int) -> int:
+        self.flush()
+        return self.database.query_one(
+            "SELECT COUNT(*) FROM user_levels WHERE guild_id=:guild_id",
+            {"guild_id": guild_id},
+        )[0]
+
+    def get_rank(self, user: User) -> int:
+        """Return the zero-based position of the user in get_ranked_page order."""
+        self.flush()
+        return self.database.query_one(
+            "SELECT (SELECT COUNT(*) FROM user_levels WHERE guild_id=:guild_id AND xp > :xp) + "
+            "(SELECT COUNT(*) FROM user_levels WHERE guild_id=:guild_id AND xp = :xp AND user_id < :user_id)",
+            {"guild_id": user.guild.id, "xp": user.xp, "user_id": user.id},
+        )[0]
 
 
 class Rewards:
     def __init__(self, conn: sqlite3.Connection, database: Database):
         self.conn = conn
         self.database = database
+        self.index: Dict[int, RewardIndex] = {}
+        self.generations = Generations()
+
+    def get_cached(self, guild_id: int) -> Optional[RewardIndex]:
+        return self.index.get(guild_id)
+
+    def invalidate(self, guild_id: int) -> None:
+        self.generations.invalidate(self.index, guild_id)
+
+    def get_index(self, guild_id: int) -> RewardIndex:
+        index = self.index.get(guild_id)
+        if index is None:
+            generation = self.generations.of(guild_id)
+            try:
+                rewards = self.database.query(
+                    "SELECT reward_level, reward_role FROM rewards WHERE guild_id=:guild_id "
+                    "ORDER BY reward_level",
+                    {"guild_id": guild_id},
+                )
+            except sqlite3.DatabaseError:
+                return RewardIndex((), ())
+            index = RewardIndex(
+                tuple(reward["reward_level"] for reward in rewards),
+                tuple(reward["reward_role"] for reward in rewards),
+            )
+            self.generations.store(self.index, guild_id, generation, index)
+        return index
 
     def get(self, guild_id: int, role_id: int) -> Reward:
         reward = None
         try:
-            reward = self.conn.execute(
+            reward = self.database.query_one(
                 "SELECT * FROM rewards WHERE guild_id=:guild_id AND reward_role=:reward_role",
                 {"guild_id": guild_id, "reward_role": role_id},
-            ).fetchone()
+            )
         except sqlite3.DatabaseError:
             pass
         finally:
@@ -258,9 +813,9 @@ class Rewards:
     def get_all(self, guild_id: int) -> List[Reward]:
         rewards = []
         try:
-            rewards = self.conn.execute(
+            rewards = self.database.query(
                 "SELECT * FROM rewards WHERE guild_id=:guild_id", {"guild_id": guild_id}
-            ).fetchall()
+            )
         except sqlite3.DatabaseError:
             pass
         finally:
@@ -271,31 +826,30 @@ class Rewards:
             ]
 
     def save(self, reward: Reward) -> Reward:
-        retrieved_reward = self.get(reward.guild.id, reward.role)
-        if retrieved_reward:
-            try:
-                self.conn.execute(
-                    "UPDATE rewards SET "
-                    "reward_level=:reward_level "
-                    "WHERE guild_id=:guild_id AND reward_role=:reward_role ",
-                    {
-                        "reward_level": reward.level,
-                        "guild_id": reward.guild.id,
-                        "reward_role": reward.role,
-                    },
-                )
-                self.conn.commit()
-            except sqlite3.DatabaseError:
-                pass
-        else:
-            try:
-                values = (reward.guild.id, reward.role, reward.level)
-                sql = "INSERT INTO rewards (guild_id, reward_role, reward_level) VALUES(?,?,?)"
-                self.conn.execute(sql, values)
-                self.conn.commit()
-            except sqlite3.DatabaseError:
-                pass
-        return self.get(reward.guild.id, reward.role)
+        saved_reward = None
+        try:
+            saved_reward = self.conn.execute(
+                "INSERT INTO rewards (guild_id, reward_role, reward_level) "
+                "VALUES(:guild_id,:reward_role,:reward_level) "
+                "ON CONFLICT(guild_id, reward_role) DO UPDATE "
+                "SET reward_level=excluded.reward_level "
+                "RETURNING *",
+                {
+                    "reward_level": reward.level,
+                    "guild_id": reward.guild.id,
+                    "reward_role": reward.role,
+                },
+            ).fetchone()
+        except sqlite3.DatabaseError:
+            pass
+        self.invalidate(reward.guild.id)
+        return (
+            Reward(
+                reward.guild, saved_reward["reward_role"], saved_reward["reward_level"]
+            )
+            if saved_reward
+            else None
+        )
 
     def delete(self, guild_id: int, role_id: int) -> None:
         try:
@@ -306,19 +860,45 @@ class Rewards:
             self.conn.commit()
         except sqlite3.DatabaseError:
             pass
+        self.invalidate(guild_id)
 
 
 class IgnoredChannels:
     def __init__(self, conn: sqlite3.Connection, database: Database):
         self.conn = conn
         self.database = database
+        self.index: Dict[int, FrozenSet[int]] = {}
+        self.generations = Generations()
+
+    def get_cached(self, guild_id: int) -> Optional[FrozenSet[int]]:
+        return self.index.get(guild_id)
+
+    def invalidate(self, guild_id: int) -> None:
+        self.generations.invalidate(self.index, guild_id)
+
+    def get_ids(self, guild_id: int) -> FrozenSet[int]:
+        ids = self.index.get(guild_id)
+        if ids is None:
+            generation = self.generations.of(guild_id)
+            try:
+                ids = frozenset(
+                    row["channel_id"]
+                    for row in self.database.query(
+                        "SELECT channel_id FROM ignored_channels WHERE guild_id=:guild_id",
+                        {"guild_id": guild_id},
+                    )
+                )
+            except sqlite3.DatabaseError:
+                return frozenset()
+            self.generations.store(self.index, guild_id, generation, ids)
+        return ids
 
     def get(self, channel_id: int, guild_id: int) -> IgnoredChannel:
         try:
-            ignored_channel = self.conn.execute(
+            ignored_channel = self.database.query_one(
                 "SELECT * FROM ignored_channels WHERE channel_id=:channel_id AND guild_id=:guild_id",
                 {"channel_id": channel_id, "guild_id": guild_id},
-            ).fetchone()
+            )
             guild = self.database.guilds.get_settings(guild_id)
             return (
                 IgnoredChannel(guild, ignored_channel["channel_id"])
@@ -330,10 +910,10 @@ class IgnoredChannels:
 
     def get_all(self, guild_id: int) -> List[IgnoredChannel]:
         try:
-            ignored_channels = self.conn.execute(
+            ignored_channels = self.database.query(
                 "SELECT * FROM ignored_channels WHERE guild_id=:guild_id",
                 {"guild_id": guild_id},
-            ).fetchall()
+            )
             guild = self.database.guilds.get_settings(guild_id)
             return [
                 IgnoredChannel(guild, channel["channel_id"])
@@ -343,18 +923,25 @@ class IgnoredChannels:
             pass
 
     def save(self, ignored_channel: IgnoredChannel) -> IgnoredChannel:
-        retrieved_ignored_channel = self.get(
-            ignored_channel.channel, ignored_channel.guild.id
+        saved_ignored_channel = None
+        try:
+            saved_ignored_channel = self.conn.execute(
+                "INSERT INTO ignored_channels(guild_id, channel_id) VALUES(:guild_id,:channel_id) "
+                "ON CONFLICT(guild_id, channel_id) DO UPDATE SET channel_id=excluded.channel_id "
+                "RETURNING *",
+                {
+                    "guild_id": ignored_channel.guild.id,
+                    "channel_id": ignored_channel.channel,
+                },
+            ).fetchone()
+        except sqlite3.DatabaseError:
+            pass
+        self.invalidate(ignored_channel.guild.id)
+        return (
+            IgnoredChannel(ignored_channel.guild, saved_ignored_channel["channel_id"])
+            if saved_ignored_channel
+            else None
         )
-        if not retrieved_ignored_channel:
-            try:
-                values = (ignored_channel.guild.id, ignored_channel.channel)
-                sql = "INSERT INTO ignored_channels(guild_id, channel_id) VALUES(?,?)"
-                self.conn.execute(sql, values)
-                self.conn.commit()
-            except sqlite3.DatabaseError:
-                pass
-        return self.get(ignored_channel.channel, ignored_channel.guild.id)
 
     def delete(self, channel_id: int, guild_id: int) -> None:
         try:
@@ -365,19 +952,45 @@ class IgnoredChannels:
             self.conn.commit()
         except sqlite3.DatabaseError:
             pass
+        self.invalidate(guild_id)
 
 
 class IgnoredRoles:
     def __init__(self, conn: sqlite3.Connection, database: Database):
         self.conn = conn
         self.database = database
+        self.index: Dict[int, FrozenSet[int]] = {}
+        self.generations = Generations()
+
+    def get_cached(self, guild_id: int) -> Optional[FrozenSet[int]]:
+        return self.index.get(guild_id)
+
+    def invalidate(self, guild_id: int) -> None:
+        self.generations.invalidate(self.index, guild_id)
+
+    def get_ids(self, guild_id: int) -> FrozenSet[int]:
+        ids = self.index.get(guild_id)
+        if ids is None:
+            generation = self.generations.of(guild_id)
+            try:
+                ids = frozenset(
+                    row["role_id"]
+                    for row in self.database.query(
+                        "SELECT role_id FROM ignored_roles WHERE guild_id=:guild_id",
+                        {"guild_id": guild_id},
+                    )
+                )
+            except sqlite3.DatabaseError:
+                return frozenset()
+            self.generations.store(self.index, guild_id, generation, ids)
+        return ids
 
     def get(self, role_id: int, guild_id: int) -> IgnoredRole:
         try:
-            ignored_role = self.conn.execute(
+            ignored_role = self.database.query_one(
                 "SELECT * FROM ignored_roles WHERE role_id=:role_id AND guild_id=:guild_id",
-                {"roll_id": role_id, "guild_id": guild_id},
-            ).fetchone()
+                {"role_id": role_id, "guild_id": guild_id},
+            )
             guild = self.database.guilds.get_settings(guild_id)
             return IgnoredRole(guild, ignored_role["role_id"]) if ignored_role else None
         except sqlite3.DatabaseError:
@@ -385,26 +998,32 @@ class IgnoredRoles:
 
     def get_all(self, guild_id: int) -> List[IgnoredRole]:
         try:
-            ignored_roles = self.conn.execute(
+            ignored_roles = self.database.query(
                 "SELECT * FROM ignored_roles WHERE guild_id=:guild_id",
                 {"guild_id": guild_id},
-            ).fetchall()
+            )
             guild = self.database.guilds.get_settings(guild_id)
             return [IgnoredRole(guild, role["role_id"]) for role in ignored_roles]
         except sqlite3.DatabaseError:
             pass
 
     def save(self, ignored_role: IgnoredRole) -> IgnoredRole:
-        retrieved_ignored_role = self.get(ignored_role.role, ignored_role.guild.id)
-        if not retrieved_ignored_role:
-            try:
-                values = (ignored_role.guild.id, ignored_role.role)
-                sql = "INSERT INTO ignored_roles(guild_id, role_id) VALUES(?,?)"
-                self.conn.execute(sql, values)
-                self.conn.commit()
-            except sqlite3.DatabaseError:
-                pass
-        return self.get(ignored_role.role, ignored_role.guild.id)
+        saved_ignored_role = None
+        try:
+            saved_ignored_role = self.conn.execute(
+                "INSERT INTO ignored_roles(guild_id, role_id) VALUES(:guild_id,:role_id) "
+                "ON CONFLICT(guild_id, role_id) DO UPDATE SET role_id=excluded.role_id "
+                "RETURNING *",
+                {"guild_id": ignored_role.guild.id, "role_id": ignored_role.role},
+            ).fetchone()
+        except sqlite3.DatabaseError:
+            pass
+        self.invalidate(ignored_role.guild.id)
+        return (
+            IgnoredRole(ignored_role.guild, saved_ignored_role["role_id"])
+            if saved_ignored_role
+            else None
+        )
 
     def delete(self, role_id: int, guild_id: int) -> None:
         try:
@@ -415,3 +1034,4 @@ class IgnoredRoles:
             self.conn.commit()
         except sqlite3.DatabaseError:
             pass
+        self.invalidate(guild_id)
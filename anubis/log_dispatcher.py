@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import discord
+
+from anubis.metrics import current_timing
+
+
+class LogDispatcher:
+    """
+    Queues log embeds per log channel and posts them in batches, so a burst of level ups or
+    moderation actions turns into a few messages of up to ten embeds instead of one message each.
+    Each channel is drained by its own task, which only sends its next message once Discord has
+    accepted the previous one. When a queue is full new entries are dropped and counted, and the
+    next message mentions how many were lost. Descriptions over Discord's limit are split over
+    several embeds before they are queued.
+    """
+
+    # Discord's limits for a single message and the description of one embed.
+    MAX_EMBEDS = 10
+    MAX_CHARACTERS = 6000
+    MAX_DESCRIPTION = 4096
+
+    def __init__(self, log: logging.Logger, window: float = 2.0, queue_size: int = 100):
+        self.log = log
+        self.window = window
+        self.queue_size = queue_size
+        self.queues: Dict[int, Deque[discord.Embed]] = {}
+        self.workers: Dict[int, asyncio.Task] = {}
+        self.dropped: Dict[int, int] = {}
+        self.dropped_total = 0
+        self.sent_messages = 0
+        self.sent_embeds = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self) -> int:
+        """How many embeds are waiting across all channels."""
+        return sum(len(queue) for queue in self.queues.values())
+
+    def depths(self) -> Dict[int, int]:
+        """How many embeds are waiting per channel id."""
+        return {
+            channel_id: len(queue) for channel_id, queue in self.queues.items() if queue
+        }
+
+    @classmethod
+    def split(cls, embed: discord.Embed) -> List[discord.Embed]:
+        """Split an embed whose description is too long for Discord into ones that fit."""
+        description = embed.description or ""
+        if len(description) <= cls.MAX_DESCRIPTION:
+            return [embed]
+        parts = []
+        while description:
+            # Cut at the last line break that fits, or mid-line if a single line is too long.
+            cut = description.rfind("\n", 0, cls.MAX_DESCRIPTION + 1)
+            if cut <= 0:
+                cut = cls.MAX_DESCRIPTION
+            part = embed.copy()
+            part.description = description[:cut]
+            parts.append(part)
+            description = description[cut:].lstrip("\n")
+        return parts
+
+    def submit(
+        self, channel: discord.abc.Messageable, embeds: List[discord.Embed]
+    ) -> None:
+        queue = self.queues.setdefault(channel.id, deque())
+        embeds = [part for embed in embeds for part in self.split(embed)]
+        for embed in embeds:
+            if len(queue) < self.queue_size:
+                queue.append(embed)
+            else:
+                self.dropped[channel.id] = self.dropped.get(channel.id, 0) + 1
+                self.dropped_total += 1
+        self.max_depth = max(self.max_depth, len(queue))
+        if channel.id not in self.workers:
+            self.workers[channel.id] = asyncio.create_task(self.drain(channel))
+
+    def next_batch(self, channel_id: int) -> List[discord.Embed]:
+        """Take as many queued embeds as fit into one message."""
+        queue = self.queues[channel_id]
+        batch = []
+        characters = 0
+        while queue and len(batch) < self.MAX_EMBEDS:
+            if batch and characters + len(queue[0]) > self.MAX_CHARACTERS:
+                break
+            characters += len(queue[0])
+            batch.append(queue.popleft())
+        return batch
+
+    async def send(self, channel: discord.abc.Messageable, batch: List[discord.Embed]):
+        dropped = self.dropped.pop(channel.id, 0)
+        content: Optional[str] = None
+        if dropped:
+            content = (
+                f"{dropped} log entries were dropped because too many came in at once."
+            )
+        try:
+            await channel.send(content, embeds=batch)
+        except discord.HTTPException as e:
+            self.log.warning(
+                f"Could not post {len(batch)} log entries to channel {channel.id}: {e}"
+            )
+            return
+        self.sent_messages += 1
+        self.sent_embeds += len(batch)
+
+    async def drain(self, channel: discord.abc.Messageable):
+        """Post everything queued for a channel, then stop until more is submitted."""
+        # This task outlives the command or listener that started it, don't bill its time to them.
+        current_timing.set(None)
+        try:
+            while self.queues[channel.id] or self.dropped.get(channel.id):
+                # Give the rest of a burst a moment to arrive so it shares a message.
+                await asyncio.sleep(self.window)
+                await self.send(channel, self.next_batch(channel.id))
+        finally:
+            self.workers.pop(channel.id, None)
+
+    async def close(self):
+        """Stop waiting for bursts and post whatever is still queued."""
+        self.window = 0
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
@@ -0,0 +1,417 @@
+import logging
+import threading
+from array import array
+from contextlib import contextmanager
+from copy import copy
+from datetime import datetime, timezone
+from math import inf
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
+
+from anubis.caches import CooldownIndex
+from anubis.metrics import QueryStats
+from anubis.models import *
+
+
+class MemoryDatabase:
+    """
+    A backend that keeps everything in dicts and arrays and forgets it all when the bot stops.
+    Meant for tests and benchmarks, where it takes SQLite out of the picture.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.log = logging.getLogger("anubis")
+        self.log.setLevel(logging.INFO)
+        # Nothing is executed, so there are never any statements to show.
+        self.query_stats = QueryStats()
+        self.shared = False
+        # Reads take it too, the reader threads would otherwise see half-made changes.
+        self.lock = threading.RLock()
+
+        self.guilds = MemoryGuilds(self)
+        self.users = MemoryUsers(self)
+        self.rewards = MemoryRewards(self)
+        self.ignored_channels = MemoryIgnoredChannels(self)
+        self.ignored_roles = MemoryIgnoredRoles(self)
+
+    @contextmanager
+    def writing(self) -> Iterator["MemoryDatabase"]:
+        with self.lock:
+            yield self
+
+    def batch(self):
+        return self.writing()
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryGuilds:
+    def __init__(self, database: MemoryDatabase):
+        self.database = database
+        self.settings: Dict[int, Guild] = {}
+
+    def get_cached(self, guild_id: int) -> Optional[Guild]:
+        guild = self.settings.get(guild_id)
+        return copy(guild) if guild else None
+
+    def get_settings(self, guild_id: int) -> Guild:
+        return self.get_cached(guild_id)
+
+    def invalidate(self, guild_id: int) -> None:
+        pass
+
+    def save(self, guild: Guild) -> Guild:
+        with self.database.lock:
+            self.settings[guild.id] = copy(guild)
+        return copy(guild)
+
+    def ensure_defaults(self, guild_ids: Iterable[int]) -> int:
+        with self.database.lock:
+            missing = {
+                guild_id for guild_id in guild_ids if guild_id not in self.settings
+            }
+            for guild_id in missing:
+                self.settings[guild_id] = Guild.default(guild_id)
+        return len(missing)
+
+
+class GuildUsers:
+    """The users of one guild, column by column, and where each of them is in the columns."""
+
+    __slots__ = ("positions", "ids", "xp", "timeouts", "ignored")
+
+    def __init__(self):
+        self.positions: Dict[int, int] = {}
+        self.ids = array("q")
+        self.xp = array("q")
+        # POSIX timestamps.
+        self.timeouts = array("d")
+        self.ignored = bytearray()
+
+    def add(self, user_id: int, xp: int, timeout: float, ignore_xp_gain: bool) -> int:
+        position = self.positions[user_id] = len(self.ids)
+        self.ids.append(user_id)
+        self.xp.append(xp)
+        self.timeouts.append(timeout)
+        self.ignored.append(ignore_xp_gain)
+        return position
+
+    def ranked(self) -> List[int]:
+        """The positions of all users by descending XP, then user id."""
+        return sorted(
+            range(len(self.ids)),
+            key=lambda position: (-self.xp[position], self.ids[position]),
+        )
+
+
+class MemoryUsers:
+    def __init__(self, database: MemoryDatabase):
+        self.database = database
+        # There is nothing slower behind memory to buffer writes for.
+        self.write_behind = False
+        self.flush_interval = database.config["database"].getfloat(
+            "flush_interval", fallback=10.0
+        )
+        self.guilds: Dict[int, GuildUsers] = {}
+        self.cooldowns = CooldownIndex()
+
+    def on_cooldown(self, user_id: int, guild_id: int, now: datetime) -> bool:
+        return self.cooldowns.on_cooldown(guild_id, user_id, now.timestamp())
+
+    def invalidate(self, user_id: int, guild_id: int) -> None:
+        """Forget what is cached about a user, for when another process changed them."""
+        self.cooldowns.forget(guild_id, user_id)
+
+    def remember_cooldown(self, user: User) -> None:
+        self.cooldowns.set(
+            user.guild.id,
+            user.id,
+            inf if user.ignore_xp_gain else user.timeout.timestamp(),
+        )
+
+    def user_at(self, users: GuildUsers, position: int, guild: Guild) -> User:
+        return User(
+            users.ids[position],
+            guild,
+            users.xp[position],
+            datetime.fromtimestamp(users.timeouts[position], timezone.utc),
+            bool(users.ignored[position]),
+        )
+
+    def find(self, user_id: int, guild_id: int) -> Tuple[Optional[GuildUsers], int]:
+        users = self.guilds.get(guild_id)
+        if users is None:
+            return None, -1
+        return users, users.positions.get(user_id, -1)
+
+    def get(self, user_id: int, guild_id: int) -> User:
+        with self.database.lock:
+            users, position = self.find(user_id, guild_id)
+            if position < 0:
+                return None
+            user = self.user_at(
+                users, position, self.database.guilds.get_settings(guild_id)
+            )
+        self.remember_cooldown(user)
+        return user
+
+    def get_all_ignored(self, guild_id: int) -> List[User]:
+        guild = self.database.guilds.get_settings(guild_id)
+        with self.database.lock:
+            users = self.guilds.get(guild_id)
+            if users is None:
+                return []
+            return [
+                self.user_at(users, position, guild)
+                for position, ignored in enumerate(users.ignored)
+                if ignored
+            ]
+
+    def save(self, user: User) -> User:
+        self.remember_cooldown(user)
+        with self.database.lock:
+            users = self.guilds.get(user.guild.id)
+            if users is None:
+                users = self.guilds[user.guild.id] = GuildUsers()
+            position = users.positions.get(user.id)
+            if position is None:
+                users.add(
+                    user.id, user.xp, user.timeout.timestamp(), user.ignore_xp_gain
+                )
+            else:
+                users.xp[position] = user.xp
+                users.timeouts[position] = user.timeout.timestamp()
+                users.ignored[position] = user.ignore_xp_gain
+        return copy(user)
+
+    def grant_xp(
+        self, user_id: int, guild_id: int, now: datetime
+    ) -> Optional[Tuple[int, User]]:
+        guild = self.database.guilds.get_settings(guild_id)
+        with self.database.lock:
+            users, position = self.find(user_id, guild_id)
+            if position < 0:
+                self.save(User(user_id, guild, 0, now, False))
+                return None
+            if users.ignored[position] or users.timeouts[position] >= now.timestamp():
+                self.remember_cooldown(self.user_at(users, position, guild))
+                return None
+            previous_xp = users.xp[position]
+            users.xp[position] += guild.reward_amount
+            users.timeouts[position] = (now + guild.text_timeout).timestamp()
+            user = self.user_at(users, position, guild)
+        self.remember_cooldown(user)
+        return previous_xp, user
+
+    def adjust_xp(
+        self, user_id: int, guild_id: int, amount: Optional[int]
+    ) -> Optional[Tuple[int, User]]:
+        with self.database.lock:
+            users, position = self.find(user_id, guild_id)
+            if position < 0:
+                return None
+            previous_xp = users.xp[position]
+            users.xp[position] = 0 if amount is None else max(previous_xp + amount, 0)
+            return previous_xp, self.user_at(
+                users, position, self.database.guilds.get_settings(guild_id)
+            )
+
+    def adjust_xp_many(
+        self, user_ids: Iterable[int], guild_id: int, amount: Optional[int]
+    ) -> Tuple[int, int]:
+        found = change = 0
+        with self.database.lock:
+            for user_id in set(user_ids):
+                users, position = self.find(user_id, guild_id)
+                if position < 0:
+                    continue
+                previous_xp = users.xp[position]
+                users.xp[position] = (
+                    0 if amount is None else max(previous_xp + amount, 0)
+                )
+                found += 1
+                change += users.xp[position] - previous_xp
+        return found, change
+
+    def flush(self) -> int:
+        return 0
+
+    def get_ranked_users(self, guild_id: int) -> RankedUsers:
+        ranked_users = RankedUsers(self.database.guilds.get_settings(guild_id))
+        with self.database.lock:
+            users = self.guilds.get(guild_id)
+            if users is not None:
+                for position in users.ranked():
+                    ranked_users.append(
+                        users.ids[position],
+                        users.xp[position],
+                        users.timeouts[position],
+                        users.ignored[position],
+                    )
+        return ranked_users
+
+    def get_ranked_page(self, guild_id: int, limit: int, offset: int = 0) -> List[User]:
+        guild = self.database.guilds.get_settings(guild_id)
+        with self.database.lock:
+            users = self.guilds.get(guild_id)
+            if users is None:
+                return []
+            return [
+                self.user_at(users, position, guild)
+                for position in users.ranked()[offset : offset + limit]
+            ]
+
+    def count(self, guild_id: int) -> int:
+        users = self.guilds.get(guild_id)
+        return len(users.ids) if users else 0
+
+    def get_rank(self, user: User) -> int:
+        with self.database.lock:
+            users = self.guilds.get(user.guild.id)
+            if users is None:
+                return 0
+            return sum(
+                1
+                for user_id, xp in zip(users.ids, users.xp)
+                if xp > user.xp or (xp == user.xp and user_id < user.id)
+            )
+
+
+class MemoryRewards:
+    def __init__(self, database: MemoryDatabase):
+        self.database = database
+        # The reward level of every reward role, by guild.
+        self.levels: Dict[int, Dict[int, int]] = {}
+        self.index: Dict[int, RewardIndex] = {}
+
+    def get_cached(self, guild_id: int) -> Optional[RewardIndex]:
+        return self.index.get(guild_id)
+
+    def invalidate(self, guild_id: int) -> None:
+        with self.database.lock:
+            self.index.pop(guild_id, None)
+
+    def get_index(self, guild_id: int) -> RewardIndex:
+        index = self.index.get(guild_id)
+        if index is None:
+            with self.database.lock:
+                rewards = sorted(
+                    self.levels.get(guild_id, {}).items(), key=lambda reward: reward[1]
+                )
+                index = self.index[guild_id] = RewardIndex(
+                    tuple(level for _, level in rewards),
+                    tuple(role for role, _ in rewards),
+                )
+        return index
+
+    def get(self, guild_id: int, role_id: int) -> Reward:
+        level = self.levels.get(guild_id, {}).get(role_id)
+        if level is None:
+            return None
+        return Reward(self.database.guilds.get_settings(guild_id), role_id, level)
+
+    def get_all(self, guild_id: int) -> List[Reward]:
+        guild = self.database.guilds.get_settings(guild_id)
+        with self.database.lock:
+            return [
+                Reward(guild, role_id, level)
+                for role_id, level in self.levels.get(guild_id, {}).items()
+            ]
+
+    def save(self, reward: Reward) -> Reward:
+        with self.database.lock:
+            self.levels.setdefault(reward.guild.id, {})[reward.role] = reward.level
+            self.invalidate(reward.guild.id)
+        return copy(reward)
+
+    def delete(self, guild_id: int, role_id: int) -> None:
+        with self.database.lock:
+            self.levels.get(guild_id, {}).pop(role_id, None)
+            self.invalidate(guild_id)
+
+
+class MemoryIgnoredChannels:
+    def __init__(self, database: MemoryDatabase):
+        self.database = database
+        self.ids: Dict[int, Set[int]] = {}
+        self.index: Dict[int, FrozenSet[int]] = {}
+
+    def get_cached(self, guild_id: int) -> Optional[FrozenSet[int]]:
+        return self.index.get(guild_id)
+
+    def invalidate(self, guild_id: int) -> None:
+        with self.database.lock:
+            self.index.pop(guild_id, None)
+
+    def get_ids(self, guild_id: int) -> FrozenSet[int]:
+        ids = self.index.get(guild_id)
+        if ids is None:
+            with self.database.lock:
+                ids = self.index[guild_id] = frozenset(self.ids.get(guild_id, ()))
+        return ids
+
+    def get(self, channel_id: int, guild_id: int) -> IgnoredChannel:
+        if channel_id not in self.get_ids(guild_id):
+            return None
+        return IgnoredChannel(self.database.guilds.get_settings(guild_id), channel_id)
+
+    def get_all(self, guild_id: int) -> List[IgnoredChannel]:
+        guild = self.database.guilds.get_settings(guild_id)
+        return [
+            IgnoredChannel(guild, channel_id) for channel_id in self.get_ids(guild_id)
+        ]
+
+    def save(self, ignored_channel: IgnoredChannel) -> IgnoredChannel:
+        with self.database.lock:
+            self.ids.setdefault(ignored_channel.guild.id, set()).add(
+                ignored_channel.channel
+            )
+            self.invalidate(ignored_channel.guild.id)
+        return copy(ignored_channel)
+
+    def delete(self, channel_id: int, guild_id: int) -> None:
+        with self.database.lock:
+            self.ids.get(guild_id, set()).discard(channel_id)
+            self.invalidate(guild_id)
+
+
+class MemoryIgnoredRoles:
+    def __init__(self, database: MemoryDatabase):
+        self.database = database
+        self.ids: Dict[int, Set[int]] = {}
+        self.index: Dict[int, FrozenSet[int]] = {}
+
+    def get_cached(self, guild_id: int) -> Optional[FrozenSet[int]]:
+        return self.index.get(guild_id)
+
+    def invalidate(self, guild_id: int) -> None:
+        with self.database.lock:
+            self.index.pop(guild_id, None)
+
+    def get_ids(self, guild_id: int) -> FrozenSet[int]:
+        ids = self.index.get(guild_id)
+        if ids is None:
+            with self.database.lock:
+                ids = self.index[guild_id] = frozenset(self.ids.get(guild_id, ()))
+        return ids
+
+    def get(self, role_id: int, guild_id: int) -> IgnoredRole:
+        if role_id not in self.get_ids(guild_id):
+            return None
+        return IgnoredRole(self.database.guilds.get_settings(guild_id), role_id)
+
+    def get_all(self, guild_id: int) -> List[IgnoredRole]:
+        guild = self.database.guilds.get_settings(guild_id)
+        return [IgnoredRole(guild, role_id) for role_id in self.get_ids(guild_id)]
+
+    def save(self, ignored_role: IgnoredRole) -> IgnoredRole:
+        with self.database.lock:
+            self.ids.setdefault(ignored_role.guild.id, set()).add(ignored_role.role)
+            self.invalidate(ignored_role.guild.id)
+        return copy(ignored_role)
+
+    def delete(self, role_id: int, guild_id: int) -> None:
+        with self.database.lock:
+            self.ids.get(guild_id, set()).discard(role_id)
+            self.invalidate(guild_id)
@@ -0,0 +1,308 @@
+import re
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import lru_cache
+from time import monotonic, perf_counter
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+# Upper bounds of the latency buckets in seconds, from 10µs to about 42s in steps of √2.
+BUCKETS: Tuple[float, ...] = tuple(0.00001 * 2 ** (step / 2) for step in range(45))
+
+
+class Histogram:
+    """Counts durations into the fixed BUCKETS, so quantiles cost the same however many there are."""
+
+    def __init__(self):
+        self.counts: List[int] = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def merge(self, other: "Histogram") -> None:
+        for bucket, count in enumerate(other.counts):
+            self.counts[bucket] += count
+        self.count += other.count
+        self.total += other.total
+
+    def quantile(self, q: float) -> float:
+        """The upper bound of the bucket holding the q-quantile, in seconds."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return BUCKETS[min(bucket, len(BUCKETS) - 1)]
+        return BUCKETS[-1]
+
+
+class RollingHistogram:
+    """
+    A histogram of the last window seconds, kept as slices that are dropped once they
+    have aged out.
+    """
+
+    def __init__(self, window: float = 3600.0, slices: int = 6):
+        self.slice_length = window / slices
+        self.slices: Deque[Tuple[float, Histogram]] = deque(maxlen=slices)
+
+    def observe(self, seconds: float) -> None:
+        now = monotonic()
+        if not self.slices or self.slices[-1][0] + self.slice_length <= now:
+            self.slices.append((now, Histogram()))
+        self.slices[-1][1].observe(seconds)
+
+    def merged(self) -> Histogram:
+        cutoff = monotonic() - self.slice_length * self.slices.maxlen
+        histogram = Histogram()
+        for start, part in self.slices:
+            if start >= cutoff:
+                histogram.merge(part)
+        return histogram
+
+
+class EventRate:
+    """Counts events in one-second buckets to tell how many arrived per second lately."""
+
+    def __init__(self, window: int = 60):
+        self.window = window
+        self.buckets = [0] * window
+        self.second = int(monotonic())
+
+    def advance(self, now: int) -> None:
+        """Empty the buckets of the seconds that passed without events."""
+        if now - self.second >= self.window:
+            self.buckets = [0] * self.window
+        else:
+            for second in range(self.second + 1, now + 1):
+                self.buckets[second % self.window] = 0
+        self.second = max(self.second, now)
+
+    def add(self, count: int = 1) -> None:
+        now = int(monotonic())
+        self.advance(now)
+        self.buckets[now % self.window] += count
+
+    def per_second(self) -> float:
+        self.advance(int(monotonic()))
+        return sum(self.buckets) / self.window
+
+
+@dataclass
+class ShardStats:
+    """Throughput and handler latency of the guild events of one shard."""
+
+    events: int = 0
+    rate: EventRate = field(default_factory=EventRate)
+    handlers: RollingHistogram = field(
+        default_factory=lambda: RollingHistogram(window=600.0, slices=10)
+    )
+
+
+@dataclass
+class StatementStats:
+    """Everything known about one statement as issued by one repository method."""
+
+    method: str
+    sql: str
+    count: int = 0
+    total: float = 0.0
+    recent: RollingHistogram = field(default_factory=RollingHistogram)
+
+    @property
+    def p99(self) -> float:
+        return self.recent.merged().quantile(0.99)
+
+
+NUMBER = re.compile(r"\b\d+(\.\d+)?\b")
+STRING = re.compile(r"'(?:[^']|'')*'")
+PARAMETER = re.compile(r"[:@$]\w+")
+WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def normalize(sql: str) -> str:
+    """Reduce a statement to its shape: literals and parameters become ?, whitespace is collapsed."""
+    sql = STRING.sub("?", sql)
+    sql = PARAMETER.sub("?", sql)
+    sql = NUMBER.sub("?", sql)
+    return WHITESPACE.sub(" ", sql).strip()
+
+
+class QueryStats:
+    """Counts and times SQL statements by repository method and normalised statement text."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statements: Dict[Tuple[str, str], StatementStats] = {}
+
+    def record(
+        self, method: str, sql: str, seconds: float, executed: bool = True
+    ) -> None:
+        """
+        Account seconds spent on a statement. Fetching the rows of an already executed
+        statement only adds to its total time, the histogram is of executions.
+        """
+        key = (method, normalize(sql))
+        with self.lock:
+            stats = self.statements.get(key)
+            if stats is None:
+                stats = self.statements[key] = StatementStats(method, key[1])
+            stats.total += seconds
+            if executed:
+                stats.count += 1
+                stats.recent.observe(seconds)
+
+    def top(self, key: str = "total", limit: int = 10) -> List[StatementStats]:
+        """The statements with the most total time, calls (count) or the highest p99."""
+        with self.lock:
+            return sorted(
+                self.statements.values(),
+                key=lambda stats: getattr(stats, key),
+                reverse=True,
+            )[:limit]
+
+    def reset(self) -> None:
+        with self.lock:
+            self.statements.clear()
+
+
+@dataclass
+class Timing:
+    """Where the time of one command invocation or listener run went."""
+
+    start: float = field(default_factory=perf_counter)
+    database: float = 0.0
+    discord: float = 0.0
+
+
+# The Timing of the command or listener running in the current task, if any.
+# The database and HTTP layers add the time they spend waiting to it.
+current_timing: ContextVar[Optional[Timing]] = ContextVar(
+    "current_timing", default=None
+)
+# When the event being handled in the current task was dispatched, so that handlers can tell
+# how long they sat in the event loop's queue.
+dispatched_at: ContextVar[Optional[float]] = ContextVar("dispatched_at", default=None)
+
+
+def add_database_time(seconds: float) -> None:
+    timing = current_timing.get()
+    if timing:
+        timing.database += seconds
+
+
+def add_discord_time(seconds: float) -> None:
+    timing = current_timing.get()
+    if timing:
+        timing.discord += seconds
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class LatencyRegistry:
+    """Latency histograms by metric name and labels, served in the Prometheus text format."""
+
+    DESCRIPTIONS = {
+        "anubis_command_seconds": "Time spent in command invocations by phase.",
+        "anubis_listener_seconds": "Time spent in event listener runs by phase.",
+        "anubis_shard_handler_seconds": "Time spent in event listener runs by shard.",
+        "anubis_shard_events_total": "Guild events dispatched by shard.",
+        "anubis_shard_events_per_second": "Guild events dispatched per second over the last minute by shard.",
+        "anubis_shard_gateway_latency_seconds": "Gateway heartbeat latency by shard.",
+        "anubis_log_queue_depth": "Log entries waiting to be posted across all channels.",
+        "anubis_log_queue_max_depth": "Most log entries ever waiting for a single channel.",
+        "anubis_log_dropped_total": "Log entries dropped because their channel's queue was full.",
+        "anubis_log_channel_queue_depth": "Log entries waiting to be posted by log channel.",
+    }
+
+    def __init__(self):
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        # Gauges and counters by metric name, as their Prometheus type and values by labels.
+        self.values: Dict[str, Tuple[str, Dict[Labels, float]]] = {}
+        # Called before every render to bring the gauges and counters up to date.
+        self.collectors: List[Callable[[], None]] = []
+
+    def set_value(
+        self, name: str, kind: str, labels: Dict[str, str], value: float
+    ) -> None:
+        """Set a gauge or counter, kind being its Prometheus type."""
+        series = self.values.setdefault(name, (kind, {}))[1]
+        series[tuple(sorted(labels.items()))] = value
+
+    def observe(self, name: str, labels: Dict[str, str], seconds: float) -> None:
+        series = self.histograms.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(seconds)
+
+    def record(self, name: str, labels: Dict[str, str], timing: Timing) -> None:
+        """Observe every phase of a finished command or listener run."""
+        end = perf_counter()
+        queued = dispatched_at.get()
+        if queued is not None:
+            self.observe(name, {**labels, "phase": "queue"}, timing.start - queued)
+        self.observe(name, {**labels, "phase": "database"}, timing.database)
+        self.observe(name, {**labels, "phase": "discord"}, timing.discord)
+        self.observe(name, {**labels, "phase": "total"}, end - timing.start)
+
+    @staticmethod
+    def format_labels(labels: Labels) -> str:
+        return ",".join(
+            '{}="{}"'.format(
+                name,
+                value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+            )
+            for name, value in labels
+        )
+
+    def render(self) -> str:
+        for collect in self.collectors:
+            collect()
+        lines = []
+        for name, (kind, series) in sorted(self.values.items()):
+            lines.append(f"# HELP {name} {self.DESCRIPTIONS.get(name, name)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{{{self.format_labels(labels)}}} {value}")
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f"# HELP {name} {self.DESCRIPTIONS.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in sorted(series.items()):
+                prefix = self.format_labels(labels)
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        f'{name}_bucket{{{prefix},le="{bound:.6g}"}} {cumulative}'
+                    )
+                lines.append(f'{name}_bucket{{{prefix},le="+Inf"}} {histogram.count}')
+                lines.append(f"{name}_sum{{{prefix}}} {histogram.total}")
+                lines.append(f"{name}_count{{{prefix}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host: str, port: int) -> web.AppRunner:
+        """Serve the histograms at http://host:port/metrics until the returned runner is cleaned up."""
+
+        async def metrics(request: web.Request) -> web.Response:
+            return web.Response(text=self.render(), content_type="text/plain")
+
+        app = web.Application()
+        app.router.add_get("/metrics", metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
@@ -0,0 +1,64 @@
+CREATE TABLE user_levels_deduplicated (
+    guild_id        INTEGER     NOT NULL,
+    user_id         INTEGER     NOT NULL,
+    xp              INTEGER,
+    timeout         TIMESTAMP,
+    ignore_xp_gain  INTEGER,
+
+    PRIMARY KEY(guild_id, user_id)
+);
+-- Keep the whole row with the most XP, the latest one written if several tie.
+INSERT INTO user_levels_deduplicated
+    SELECT guild_id, user_id, xp, timeout, ignore_xp_gain
+    FROM (
+        SELECT *, ROW_NUMBER() OVER (
+            PARTITION BY guild_id, user_id ORDER BY xp DESC, rowid DESC
+        ) AS position
+        FROM user_levels
+        WHERE guild_id IS NOT NULL AND user_id IS NOT NULL
+    )
+    WHERE position = 1;
+DROP TABLE user_levels;
+ALTER TABLE user_levels_deduplicated RENAME TO user_levels;
+CREATE INDEX user_levels_guild_xp ON user_levels(guild_id, xp DESC);
+
+CREATE TABLE rewards_deduplicated (
+    guild_id        INTEGER     NOT NULL,
+    reward_role     INTEGER     NOT NULL,
+    reward_level    INTEGER,
+
+    PRIMARY KEY(guild_id, reward_role)
+);
+INSERT INTO rewards_deduplicated
+    SELECT guild_id, reward_role, MAX(reward_level)
+    FROM rewards
+    WHERE guild_id IS NOT NULL AND reward_role IS NOT NULL
+    GROUP BY guild_id, reward_role;
+DROP TABLE rewards;
+ALTER TABLE rewards_deduplicated RENAME TO rewards;
+
+CREATE TABLE ignored_channels_deduplicated (
+    guild_id        INTEGER     NOT NULL,
+    channel_id      INTEGER     NOT NULL,
+
+    PRIMARY KEY(guild_id, channel_id)
+);
+INSERT INTO ignored_channels_deduplicated
+    SELECT DISTINCT guild_id, channel_id
+    FROM ignored_channels
+    WHERE guild_id IS NOT NULL AND channel_id IS NOT NULL;
+DROP TABLE ignored_channels;
+ALTER TABLE ignored_channels_deduplicated RENAME TO ignored_channels;
+
+CREATE TABLE ignored_roles_deduplicated (
+    guild_id    INTEGER     NOT NULL,
+    role_id     INTEGER     NOT NULL,
+
+    PRIMARY KEY(guild_id, role_id),
+    FOREIGN KEY(guild_id) REFERENCES level_settings(guild_id)
+);
+INSERT INTO ignored_roles_deduplicated
+    SELECT DISTINCT guild_id, role_id
+    FROM ignored_roles;
+DROP TABLE ignored_roles;
+ALTER TABLE ignored_roles_deduplicated RENAME TO ignored_roles;
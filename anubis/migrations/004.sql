@@ -0,0 +1,2 @@
+DROP INDEX IF EXISTS user_levels_guild_xp;
+CREATE INDEX user_levels_guild_xp ON user_levels(guild_id, xp DESC, user_id);
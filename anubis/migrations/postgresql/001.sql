@@ -0,0 +1,43 @@
+CREATE TABLE IF NOT EXISTS level_settings (
+    guild_id        BIGINT      PRIMARY KEY,
+    text_time       INTEGER     NOT NULL,
+    base            INTEGER     NOT NULL,
+    modifier        INTEGER     NOT NULL,
+    amount          INTEGER     NOT NULL,
+    user_channel    BIGINT      NOT NULL,
+    log_channel     BIGINT      NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_levels (
+    guild_id        BIGINT      NOT NULL,
+    user_id         BIGINT      NOT NULL,
+    xp              BIGINT      NOT NULL,
+    timeout         TIMESTAMPTZ NOT NULL,
+    ignore_xp_gain  BOOLEAN     NOT NULL,
+
+    PRIMARY KEY(guild_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS user_levels_guild_xp ON user_levels(guild_id, xp DESC, user_id);
+
+CREATE TABLE IF NOT EXISTS rewards (
+    guild_id        BIGINT      NOT NULL,
+    reward_role     BIGINT      NOT NULL,
+    reward_level    INTEGER,
+
+    PRIMARY KEY(guild_id, reward_role)
+);
+
+CREATE TABLE IF NOT EXISTS ignored_channels (
+    guild_id        BIGINT      NOT NULL,
+    channel_id      BIGINT      NOT NULL,
+
+    PRIMARY KEY(guild_id, channel_id)
+);
+
+CREATE TABLE IF NOT EXISTS ignored_roles (
+    guild_id        BIGINT      NOT NULL,
+    role_id         BIGINT      NOT NULL,
+
+    PRIMARY KEY(guild_id, role_id),
+    FOREIGN KEY(guild_id) REFERENCES level_settings(guild_id)
+);
@@ -1,8 +1,54 @@
+from array import array
+from bisect import bisect_right
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from math import sqrt, floor
+from functools import lru_cache
+from typing import List, NamedTuple, Sequence, Tuple, Union, overload
+
+
+class LevelTable:
+    """
+    The XP thresholds of one (base, modifier) pair, grown on demand.
+    Reaching level n + 2 takes thresholds[n] XP.
+    """
+
+    def __init__(self, base: int, modifier: int):
+        self.base = base
+        self.modifier = modifier
+        self.thresholds: List[int] = []
+        self.extend(64)
+
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def of(base: int, modifier: int) -> "LevelTable":
+        return LevelTable(base, modifier)
+
+    def extend(self, size: int) -> None:
+        for i in range(len(self.thresholds), size):
+            self.thresholds.append(
+                self.base + (round(self.base * (self.modifier / 100) * i) * i)
+            )
+
+    def level(self, xp: int) -> int:
+        if xp >= self.thresholds[-1]:
+            if self.base <= 0 or self.modifier <= 0:
+                raise ValueError(
+                    f"XP thresholds never grow with base {self.base} and modifier {self.modifier}"
+                )
+            size = len(self.thresholds)
+            while xp >= self.thresholds[-1]:
+                size *= 2
+                self.extend(size)
+        return bisect_right(self.thresholds, xp) + 1
+
+    def xp_needed(self, level: int) -> int:
+        if level < 0:
+            return 0
+        self.extend(level + 1)
+        return self.thresholds[level]
+
 
-@dataclass
+@dataclass(slots=True)
 class Guild:
     id: int
     _text_timeout: int
@@ -12,6 +58,10 @@ class Guild:
     user_channel: int
     log_channel: int
 
+    @classmethod
+    def default(cls, guild_id: int) -> "Guild":
+        return cls(guild_id, 3, 15, 50, 5, 0, 0)
+
     @property
     def text_timeout(self):
         return timedelta(minutes=self._text_timeout)
@@ -22,8 +72,12 @@ class Guild:
     def set_text_timeout(self, new_timeout: int):
         self._text_timeout = new_timeout
 
+    @property
+    def levels(self) -> LevelTable:
+        return LevelTable.of(self.base, self.modifier)
+
 
-@dataclass
+@dataclass(slots=True)
 class User:
     id: int
     guild: Guild
@@ -33,27 +87,10 @@ class User:
 
     @property
     def level(self):
-        i = 0
-        if self.xp > 1000:
-            i = floor(sqrt(((self.xp - self.guild.base) * 100) / (self.guild.base * self.guild.modifier))) - 2
-        while True:
-            xp_needed = self.guild.base + (
-                round(self.guild.base * (self.guild.modifier / 100) * i) * i
-            )
-            if self.xp < xp_needed:
-                return i + 1
-            i += 1
+        return self.guild.levels.level(self.xp)
 
     def xp_needed(self, level_modifier: int = 0) -> int:
-        level = self.level - 2 + level_modifier
-        if level == 0:
-            return self.guild.base
-        elif level < 0:
-            return 0
-        else:
-            return self.guild.base + (
-                round(self.guild.base * (self.guild.modifier / 100) * level) * level
-            )
+        return self.guild.levels.xp_needed(self.level - 2 + level_modifier)
 
     def grant_xp(self, xp_amount: int = None) -> None:
         if not xp_amount:
@@ -62,7 +99,52 @@ class User:
         self.timeout = datetime.now(timezone.utc) + self.guild.text_timeout
 
 
-@dataclass
+class RankedUsers(Sequence[User]):
+    """
+    The users of one guild in leaderboard order, stored column by column in arrays instead of
+    one object per row. Users are only built when they are looked at.
+    """
+
+    __slots__ = ("guild", "ids", "xp", "timeouts", "ignored")
+
+    def __init__(self, guild: Guild):
+        self.guild = guild
+        self.ids = array("q")
+        self.xp = array("q")
+        self.timeouts = array("d")
+        self.ignored = bytearray()
+
+    def append(
+        self, user_id: int, xp: int, timeout: float, ignore_xp_gain: bool
+    ) -> None:
+        """Add a user, with its timeout as a POSIX timestamp."""
+        self.ids.append(user_id)
+        self.xp.append(xp)
+        self.timeouts.append(timeout)
+        self.ignored.append(ignore_xp_gain)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @overload
+    def __getitem__(self, index: int) -> User: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[User]: ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[User, List[User]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return User(
+            self.ids[index],
+            self.guild,
+            self.xp[index],
+            datetime.fromtimestamp(self.timeouts[index], timezone.utc),
+            bool(self.ignored[index]),
+        )
+
+
+@dataclass(slots=True)
 class Reward:
     guild: Guild
     role: int
@@ -70,24 +152,29 @@ class Reward:
 
     @property
     def xp_needed(self):
-        level = self.level - 2
-        if level == 0:
-            return self.guild.base
-        elif level < 0:
-            return 0
-        else:
-            return self.guild.base + (
-                round(self.guild.base * (self.guild.modifier / 100) * level) * level
-            )
+        return self.guild.levels.xp_needed(self.level - 2)
+
+
+class RewardIndex(NamedTuple):
+    """The reward roles of a guild, sorted by the level they are given at."""
+
+    levels: Tuple[int, ...]
+    roles: Tuple[int, ...]
+
+    def earned(self, previous_level: int, level: int) -> Tuple[int, ...]:
+        """Return the roles for levels above previous_level, up to and including level."""
+        return self.roles[
+            bisect_right(self.levels, previous_level) : bisect_right(self.levels, level)
+        ]
 
 
-@dataclass
+@dataclass(slots=True)
 class IgnoredChannel:
     guild: Guild
     channel: int
 
 
-@dataclass
+@dataclass(slots=True)
 class IgnoredRole:
     guild: Guild
     role: int
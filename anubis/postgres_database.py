@@ -0,0 +1,708 @@
+import logging
+import sys
+import threading
+from contextlib import contextmanager
+from copy import copy
+from datetime import datetime, timezone
+from math import inf
+from pathlib import Path
+from time import perf_counter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+try:
+    import psycopg
+    from psycopg.rows import dict_row, tuple_row
+    from psycopg_pool import ConnectionPool
+except ImportError as e:
+    raise ImportError(
+        "The postgresql backend needs psycopg and psycopg_pool, "
+        "install them with `poetry install -E postgresql`"
+    ) from e
+
+from anubis.caches import CooldownIndex, Generations
+from anubis.metrics import QueryStats
+from anubis.models import *
+
+
+class PostgresDatabase:
+    """
+    A backend on a PostgreSQL server, reached through a pool of connections so that the
+    reader threads don't queue up behind each other. Migrations are the .sql files in the
+    postgresql folder of [database] migrations.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.log = logging.getLogger("anubis")
+        self.log.setLevel(logging.INFO)
+        settings = config["database"]
+
+        self.query_stats = QueryStats()
+        self.instrument = settings.getboolean("instrument", fallback=True)
+        self.shared = True
+        # Writes are made one at a time like with SQLite, which keeps the caches simple.
+        self.lock = threading.RLock()
+        # The connection run() uses while the current thread is writing, if any.
+        self.local = threading.local()
+        self.pool = ConnectionPool(
+            settings["dsn"],
+            min_size=settings.getint("pool_min_size", fallback=2),
+            max_size=settings.getint("pool_max_size", fallback=8),
+            kwargs={"autocommit": True, "row_factory": dict_row},
+            name="anubis",
+            open=True,
+        )
+        self.migrate(Path(settings["migrations"]) / "postgresql")
+
+        self.guilds = PostgresGuilds(self)
+        self.users = PostgresUsers(self)
+        self.rewards = PostgresRewards(self)
+        self.ignored_channels = PostgresIgnoredChannels(self)
+        self.ignored_roles = PostgresIgnoredRoles(self)
+
+    def migrate(self, migrations: Path) -> None:
+        with self.pool.connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS applied_migrations (number INTEGER PRIMARY KEY)"
+            )
+            last_migration_number = conn.execute(
+                "SELECT COALESCE(MAX(number), 0) AS number FROM applied_migrations"
+            ).fetchone()["number"]
+            for path in sorted(migrations.glob("*.sql")):
+                number = int(path.stem)
+                if number > last_migration_number:
+                    with conn.transaction():
+                        conn.execute(path.read_text())
+                        conn.execute(
+                            "INSERT INTO applied_migrations VALUES(%s)", (number,)
+                        )
+                    self.log.info(f"Applied migration {number}")
+
+    @contextmanager
+    def connection(self) -> Iterator["psycopg.Connection"]:
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+        with self.pool.connection() as conn:
+            yield conn
+
+    @contextmanager
+    def writing(self) -> Iterator["psycopg.Connection"]:
+        """Hold the write lock and make run() use its connection on this thread."""
+        with self.lock, self.connection() as conn:
+            outer = getattr(self.local, "conn", None)
+            self.local.conn = conn
+            try:
+                yield conn
+            finally:
+                self.local.conn = outer
+
+    @contextmanager
+    def batch(self) -> Iterator["psycopg.Connection"]:
+        """Write everything done on this thread while this is held in one transaction."""
+        with self.writing() as conn, conn.transaction():
+            yield conn
+
+    def close(self) -> None:
+        self.pool.close()
+
+    def run(
+        self,
+        fetch: Callable[["psycopg.Cursor"], Any],
+        sql: str,
+        parameters: Any,
+        row_factory=dict_row,
+    ) -> Any:
+        caller = sys._getframe(1).f_code
+        if caller in PLUMBING:
+            caller = sys._getframe(2).f_code
+        start = perf_counter()
+        with self.connection() as conn:
+            cursor = conn.cursor(row_factory=row_factory)
+            cursor.execute(sql, parameters)
+            result = fetch(cursor)
+        if self.instrument:
+            self.query_stats.record(
+                getattr(caller, "co_qualname", caller.co_name),
+                sql,
+                perf_counter() - start,
+            )
+        return result
+
+    def query(self, sql: str, parameters: Any = None) -> List[Dict[str, Any]]:
+        return self.run(lambda cursor: cursor.fetchall(), sql, parameters)
+
+    def query_one(self, sql: str, parameters: Any = None) -> Optional[Dict[str, Any]]:
+        return self.run(lambda cursor: cursor.fetchone(), sql, parameters)
+
+
+# The functions between a repository method and run().
+PLUMBING = {PostgresDatabase.query.__code__, PostgresDatabase.query_one.__code__}
+
+
+def guild_from(row: Dict[str, Any]) -> Guild:
+    return Guild(
+        row["guild_id"],
+        row["text_time"],
+        row["base"],
+        row["modifier"],
+        row["amount"],
+        row["user_channel"],
+        row["log_channel"],
+    )
+
+
+def user_from(row: Dict[str, Any], guild: Guild) -> User:
+    return User(
+        row["user_id"],
+        guild,
+        row["xp"],
+        row["timeout"].astimezone(timezone.utc),
+        row["ignore_xp_gain"],
+    )
+
+
+class PostgresGuilds:
+    def __init__(self, database: PostgresDatabase):
+        self.database = database
+        self.cache: Dict[int, Guild] = {}
+        self.generations = Generations()
+
+    def get_cached(self, guild_id: int) -> Optional[Guild]:
+        cached_guild = self.cache.get(guild_id)
+        return copy(cached_guild) if cached_guild else None
+
+    def get_settings(self, guild_id: int) -> Guild:
+        cached_guild = self.get_cached(guild_id)
+        if cached_guild:
+            return cached_guild
+        generation = self.generations.of(guild_id)
+        try:
+            guild = self.database.query_one(
+                "SELECT * FROM level_settings WHERE guild_id=%(guild_id)s",
+                {"guild_id": guild_id},
+            )
+        except psycopg.DatabaseError:
+            return None
+        if not guild:
+            return None
+        settings = guild_from(guild)
+        self.generations.store(self.cache, guild_id, generation, settings)
+        return copy(settings)
+
+    def invalidate(self, guild_id: int) -> None:
+        self.generations.invalidate(self.cache, guild_id)
+
+    def save(self, guild: Guild) -> Guild:
+        saved_guild = None
+        try:
+            saved_guild = self.database.query_one(
+                "INSERT INTO level_settings (guild_id, text_time, base, modifier, amount, "
+                "user_channel, log_channel) VALUES(%(guild_id)s,%(text_time)s,%(base)s,"
+                "%(modifier)s,%(amount)s,%(user_channel)s,%(log_channel)s) "
+                "ON CONFLICT(guild_id) DO UPDATE "
+                "SET text_time=excluded.text_time,"
+                "base=excluded.base,"
+                "modifier=excluded.modifier,"
+                "amount=excluded.amount,"
+                "user_channel=excluded.user_channel,"
+                "log_channel=excluded.log_channel "
+                "RETURNING *",
+                {
+                    "text_time": guild.get_text_timeout(),
+                    "base": guild.base,
+                    "modifier": guild.modifier,
+                    "amount": guild.reward_amount,
+                    "user_channel": guild.user_channel,
+                    "log_channel": guild.log_channel,
+                    "guild_id": guild.id,
+                },
+            )
+        except psycopg.DatabaseError:
+            pass
+        self.invalidate(guild.id)
+        if not saved_guild:
+            return None
+        self.cache[guild.id] = guild_from(saved_guild)
+        return copy(self.cache[guild.id])
+
+    def ensure_defaults(self, guild_ids: Iterable[int]) -> int:
+        """Give every guild without settings the default ones and return how many were missing."""
+        default = Guild.default(0)
+        try:
+            created = self.database.query(
+                "INSERT INTO level_settings (guild_id, text_time, base, modifier, amount, "
+                "user_channel, log_channel) "
+                "SELECT DISTINCT guild_id, %(text_time)s, %(base)s, %(modifier)s, %(amount)s, "
+                "%(user_channel)s, %(log_channel)s FROM unnest(%(guild_ids)s::bigint[]) "
+                "AS guild_id ON CONFLICT(guild_id) DO NOTHING RETURNING *",
+                {
+                    "guild_ids": list(guild_ids),
+                    "text_time": default.get_text_timeout(),
+                    "base": default.base,
+                    "modifier": default.modifier,
+                    "amount": default.reward_amount,
+                    "user_channel": default.user_channel,
+                    "log_channel": default.log_channel,
+                },
+            )
+        except psycopg.DatabaseError as e:
+            self.database.log.error(f"Could not provision guild settings: {e}")
+            return 0
+        for guild in created:
+            self.cache[guild["guild_id"]] = guild_from(guild)
+        return len(created)
+
+
+class PostgresUsers:
+    def __init__(self, database: PostgresDatabase):
+        self.database = database
+        # Buffering only pays off against SQLite's single writer.
+        self.write_behind = False
+        self.flush_interval = database.config["database"].getfloat(
+            "flush_interval", fallback=10.0
+        )
+        self.cooldowns = CooldownIndex()
+
+    def on_cooldown(self, user_id: int, guild_id: int, now: datetime) -> bool:
+        return self.cooldowns.on_cooldown(guild_id, user_id, now.timestamp())
+
+    def invalidate(self, user_id: int, guild_id: int) -> None:
+        """Forget what is cached about a user, for when another process changed them."""
+        self.cooldowns.forget(guild_id, user_id)
+
+    def remember_cooldown(self, user: User) -> None:
+        self.cooldowns.set(
+            user.guild.id,
+            user.id,
+            inf if user.ignore_xp_gain else user.timeout.timestamp(),
+        )
+
+    def get(self, user_id: int, guild_id: int) -> User:
+        try:
+            user = self.database.query_one(
+                "SELECT * FROM user_levels WHERE user_id=%(user_id)s AND guild_id=%(guild_id)s",
+                {"user_id": user_id, "guild_id": guild_id},
+            )
+        except psycopg.DatabaseError:
+            return None
+        if not user:
+            return None
+        retrieved_user = user_from(user, self.database.guilds.get_settings(guild_id))
+        self.remember_cooldown(retrieved_user)
+        return retrieved_user
+
+    def get_all_ignored(self, guild_id: int) -> List[User]:
+        guild = self.database.guilds.get_settings(guild_id)
+        try:
+            users = self.database.query(
+                "SELECT * FROM user_levels WHERE guild_id=%(guild_id)s AND ignore_xp_gain",
+                {"guild_id": guild_id},
+            )
+        except psycopg.DatabaseError:
+            return []
+        return [user_from(user, guild) for user in users]
+
+    def save(self, user: User) -> User:
+        self.remember_cooldown(user)
+        try:
+            saved_user = self.database.query_one(
+                "INSERT INTO user_levels (guild_id, user_id, xp, timeout, ignore_xp_gain) "
+                "VALUES(%(guild_id)s,%(user_id)s,%(xp)s,%(timeout)s,%(ignore_xp_gain)s) "
+                "ON CONFLICT(guild_id, user_id) DO UPDATE "
+                "SET xp=excluded.xp,"
+                "timeout=excluded.timeout,"
+                "ignore_xp_gain=excluded.ignore_xp_gain "
+                "RETURNING *",
+                {
+                    "xp": user.xp,
+                    "timeout": user.timeout,
+                    "ignore_xp_gain": user.ignore_xp_gain,
+                    "user_id": user.id,
+                    "guild_id": user.guild.id,
+                },
+            )
+        except psycopg.DatabaseError:
+            return None
+        return user_from(saved_user, user.guild) if saved_user else None
+
+    def grant_xp(
+        self, user_id: int, guild_id: int, now: datetime
+    ) -> Optional[Tuple[int, User]]:
+        """See Users.grant_xp, this does the same in the same statements."""
+        guild = self.database.guilds.get_settings(guild_id)
+        parameters = {
+            "amount": guild.reward_amount,
+            "timeout": now + guild.text_timeout,
+            "now": now,
+            "guild_id": guild_id,
+            "user_id": user_id,
+        }
+        try:
+            granted_user = self.database.query_one(
+                "UPDATE user_levels SET xp=xp + %(amount)s, timeout=%(timeout)s "
+                "WHERE guild_id=%(guild_id)s AND user_id=%(user_id)s "
+                "AND timeout < %(now)s AND NOT ignore_xp_gain "
+                "RETURNING *",
+                parameters,
+            )
+            if not granted_user:
+                created_user = self.database.query_one(
+                    "INSERT INTO user_levels (guild_id, user_id, xp, timeout, ignore_xp_gain) "
+                    "VALUES(%(guild_id)s,%(user_id)s,0,%(now)s,FALSE) "
+                    "ON CONFLICT(guild_id, user_id) DO NOTHING RETURNING *",
+                    parameters,
+                )
+                if created_user:
+                    self.remember_cooldown(user_from(created_user, guild))
+                else:
+                    self.get(user_id, guild_id)
+                return None
+        except psycopg.DatabaseError:
+            return None
+        user = user_from(granted_user, guild)
+        self.remember_cooldown(user)
+        return user.xp - guild.reward_amount, user
+
+    def adjust_xp(
+        self, user_id: int, guild_id: int, amount: Optional[int]
+    ) -> Optional[Tuple[int, User]]:
+        """See Users.adjust_xp. The row lock of the subquery keeps the previous XP exact."""
+        try:
+            adjusted_user = self.database.query_one(
+                "UPDATE user_levels SET xp=CASE WHEN %(amount)s::bigint IS NULL THEN 0 "
+                "ELSE GREATEST(user_levels.xp + %(amount)s::bigint, 0) END "
+                "FROM (SELECT xp FROM user_levels "
+                "WHERE guild_id=%(guild_id)s AND user_id=%(user_id)s FOR UPDATE) AS previous "
+                "WHERE guild_id=%(guild_id)s AND user_id=%(user_id)s "
+                "RETURNING user_levels.*, previous.xp AS previous_xp",
+                {"amount": amount, "guild_id": guild_id, "user_id": user_id},
+            )
+        except psycopg.DatabaseError:
+            return None
+        if not adjusted_user:
+            return None
+        return adjusted_user["previous_xp"], user_from(
+            adjusted_user, self.database.guilds.get_settings(guild_id)
+        )
+
+    def adjust_xp_many(
+        self, user_ids: Iterable[int], guild_id: int, amount: Optional[int]
+    ) -> Tuple[int, int]:
+        """See Users.adjust_xp_many. One UPDATE over all of them does what executemany does there."""
+        try:
+            adjusted = self.database.query_one(
+                "WITH adjusted AS ("
+                "UPDATE user_levels SET xp=CASE WHEN %(amount)s::bigint IS NULL THEN 0 "
+                "ELSE GREATEST(user_levels.xp + %(amount)s::bigint, 0) END "
+                "FROM (SELECT user_id, xp FROM user_levels WHERE guild_id=%(guild_id)s "
+                "AND user_id = ANY(%(user_ids)s::bigint[]) FOR UPDATE) AS previous "
+                "WHERE user_levels.guild_id=%(guild_id)s AND user_levels.user_id=previous.user_id "
+                "RETURNING user_levels.xp - previous.xp AS change) "
+                "SELECT COUNT(*) AS found, COALESCE(SUM(change), 0)::bigint AS change FROM adjusted",
+                {
+                    "amount": amount,
+                    "guild_id": guild_id,
+                    "user_ids": list(set(user_ids)),
+                },
+            )
+        except psycopg.DatabaseError as e:
+            self.database.log.error(f"Could not adjust the XP of users: {e}")
+            return 0, 0
+        return adjusted["found"], adjusted["change"]
+
+    def flush(self) -> int:
+        return 0
+
+    def get_ranked_users(self, guild_id: int) -> RankedUsers:
+        ranked_users = RankedUsers(self.database.guilds.get_settings(guild_id))
+
+        def fill(cursor: "psycopg.Cursor") -> None:
+            for user_id, xp, timeout, ignore_xp_gain in cursor:
+                ranked_users.append(user_id, xp, timeout, ignore_xp_gain)
+
+        self.database.run(
+            fill,
+            "SELECT user_id, xp, EXTRACT(EPOCH FROM timeout)::float8, ignore_xp_gain "
+            "FROM user_levels WHERE guild_id=%(guild_id)s ORDER BY xp DESC",
+            {"guild_id": guild_id},
+            row_factory=tuple_row,
+        )
+        return ranked_users
+
+    def get_ranked_page(self, guild_id: int, limit: int, offset: int = 0) -> List[User]:
+        users = self.database.query(
+            "SELECT * FROM user_levels WHERE guild_id=%(guild_id)s "
+            "ORDER BY xp DESC, user_id LIMIT %(limit)s OFFSET %(offset)s",
+            {"guild_id": guild_id, "limit": limit, "offset": offset},
+        )
+        guild = self.database.guilds.get_settings(guild_id)
+        return [user_from(user, guild) for user in users]
+
+    def count(self, guild_id: int) -> int:
+        return self.database.query_one(
+            "SELECT COUNT(*) AS count FROM user_levels WHERE guild_id=%(guild_id)s",
+            {"guild_id": guild_id},
+        )["count"]
+
+    def get_rank(self, user: User) -> int:
+        """Return the zero-based position of the user in get_ranked_page order."""
+        return self.database.query_one(
+            "SELECT COUNT(*) AS rank FROM user_levels WHERE guild_id=%(guild_id)s "
+            "AND (xp > %(xp)s OR (xp = %(xp)s AND user_id < %(user_id)s))",
+            {"guild_id": user.guild.id, "xp": user.xp, "user_id": user.id},
+        )["rank"]
+
+
+class PostgresRewards:
+    def __init__(self, database: PostgresDatabase):
+        self.database = database
+        self.index: Dict[int, RewardIndex] = {}
+        self.generations = Generations()
+
+    def get_cached(self, guild_id: int) -> Optional[RewardIndex]:
+        return self.index.get(guild_id)
+
+    def invalidate(self, guild_id: int) -> None:
+        self.generations.invalidate(self.index, guild_id)
+
+    def get_index(self, guild_id: int) -> RewardIndex:
+        index = self.index.get(guild_id)
+        if index is None:
+            generation = self.generations.of(guild_id)
+            try:
+                rewards = self.database.query(
+                    "SELECT reward_level, reward_role FROM rewards "
+                    "WHERE guild_id=%(guild_id)s ORDER BY reward_level",
+                    {"guild_id": guild_id},
+                )
+            except psycopg.DatabaseError:
+                return RewardIndex((), ())
+            index = RewardIndex(
+                tuple(reward["reward_level"] for reward in rewards),
+                tuple(reward["reward_role"] for reward in rewards),
+            )
+            self.generations.store(self.index, guild_id, generation, index)
+        return index
+
+    def get(self, guild_id: int, role_id: int) -> Reward:
+        try:
+            reward = self.database.query_one(
+                "SELECT * FROM rewards WHERE guild_id=%(guild_id)s AND reward_role=%(reward_role)s",
+                {"guild_id": guild_id, "reward_role": role_id},
+            )
+        except psycopg.DatabaseError:
+            return None
+        return (
+            Reward(
+                self.database.guilds.get_settings(guild_id),
+                reward["reward_role"],
+                reward["reward_level"],
+            )
+            if reward
+            else None
+        )
+
+    def get_all(self, guild_id: int) -> List[Reward]:
+        try:
+            rewards = self.database.query(
+                "SELECT * FROM rewards WHERE guild_id=%(guild_id)s",
+                {"guild_id": guild_id},
+            )
+        except psycopg.DatabaseError:
+            rewards = []
+        guild = self.database.guilds.get_settings(guild_id)
+        return [
+            Reward(guild, reward["reward_role"], reward["reward_level"])
+            for reward in rewards
+        ]
+
+    def save(self, reward: Reward) -> Reward:
+        saved_reward = None
+        try:
+            saved_reward = self.database.query_one(
+                "INSERT INTO rewards (guild_id, reward_role, reward_level) "
+                "VALUES(%(guild_id)s,%(reward_role)s,%(reward_level)s) "
+                "ON CONFLICT(guild_id, reward_role) DO UPDATE "
+                "SET reward_level=excluded.reward_level "
+                "RETURNING *",
+                {
+                    "reward_level": reward.level,
+                    "guild_id": reward.guild.id,
+                    "reward_role": reward.role,
+                },
+            )
+        except psycopg.DatabaseError:
+            pass
+        self.invalidate(reward.guild.id)
+        return (
+            Reward(
+                reward.guild, saved_reward["reward_role"], saved_reward["reward_level"]
+            )
+            if saved_reward
+            else None
+        )
+
+    def delete(self, guild_id: int, role_id: int) -> None:
+        try:
+            self.database.query_one(
+                "DELETE FROM rewards WHERE guild_id=%(guild_id)s "
+                "AND reward_role=%(reward_role)s RETURNING reward_role",
+                {"guild_id": guild_id, "reward_role": role_id},
+            )
+        except psycopg.DatabaseError:
+            pass
+        self.invalidate(guild_id)
+
+
+class PostgresIgnoredChannels:
+    def __init__(self, database: PostgresDatabase):
+        self.database = database
+        self.index: Dict[int, FrozenSet[int]] = {}
+        self.generations = Generations()
+
+    def get_cached(self, guild_id: int) -> Optional[FrozenSet[int]]:
+        return self.index.get(guild_id)
+
+    def invalidate(self, guild_id: int) -> None:
+        self.generations.invalidate(self.index, guild_id)
+
+    def get_ids(self, guild_id: int) -> FrozenSet[int]:
+        ids = self.index.get(guild_id)
+        if ids is None:
+            generation = self.generations.of(guild_id)
+            try:
+                ids = frozenset(
+                    row["channel_id"]
+                    for row in self.database.query(
+                        "SELECT channel_id FROM ignored_channels WHERE guild_id=%(guild_id)s",
+                        {"guild_id": guild_id},
+                    )
+                )
+            except psycopg.DatabaseError:
+                return frozenset()
+            self.generations.store(self.index, guild_id, generation, ids)
+        return ids
+
+    def get(self, channel_id: int, guild_id: int) -> IgnoredChannel:
+        if channel_id not in self.get_ids(guild_id):
+            return None
+        return IgnoredChannel(self.database.guilds.get_settings(guild_id), channel_id)
+
+    def get_all(self, guild_id: int) -> List[IgnoredChannel]:
+        guild = self.database.guilds.get_settings(guild_id)
+        return [
+            IgnoredChannel(guild, channel_id) for channel_id in self.get_ids(guild_id)
+        ]
+
+    def save(self, ignored_channel: IgnoredChannel) -> IgnoredChannel:
+        saved_ignored_channel = None
+        try:
+            saved_ignored_channel = self.database.query_one(
+                "INSERT INTO ignored_channels(guild_id, channel_id) "
+                "VALUES(%(guild_id)s,%(channel_id)s) "
+                "ON CONFLICT(guild_id, channel_id) DO UPDATE SET channel_id=excluded.channel_id "
+                "RETURNING *",
+                {
+                    "guild_id": ignored_channel.guild.id,
+                    "channel_id": ignored_channel.channel,
+                },
+            )
+        except psycopg.DatabaseError:
+            pass
+        self.invalidate(ignored_channel.guild.id)
+        return (
+            IgnoredChannel(ignored_channel.guild, saved_ignored_channel["channel_id"])
+            if saved_ignored_channel
+            else None
+        )
+
+    def delete(self, channel_id: int, guild_id: int) -> None:
+        try:
+            self.database.query_one(
+                "DELETE FROM ignored_channels WHERE channel_id=%(channel_id)s "
+                "AND guild_id=%(guild_id)s RETURNING channel_id",
+                {"channel_id": channel_id, "guild_id": guild_id},
+            )
+        except psycopg.DatabaseError:
+            pass
+        self.invalidate(guild_id)
+
+
+class PostgresIgnoredRoles:
+    def __init__(self, database: PostgresDatabase):
+        self.database = database
+        self.index: Dict[int, FrozenSet[int]] = {}
+        self.generations = Generations()
+
+    def get_cached(self, guild_id: int) -> Optional[FrozenSet[int]]:
+        return self.index.get(guild_id)
+
+    def invalidate(self, guild_id: int) -> None:
+        self.generations.invalidate(self.index, guild_id)
+
+    def get_ids(self, guild_id: int) -> FrozenSet[int]:
+        ids = self.index.get(guild_id)
+        if ids is None:
+            generation = self.generations.of(guild_id)
+            try:
+                ids = frozenset(
+                    row["role_id"]
+                    for row in self.database.query(
+                        "SELECT role_id FROM ignored_roles WHERE guild_id=%(guild_id)s",
+                        {"guild_id": guild_id},
+                    )
+                )
+            except psycopg.DatabaseError:
+                return frozenset()
+            self.generations.store(self.index, guild_id, generation, ids)
+        return ids
+
+    def get(self, role_id: int, guild_id: int) -> IgnoredRole:
+        if role_id not in self.get_ids(guild_id):
+            return None
+        return IgnoredRole(self.database.guilds.get_settings(guild_id), role_id)
+
+    def get_all(self, guild_id: int) -> List[IgnoredRole]:
+        guild = self.database.guilds.get_settings(guild_id)
+        return [IgnoredRole(guild, role_id) for role_id in self.get_ids(guild_id)]
+
+    def save(self, ignored_role: IgnoredRole) -> IgnoredRole:
+        saved_ignored_role = None
+        try:
+            saved_ignored_role = self.database.query_one(
+                "INSERT INTO ignored_roles(guild_id, role_id) VALUES(%(guild_id)s,%(role_id)s) "
+                "ON CONFLICT(guild_id, role_id) DO UPDATE SET role_id=excluded.role_id "
+                "RETURNING *",
+                {"guild_id": ignored_role.guild.id, "role_id": ignored_role.role},
+            )
+        except psycopg.DatabaseError:
+            pass
+        self.invalidate(ignored_role.guild.id)
+        return (
+            IgnoredRole(ignored_role.guild, saved_ignored_role["role_id"])
+            if saved_ignored_role
+            else None
+        )
+
+    def delete(self, role_id: int, guild_id: int) -> None:
+        try:
+            self.database.query_one(
+                "DELETE FROM ignored_roles WHERE role_id=%(role_id)s "
+                "AND guild_id=%(guild_id)s RETURNING role_id",
+                {"role_id": role_id, "guild_id": guild_id},
+            )
+        except psycopg.DatabaseError:
+            pass
+        self.invalidate(guild_id)
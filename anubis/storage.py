@@ -0,0 +1,164 @@
+"""
+What the rest of the bot expects from a database. Database (SQLite) is the default backend,
+MemoryDatabase keeps everything in dicts and arrays for tests and benchmarks, and
+PostgresDatabase talks to a PostgreSQL server through a connection pool. Pick one with
+[database] backend.
+"""
+
+import logging
+from configparser import ConfigParser
+from datetime import datetime
+from typing import (
+    ContextManager,
+    FrozenSet,
+    Iterable,
+    List,
+    Optional,
+    Protocol,
+    Tuple,
+)
+
+from anubis.metrics import QueryStats
+from anubis.models import *
+
+
+class GuildStorage(Protocol):
+    def get_cached(self, guild_id: int) -> Optional[Guild]: ...
+
+    def get_settings(self, guild_id: int) -> Guild: ...
+
+    def invalidate(self, guild_id: int) -> None: ...
+
+    def save(self, guild: Guild) -> Guild: ...
+
+    def ensure_defaults(self, guild_ids: Iterable[int]) -> int: ...
+
+
+class UserStorage(Protocol):
+    write_behind: bool
+    flush_interval: float
+
+    def on_cooldown(self, user_id: int, guild_id: int, now: datetime) -> bool: ...
+
+    def invalidate(self, user_id: int, guild_id: int) -> None: ...
+
+    def get(self, user_id: int, guild_id: int) -> User: ...
+
+    def get_all_ignored(self, guild_id: int) -> List[User]: ...
+
+    def save(self, user: User) -> User: ...
+
+    def grant_xp(
+        self, user_id: int, guild_id: int, now: datetime
+    ) -> Optional[Tuple[int, User]]: ...
+
+    def adjust_xp(
+        self, user_id: int, guild_id: int, amount: Optional[int]
+    ) -> Optional[Tuple[int, User]]: ...
+
+    def adjust_xp_many(
+        self, user_ids: Iterable[int], guild_id: int, amount: Optional[int]
+    ) -> Tuple[int, int]: ...
+
+    def flush(self) -> int: ...
+
+    def get_ranked_users(self, guild_id: int) -> RankedUsers: ...
+
+    def get_ranked_page(
+        self, guild_id: int, limit: int, offset: int = 0
+    ) -> List[User]: ...
+
+    def count(self, guild_id: int) -> int: ...
+
+    def get_rank(self, user: User) -> int: ...
+
+
+class RewardStorage(Protocol):
+    def get_cached(self, guild_id: int) -> Optional[RewardIndex]: ...
+
+    def invalidate(self, guild_id: int) -> None: ...
+
+    def get_index(self, guild_id: int) -> RewardIndex: ...
+
+    def get(self, guild_id: int, role_id: int) -> Reward: ...
+
+    def get_all(self, guild_id: int) -> List[Reward]: ...
+
+    def save(self, reward: Reward) -> Reward: ...
+
+    def delete(self, guild_id: int, role_id: int) -> None: ...
+
+
+class IgnoredChannelStorage(Protocol):
+    def get_cached(self, guild_id: int) -> Optional[FrozenSet[int]]: ...
+
+    def invalidate(self, guild_id: int) -> None: ...
+
+    def get_ids(self, guild_id: int) -> FrozenSet[int]: ...
+
+    def get(self, channel_id: int, guild_id: int) -> IgnoredChannel: ...
+
+    def get_all(self, guild_id: int) -> List[IgnoredChannel]: ...
+
+    def save(self, ignored_channel: IgnoredChannel) -> IgnoredChannel: ...
+
+    def delete(self, channel_id: int, guild_id: int) -> None: ...
+
+
+class IgnoredRoleStorage(Protocol):
+    def get_cached(self, guild_id: int) -> Optional[FrozenSet[int]]: ...
+
+    def invalidate(self, guild_id: int) -> None: ...
+
+    def get_ids(self, guild_id: int) -> FrozenSet[int]: ...
+
+    def get(self, role_id: int, guild_id: int) -> IgnoredRole: ...
+
+    def get_all(self, guild_id: int) -> List[IgnoredRole]: ...
+
+    def save(self, ignored_role: IgnoredRole) -> IgnoredRole: ...
+
+    def delete(self, role_id: int, guild_id: int) -> None: ...
+
+
+class Storage(Protocol):
+    config: ConfigParser
+    log: logging.Logger
+    query_stats: QueryStats
+    # Whether other processes see what this one writes, which XP workers rely on.
+    shared: bool
+
+    guilds: GuildStorage
+    users: UserStorage
+    rewards: RewardStorage
+    ignored_channels: IgnoredChannelStorage
+    ignored_roles: IgnoredRoleStorage
+
+    def writing(self) -> ContextManager:
+        """Hold this while writing; writes are made one at a time."""
+
+    def batch(self) -> ContextManager:
+        """Write everything done while this is held in one transaction."""
+
+    def close(self) -> None: ...
+
+
+BACKENDS = ("sqlite", "memory", "postgresql")
+
+
+def open_storage(config: ConfigParser) -> Storage:
+    """Open the backend chosen by [database] backend."""
+    backend = config["database"].get("backend", "sqlite").lower()
+    if backend == "sqlite":
+        from anubis.database import Database
+
+        return Database(config)
+    if backend == "memory":
+        from anubis.memory_database import MemoryDatabase
+
+        return MemoryDatabase(config)
+    if backend == "postgresql":
+        from anubis.postgres_database import PostgresDatabase
+
+        return PostgresDatabase(config)
+    raise ValueError(f"Unknown database backend {backend}, use one of {BACKENDS}")
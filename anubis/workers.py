@@ -0,0 +1,325 @@
+"""
+Granting XP in separate processes. The bot forwards a compact MessageEvent for every message to
+the worker owning its guild; workers check cooldowns and ignores, grant the XP through a
+Database of their own and send back an Outcome whenever the bot has something to announce or
+roles to hand out.
+"""
+
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+from configparser import ConfigParser
+from datetime import datetime, timezone
+from time import monotonic
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+
+from anubis.storage import Storage, open_storage
+
+
+class MessageEvent(NamedTuple):
+    """The parts of a message that decide whether and how much XP it earns."""
+
+    guild_id: int
+    channel_id: int
+    user_id: int
+    role_ids: Tuple[int, ...]
+    # When the message arrived, as a POSIX timestamp.
+    timestamp: float
+
+
+class Outcome(NamedTuple):
+    """What the bot has to do for a message after its XP was granted."""
+
+    guild_id: int
+    user_id: int
+    level: int
+    leveled_up: bool
+    # Reward roles earned with this message that the member doesn't have yet.
+    roles: Tuple[int, ...]
+
+
+class Invalidate(NamedTuple):
+    """
+    Tells a worker that the bot changed something it may have cached. kind is one of guild,
+    rewards, ignored_channels, ignored_roles or user, the latter with a user_id.
+    """
+
+    kind: str
+    guild_id: int
+    user_id: Optional[int] = None
+
+
+class Barrier(NamedTuple):
+    """Echoed back by a worker once everything queued before it has been handled."""
+
+    token: int
+    worker: int
+
+
+Request = Union[MessageEvent, Invalidate, Barrier, None]
+
+# The most requests a worker handles in one transaction.
+BATCH_SIZE = 500
+# How often the pool looks for workers that died, in seconds.
+CHECK_INTERVAL = 1.0
+
+
+def handle(database: Storage, event: MessageEvent) -> Optional[Outcome]:
+    """
+    Grant the XP a message earned, the same way Leveling.on_message does in one process.
+    Must be called holding the backend's write lock.
+    """
+    now = datetime.fromtimestamp(event.timestamp, timezone.utc)
+    if database.users.on_cooldown(event.user_id, event.guild_id, now):
+        return None
+    if event.channel_id in database.ignored_channels.get_ids(event.guild_id):
+        return None
+    ignored_roles = database.ignored_roles.get_ids(event.guild_id)
+    if ignored_roles and any(role_id in ignored_roles for role_id in event.role_ids):
+        return None
+    granted = database.users.grant_xp(event.user_id, event.guild_id, now)
+    if not granted:
+        return None
+    previous_xp, user = granted
+    previous_level = user.guild.levels.level(previous_xp)
+    leveled_up = user.level > previous_level
+    if not leveled_up and previous_xp:
+        return None
+    roles = tuple(
+        role_id
+        for role_id in database.rewards.get_index(event.guild_id).earned(
+            previous_level if previous_xp else 0, user.level
+        )
+        if role_id not in event.role_ids
+    )
+    if not leveled_up and not roles:
+        return None
+    return Outcome(event.guild_id, event.user_id, user.level, leveled_up, roles)
+
+
+def invalidate(database: Storage, message: Invalidate) -> None:
+    if message.kind == "guild":
+        database.guilds.invalidate(message.guild_id)
+    elif message.kind == "rewards":
+        database.rewards.invalidate(message.guild_id)
+    elif message.kind == "ignored_channels":
+        database.ignored_channels.invalidate(message.guild_id)
+    elif message.kind == "ignored_roles":
+        database.ignored_roles.invalidate(message.guild_id)
+    elif message.kind == "user":
+        database.users.invalidate(message.user_id, message.guild_id)
+
+
+def run_worker(
+    number: int,
+    sections: Dict[str, Dict[str, str]],
+    requests: multiprocessing.Queue,
+    results: multiprocessing.Queue,
+) -> None:
+    """The main loop of a worker process, until it is sent None."""
+    config = ConfigParser()
+    config.read_dict(sections)
+    logging.basicConfig(
+        format=f"%(levelname)s worker {number} %(name)s: %(message)s",
+        level=config["log"]["level"],
+    )
+    # A worker only ever runs one query at a time, and XP it kept in memory would be
+    # overwritten by the bot's own writes.
+    config["database"]["readers"] = "0"
+    config["database"]["write_behind"] = "false"
+    database = open_storage(config)
+    running = True
+    try:
+        while running:
+            # Whatever has piled up is handled in one transaction, so the workers take turns
+            # on the database's write lock once per batch instead of once per message.
+            batch: List[Request] = [requests.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(requests.get_nowait())
+                except queue.Empty:
+                    break
+            replies = []
+            try:
+                with database.batch():
+                    for request in batch:
+                        if request is None:
+                            running = False
+                        elif isinstance(request, MessageEvent):
+                            try:
+                                outcome = handle(database, request)
+                            except Exception:
+                                database.log.exception(
+                                    f"Could not grant XP for {request}"
+                                )
+                                continue
+                            if outcome:
+                                replies.append(outcome)
+                        elif isinstance(request, Invalidate):
+                            invalidate(database, request)
+                        elif isinstance(request, Barrier):
+                            replies.append(request)
+            except Exception:
+                # The batch was rolled back, e.g. because the database stayed locked. Its
+                # messages earn nothing, but the worker carries on with the next batch.
+                database.log.exception(f"Could not write a batch of {len(batch)}")
+                for request in batch:
+                    if request is None:
+                        running = False
+                    elif isinstance(request, Invalidate):
+                        invalidate(database, request)
+                replies = [reply for reply in batch if isinstance(reply, Barrier)]
+            # Only once committed, so the bot reads what the outcomes announce.
+            for reply in replies:
+                results.put(reply)
+    finally:
+        database.close()
+
+
+class WorkerPool:
+    """
+    Worker processes that each own the guilds with (guild_id >> 22) % count equal to their
+    number, the same split Discord uses for shards. Requests for a guild always go to the
+    same worker, so they are handled in the order they were submitted.
+    """
+
+    def __init__(self, config: ConfigParser, count: int, queue_size: int = 10_000):
+        self.log = logging.getLogger("Anubis").getChild("WorkerPool")
+        self.context = multiprocessing.get_context("spawn")
+        self.sections = {
+            section: dict(config[section]) for section in config.sections()
+        }
+        self.queue_size = queue_size
+        self.requests: List[multiprocessing.Queue] = [
+            self.context.Queue(maxsize=queue_size) for _ in range(count)
+        ]
+        self.results: multiprocessing.Queue = self.context.Queue()
+        self.processes = [self.spawn(number) for number in range(count)]
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.receiver: Optional[threading.Thread] = None
+        self.closing = False
+        self.respawned = 0
+        # The barriers being waited for, and the workers that have yet to pass each.
+        self.barriers: Dict[int, Tuple[asyncio.Future, Set[int]]] = {}
+        self.tokens = itertools.count()
+        self.submitted = 0
+        self.dropped = 0
+
+    def spawn(self, number: int) -> multiprocessing.Process:
+        return self.context.Process(
+            target=run_worker,
+            args=(number, self.sections, self.requests[number], self.results),
+            name=f"anubis-worker-{number}",
+            daemon=True,
+        )
+
+    def worker_of(self, guild_id: int) -> int:
+        return (guild_id >> 22) % len(self.processes)
+
+    def start(self, deliver: Callable[[Outcome], None]) -> None:
+        """Start the workers. deliver is called on the running event loop with every Outcome."""
+        loop = self.loop = asyncio.get_running_loop()
+        for process in self.processes:
+            process.start()
+
+        def receive():
+            checked = monotonic()
+            while True:
+                if monotonic() - checked >= CHECK_INTERVAL:
+                    self.respawn_dead()
+                    checked = monotonic()
+                try:
+                    result = self.results.get(timeout=CHECK_INTERVAL)
+                except queue.Empty:
+                    continue
+                if result is None:
+                    break
+                if isinstance(result, Barrier):
+                    loop.call_soon_threadsafe(self.passed, result.token, result.worker)
+                else:
+                    loop.call_soon_threadsafe(deliver, result)
+
+        self.receiver = threading.Thread(
+            target=receive, name="anubis-worker-results", daemon=True
+        )
+        self.receiver.start()
+        self.log.info(f"Started {len(self.processes)} XP workers")
+
+    def respawn_dead(self) -> None:
+        """
+        Replace workers that died. A worker killed while waiting for requests dies holding
+        its queue's lock, so the new one gets a fresh queue; what was still queued for the
+        old one is lost, apart from the barriers, which are sent again.
+        """
+        for number, process in enumerate(self.processes):
+            if self.closing or process.is_alive():
+                continue
+            self.log.error(
+                f"{process.name} died with exit code {process.exitcode}, restarting it"
+            )
+            self.requests[number] = self.context.Queue(maxsize=self.queue_size)
+            self.processes[number] = self.spawn(number)
+            self.processes[number].start()
+            self.respawned += 1
+            self.loop.call_soon_threadsafe(self.resend_barriers, number)
+
+    def submit(self, event: MessageEvent) -> bool:
+        """Queue a message for its guild's worker, or drop it if that worker is too far behind."""
+        try:
+            self.requests[self.worker_of(event.guild_id)].put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.submitted += 1
+        return True
+
+    def invalidate(self, kind: str, guild_id: int, user_id: Optional[int] = None):
+        # Unlike messages these must not be dropped. If the queue is full they wait for room
+        # on an executor thread rather than blocking the event loop.
+        requests = self.requests[self.worker_of(guild_id)]
+        message = Invalidate(kind, guild_id, user_id)
+        try:
+            requests.put_nowait(message)
+        except queue.Full:
+            asyncio.get_running_loop().run_in_executor(None, requests.put, message)
+
+    async def barrier(self) -> None:
+        """Wait until every worker has handled everything submitted so far."""
+        token = next(self.tokens)
+        future = asyncio.get_running_loop().create_future()
+        self.barriers[token] = (future, set(range(len(self.processes))))
+        for number, requests in enumerate(self.requests):
+            requests.put(Barrier(token, number))
+        await future
+
+    def passed(self, token: int, worker: int) -> None:
+        # A barrier sent again to a restarted worker may be passed twice.
+        if token not in self.barriers:
+            return
+        future, waiting = self.barriers[token]
+        waiting.discard(worker)
+        if not waiting:
+            del self.barriers[token]
+            future.set_result(None)
+
+    def resend_barriers(self, worker: int) -> None:
+        for token, (_, waiting) in self.barriers.items():
+            if worker in waiting:
+                self.requests[worker].put(Barrier(token, worker))
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Let the workers finish what they have queued and stop them."""
+        self.closing = True
+        for requests in self.requests:
+            requests.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                self.log.warning(f"{process.name} did not stop in time")
+                process.terminate()
+        if self.receiver:
+            self.results.put(None)
+            self.receiver.join()
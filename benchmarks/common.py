@@ -0,0 +1,83 @@
+import statistics
+import tempfile
+import threading
+from configparser import ConfigParser
+from pathlib import Path
+from typing import Dict, List
+
+from anubis.database import Database
+from anubis.storage import Storage
+
+MIGRATIONS = Path(__file__).parent.parent / "anubis" / "migrations"
+
+
+def make_config(directory: str, database: Dict[str, str] = None) -> ConfigParser:
+    """A configuration like anubis.cfg.example, with the database in a scratch directory."""
+    config = ConfigParser()
+    config.read_dict(
+        {
+            "discord": {"prefix": ">", "token": ""},
+            "log": {"level": "WARNING", "suppress": ""},
+            "database": {
+                "path": str(Path(directory) / "benchmark.db"),
+                "migrations": str(MIGRATIONS),
+                **(database or {}),
+            },
+        }
+    )
+    return config
+
+
+def temporary_directory() -> tempfile.TemporaryDirectory:
+    return tempfile.TemporaryDirectory(prefix="anubis-benchmark-")
+
+
+class StatementCounter:
+    """
+    Counts the SQL statements run on every connection of a Database while in use. Other
+    backends are counted by their query_stats, which the memory backend never adds to.
+    """
+
+    def __init__(self, database: Storage):
+        self.lock = threading.Lock()
+        self.statements = 0
+        self.query_stats = database.query_stats
+        self.connections = []
+        if not isinstance(database, Database):
+            return
+        self.connections.append(database.conn)
+        readers = []
+        while not database.readers.empty():
+            readers.append(database.readers.get())
+        for reader in readers:
+            self.connections.append(reader[1])
+            database.readers.put(reader)
+
+    def recorded(self) -> int:
+        with self.query_stats.lock:
+            return sum(stats.count for stats in self.query_stats.statements.values())
+
+    def trace(self, statement: str) -> None:
+        with self.lock:
+            self.statements += 1
+
+    def __enter__(self) -> "StatementCounter":
+        for conn in self.connections:
+            conn.set_trace_callback(self.trace)
+        if not self.connections:
+            self.statements = -self.recorded()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        for conn in self.connections:
+            conn.set_trace_callback(None)
+        if not self.connections:
+            self.statements += self.recorded()
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """The p50 and p99 of durations in seconds, in milliseconds."""
+    if len(samples) == 1:
+        samples = samples * 2
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50": cuts[49] * 1000, "p99": cuts[98] * 1000}
@@ -0,0 +1,255 @@
+"""
+Drive Leveling.on_message with a synthetic stream of messages against a scratch database and
+report throughput, handler latency and SQL statements per message.
+
+    python -m benchmarks.on_message --guilds 50 --users 500 --messages 20000
+"""
+
+import argparse
+import asyncio
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Dict, List
+
+import discord
+
+from anubis.async_database import AsyncDatabase
+from anubis.cogs.leveling import Leveling
+from anubis.customizations import Anubis
+from anubis.models import IgnoredChannel, IgnoredRole, Reward, User
+from anubis.storage import BACKENDS, open_storage
+from benchmarks.common import (
+    StatementCounter,
+    make_config,
+    percentiles,
+    temporary_directory,
+)
+
+
+@dataclass
+class StubRole:
+    id: int
+
+    @property
+    def mention(self) -> str:
+        return f"<@&{self.id}>"
+
+
+@dataclass
+class StubChannel:
+    id: int
+
+
+@dataclass
+class StubGuild:
+    id: int
+    roles: Dict[int, StubRole] = field(default_factory=dict)
+
+    def get_role(self, role_id: int) -> StubRole:
+        return self.roles.get(role_id)
+
+    def get_member(self, user_id: int) -> None:
+        return None
+
+
+@dataclass
+class StubMember:
+    id: int
+    roles: List[StubRole]
+    bot: bool = False
+    name: str = "member"
+    discriminator: str = "0"
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+    async def add_roles(self, *roles: StubRole, reason: str = None) -> None:
+        self.roles.extend(roles)
+
+
+@dataclass
+class StubMessage:
+    guild: StubGuild
+    author: StubMember
+    channel: StubChannel
+
+    def is_system(self) -> bool:
+        return False
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--users", type=int, default=500, help="users per guild")
+    parser.add_argument("--channels", type=int, default=10, help="channels per guild")
+    parser.add_argument(
+        "--roles",
+        type=int,
+        default=10,
+        help="roles per guild, each member gets up to 3",
+    )
+    parser.add_argument(
+        "--ignored-channels", type=int, default=2, help="ignored channels per guild"
+    )
+    parser.add_argument(
+        "--ignored-roles", type=int, default=2, help="ignored roles per guild"
+    )
+    parser.add_argument("--rewards", type=int, default=5, help="rewards per guild")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument(
+        "--warmup", type=int, default=1000, help="messages sent before measuring"
+    )
+    parser.add_argument(
+        "--cooldown",
+        type=int,
+        default=0,
+        help="text timeout in minutes; 0 lets every message grant XP",
+    )
+    parser.add_argument("--backend", choices=BACKENDS, default="sqlite")
+    parser.add_argument(
+        "--dsn", default="", help="server to use with --backend postgresql"
+    )
+    parser.add_argument("--write-behind", action="store_true")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="XP worker processes; the handler then only forwards messages to them",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+async def populate(
+    database: AsyncDatabase, arguments: argparse.Namespace, rng: random.Random
+) -> List[StubMessage]:
+    """Create the guilds, their settings and members, and the messages to send."""
+    # Spaced like snowflakes, whose upper bits decide the shard and XP worker of a guild.
+    guild_ids = [number << 22 for number in range(1, arguments.guilds + 1)]
+    await database.guilds.ensure_defaults(guild_ids)
+    now = datetime.now(timezone.utc)
+    guilds = []
+    members = []
+    for guild_id in guild_ids:
+        settings = await database.guilds.get_settings(guild_id)
+        settings.set_text_timeout(arguments.cooldown)
+        settings = await database.guilds.save(settings)
+
+        guild = StubGuild(guild_id)
+        role_ids = [guild_id * 1000 + role for role in range(arguments.roles)]
+        guild.roles = {role_id: StubRole(role_id) for role_id in role_ids}
+        for role_id in role_ids[: arguments.ignored_roles]:
+            await database.ignored_roles.save(IgnoredRole(settings, role_id))
+        channels = [
+            StubChannel(guild_id * 1000 + channel)
+            for channel in range(arguments.channels)
+        ]
+        for channel in channels[: arguments.ignored_channels]:
+            await database.ignored_channels.save(IgnoredChannel(settings, channel.id))
+        # Rewards are spread over the first levels, so that level ups hand some of them out.
+        for number, role_id in enumerate(
+            role_ids[-arguments.rewards :] if arguments.rewards else []
+        ):
+            await database.rewards.save(Reward(settings, role_id, 2 + number * 2))
+
+        guild_members = []
+        for user in range(arguments.users):
+            member = StubMember(
+                guild_id * 1_000_000 + user,
+                rng.sample(
+                    list(guild.roles.values()), min(rng.randint(0, 3), arguments.roles)
+                ),
+            )
+            guild_members.append(member)
+            await database.users.save(
+                User(member.id, settings, rng.randint(0, 2000), now, False)
+            )
+        guilds.append((guild, channels))
+        members.append(guild_members)
+    await database.users.flush()
+
+    messages = []
+    for _ in range(arguments.warmup + arguments.messages):
+        index = rng.randrange(len(guilds))
+        guild, channels = guilds[index]
+        messages.append(
+            StubMessage(guild, rng.choice(members[index]), rng.choice(channels))
+        )
+    return messages
+
+
+async def run(arguments: argparse.Namespace) -> None:
+    rng = random.Random(arguments.seed)
+    with temporary_directory() as directory:
+        config = make_config(
+            directory,
+            {
+                "backend": arguments.backend,
+                "dsn": arguments.dsn,
+                "write_behind": str(arguments.write_behind).lower(),
+            },
+        )
+        # Room for every message, so that none are dropped.
+        config.read_dict(
+            {
+                "workers": {
+                    "count": str(arguments.workers),
+                    "queue_size": str(arguments.warmup + arguments.messages),
+                }
+            }
+        )
+        database = open_storage(config)
+        async_database = AsyncDatabase(database)
+        bot = Anubis(config, async_database, intents=discord.Intents.default())
+        leveling = Leveling(bot)
+        outcomes = []
+        try:
+            messages = await populate(async_database, arguments, rng)
+            if bot.workers:
+                bot.workers.start(outcomes.append)
+            for message in messages[: arguments.warmup]:
+                await leveling.on_message(message)
+
+            latencies = []
+            with StatementCounter(database) as counter:
+                start = perf_counter()
+                for message in messages[arguments.warmup :]:
+                    handler_start = perf_counter()
+                    await leveling.on_message(message)
+                    latencies.append(perf_counter() - handler_start)
+                await async_database.users.flush()
+                if bot.workers:
+                    await bot.workers.barrier()
+                elapsed = perf_counter() - start
+        finally:
+            if bot.workers:
+                bot.workers.close()
+            async_database.close()
+
+    latency = percentiles(latencies)
+    print(
+        f"{arguments.messages} messages over {arguments.guilds} guilds "
+        f"with {arguments.users} users each"
+        f" on {arguments.backend}"
+        f"{', write-behind' if arguments.write_behind else ''}"
+        f"{f', {arguments.workers} workers' if arguments.workers else ''}"
+    )
+    print(f"messages/sec: {arguments.messages / elapsed:.0f}")
+    print(f"handler p50:  {latency['p50']:.3f} ms")
+    print(f"handler p99:  {latency['p99']:.3f} ms")
+    if arguments.workers:
+        # The workers' statements aren't counted, the handler only forwards messages.
+        print(f"outcomes:     {len(outcomes)}")
+    else:
+        print(f"SQL/message:  {counter.statements / arguments.messages:.2f}")
+
+
+def main() -> None:
+    asyncio.run(run(parse_arguments()))
+
+
+if __name__ == "__main__":
+    main()
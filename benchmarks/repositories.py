@@ -0,0 +1,245 @@
+"""
+Time the repository methods the cogs call against a scratch database seeded to realistic sizes,
+and print the results as JSON so they can be diffed between commits.
+
+    python -m benchmarks.repositories --guilds 10000 --rows 1000000 --output before.json
+"""
+
+import argparse
+import json
+import random
+import sys
+import tracemalloc
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Callable, Dict, List, Sized
+
+from anubis.database import Database
+from anubis.models import User
+from benchmarks.common import make_config, percentiles, temporary_directory
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--guilds", type=int, default=10_000)
+    parser.add_argument(
+        "--rows",
+        type=int,
+        default=1_000_000,
+        help="user_levels rows, skewed so that low guild ids have the most users",
+    )
+    parser.add_argument(
+        "--ignored", type=int, default=5, help="ignored channels and roles per guild"
+    )
+    parser.add_argument("--rewards", type=int, default=5, help="rewards per guild")
+    parser.add_argument(
+        "--iterations", type=int, default=2000, help="calls timed per method"
+    )
+    parser.add_argument("--write-behind", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", type=argparse.FileType("w"), default=sys.stdout, help="JSON file"
+    )
+    return parser.parse_args()
+
+
+def seed(
+    database: Database, arguments: argparse.Namespace, rng: random.Random
+) -> List[tuple]:
+    """Fill every table in bulk and return the (guild_id, user_id) of every user row."""
+    database.guilds.ensure_defaults(range(1, arguments.guilds + 1))
+    conn = database.conn
+    now = datetime.now(timezone.utc)
+
+    keys = set()
+    while len(keys) < arguments.rows:
+        guild_id = int(arguments.guilds * rng.random() ** 2) + 1
+        keys.add((guild_id, rng.randrange(1, 1 << 62)))
+    keys = sorted(keys)
+
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO user_levels (guild_id, user_id, xp, timeout, ignore_xp_gain) "
+        "VALUES(?,?,?,?,?)",
+        (
+            (guild_id, user_id, rng.randrange(100_000), now, rng.random() < 0.01)
+            for guild_id, user_id in keys
+        ),
+    )
+    for table, column in (
+        ("ignored_channels", "channel_id"),
+        ("ignored_roles", "role_id"),
+    ):
+        conn.executemany(
+            f"INSERT INTO {table} (guild_id, {column}) VALUES(?,?)",
+            (
+                (guild_id, guild_id * 1000 + number)
+                for guild_id in range(1, arguments.guilds + 1)
+                for number in range(arguments.ignored)
+            ),
+        )
+    conn.executemany(
+        "INSERT INTO rewards (guild_id, reward_role, reward_level) VALUES(?,?,?)",
+        (
+            (guild_id, guild_id * 1000 + number, 5 * (number + 1))
+            for guild_id in range(1, arguments.guilds + 1)
+            for number in range(arguments.rewards)
+        ),
+    )
+    conn.execute("COMMIT")
+    conn.execute("ANALYZE")
+    return keys
+
+
+def measure(function: Callable[[], object], iterations: int) -> Dict[str, float]:
+    latencies = []
+    start = perf_counter()
+    for _ in range(iterations):
+        call_start = perf_counter()
+        function()
+        latencies.append(perf_counter() - call_start)
+    elapsed = perf_counter() - start
+    return {
+        "calls": iterations,
+        "ops_per_sec": round(iterations / elapsed, 1),
+        "mean_ms": round(elapsed / iterations * 1000, 4),
+        **{
+            f"{name}_ms": round(value, 4)
+            for name, value in percentiles(latencies).items()
+        },
+    }
+
+
+def measure_memory(function: Callable[[], Sized]) -> Dict[str, float]:
+    """How many bytes per row the result of function keeps alive."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = function()
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return {
+        "rows": len(result),
+        "bytes_per_row": round(retained / max(len(result), 1), 1),
+    }
+
+
+def run(arguments: argparse.Namespace) -> Dict[str, object]:
+    rng = random.Random(arguments.seed)
+    with temporary_directory() as directory:
+        database = Database(
+            make_config(
+                directory, {"write_behind": str(arguments.write_behind).lower()}
+            )
+        )
+        try:
+            seed_start = perf_counter()
+            keys = seed(database, arguments, rng)
+            seed_time = perf_counter() - seed_start
+
+            def random_key():
+                return keys[rng.randrange(len(keys))]
+
+            def random_guild():
+                return rng.randrange(1, arguments.guilds + 1)
+
+            def get_user():
+                guild_id, user_id = random_key()
+                database.users.get(user_id, guild_id)
+
+            def save_user():
+                guild_id, user_id = random_key()
+                database.users.save(
+                    User(
+                        user_id,
+                        database.guilds.get_settings(guild_id),
+                        rng.randrange(100_000),
+                        datetime.now(timezone.utc),
+                        False,
+                    )
+                )
+
+            def ranked_users(guild_id: int):
+                return lambda: database.users.get_ranked_users(guild_id)
+
+            def uncached(repository, method: Callable[[int], object]):
+                def call():
+                    guild_id = random_guild()
+                    repository.invalidate(guild_id)
+                    method(guild_id)
+
+                return call
+
+            largest_guild = keys[0][0]
+            median_guild = keys[len(keys) // 2][0]
+            ranked_iterations = max(1, arguments.iterations // 100)
+            results = {
+                "Users.get": measure(get_user, arguments.iterations),
+                "Users.save": measure(save_user, arguments.iterations),
+                "Users.get_ranked_users (largest guild)": measure(
+                    ranked_users(largest_guild), ranked_iterations
+                ),
+                "Users.get_ranked_users (median guild)": measure(
+                    ranked_users(median_guild), arguments.iterations
+                ),
+                "Rewards.get_all": measure(
+                    lambda: database.rewards.get_all(random_guild()),
+                    arguments.iterations,
+                ),
+                "IgnoredChannels.get_ids": measure(
+                    uncached(
+                        database.ignored_channels, database.ignored_channels.get_ids
+                    ),
+                    arguments.iterations,
+                ),
+                "IgnoredRoles.get_ids": measure(
+                    uncached(database.ignored_roles, database.ignored_roles.get_ids),
+                    arguments.iterations,
+                ),
+                "IgnoredChannels.get_all": measure(
+                    lambda: database.ignored_channels.get_all(random_guild()),
+                    arguments.iterations,
+                ),
+                "IgnoredRoles.get_all": measure(
+                    lambda: database.ignored_roles.get_all(random_guild()),
+                    arguments.iterations,
+                ),
+            }
+            ranked_users = database.users.get_ranked_users(largest_guild)
+            memory = {
+                "Users.get_ranked_users (largest guild)": measure_memory(
+                    lambda: database.users.get_ranked_users(largest_guild)
+                ),
+                "User objects (largest guild)": measure_memory(
+                    lambda: list(ranked_users)
+                ),
+            }
+            database.users.flush()
+        finally:
+            database.close()
+
+    return {
+        "parameters": {
+            name: value for name, value in vars(arguments).items() if name != "output"
+        },
+        "seed_seconds": round(seed_time, 2),
+        "largest_guild_users": sum(
+            1 for guild_id, _ in keys if guild_id == largest_guild
+        ),
+        "median_guild_users": sum(
+            1 for guild_id, _ in keys if guild_id == median_guild
+        ),
+        "results": results,
+        "memory": memory,
+    }
+
+
+def main() -> None:
+    arguments = parse_arguments()
+    json.dump(run(arguments), arguments.output, indent=2)
+    arguments.output.write("\n")
+
+
+if __name__ == "__main__":
+    main()
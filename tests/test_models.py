@@ -0,0 +1,84 @@
+from math import floor, sqrt
+
+import pytest
+
+from anubis.models import LevelTable
+
+# The pairs whose levels the closed-form seed of the old formula got right.
+MATCHING = [(15, 50), (10, 30), (100, 10), (5, 200), (20, 75), (15, 5), (50, 1)]
+
+
+def formula_level(xp: int, base: int, modifier: int) -> int:
+    """User.level before the threshold table: a sqrt estimate, then a walk up."""
+    i = 0
+    if xp > 1000:
+        i = floor(sqrt(((xp - base) * 100) / (base * modifier))) - 2
+    while True:
+        xp_needed = base + (round(base * (modifier / 100) * i) * i)
+        if xp < xp_needed:
+            return i + 1
+        i += 1
+
+
+def walked_levels(xp_range: range, base: int, modifier: int):
+    """The same walk, but always from level 0, for every XP of an ascending range."""
+    i = 0
+    for xp in xp_range:
+        while xp >= base + (round(base * (modifier / 100) * i) * i):
+            i += 1
+        yield xp, i + 1
+
+
+def sample_xp(table: LevelTable):
+    """A wide XP range, plus both sides of every threshold of the first 300 levels."""
+    yield from range(0, 300_000, 7)
+    for level in range(300):
+        threshold = table.xp_needed(level)
+        yield from (threshold - 1, threshold, threshold + 1)
+
+
+@pytest.mark.parametrize("base, modifier", MATCHING)
+def test_table_matches_formula(base, modifier):
+    table = LevelTable(base, modifier)
+    for xp in sample_xp(table):
+        if xp < 0:
+            continue
+        assert table.level(xp) == formula_level(xp, base, modifier), xp
+
+
+@pytest.mark.parametrize("base, modifier", MATCHING + [(1, 1), (2, 3)])
+def test_table_matches_walk(base, modifier):
+    table = LevelTable(base, modifier)
+    for xp, level in walked_levels(range(0, 300_000), base, modifier):
+        assert table.level(xp) == level, xp
+
+
+def test_small_modifiers_deviate_from_formula():
+    # Here the sqrt estimate can start past the right level, so the old formula reported
+    # levels that were too high, by up to 22 below 20,000 XP.
+    table = LevelTable(1, 1)
+    assert formula_level(1248, 1, 1) == 352
+    assert table.level(1248) == 351
+    deviations = {
+        xp: formula_level(xp, 1, 1) - level
+        for xp, level in walked_levels(range(20_000), 1, 1)
+        if formula_level(xp, 1, 1) != level
+    }
+    assert min(deviations) == 1248
+    assert all(0 < deviation <= 22 for deviation in deviations.values())
+    assert max(deviations.values()) == 22
+
+
+def test_xp_needed_matches_formula():
+    table = LevelTable(15, 50)
+    for level in range(500):
+        assert table.xp_needed(level) == 15 + round(15 * 0.5 * level) * level
+    assert table.xp_needed(-1) == 0
+
+
+@pytest.mark.parametrize("base, modifier", [(0, 50), (15, 0), (-5, 50), (15, -10)])
+def test_settings_that_never_level_raise(base, modifier):
+    table = LevelTable(base, modifier)
+    # Past the precomputed thresholds, growing the table would never end.
+    with pytest.raises(ValueError):
+        table.level(max(table.thresholds[-1], 0) + 10**9)
@@ -0,0 +1,167 @@
+import sqlite3
+from configparser import ConfigParser
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+from anubis.database import Database
+
+MIGRATIONS = Path(__file__).parent.parent / "anubis" / "migrations"
+TIMEOUT = datetime(2021, 1, 1, 12, 30, 15, 250, tzinfo=timezone.utc)
+LATER_TIMEOUT = datetime(2021, 6, 1, 8, 0, 0, 500, tzinfo=timezone.utc)
+
+
+def baseline(path: Path) -> None:
+    """Create a database as it was before migration 003, with duplicate rows."""
+    conn = sqlite3.connect(path)
+    for number in (1, 2):
+        conn.executescript((MIGRATIONS / f"{number:03}.sql").read_text())
+        conn.execute("INSERT INTO applied_migrations VALUES(?)", (number,))
+    conn.execute("INSERT INTO level_settings VALUES(1, 60, 15, 5, 30, NULL, NULL)")
+    # The duplicates of user 10 differ in every column, only the 900 XP row should be kept.
+    conn.executemany(
+        "INSERT INTO user_levels VALUES(?, ?, ?, ?, ?)",
+        [
+            (1, 10, 40, LATER_TIMEOUT, 1),
+            (1, 10, 900, TIMEOUT, 0),
+            (1, 10, 120, LATER_TIMEOUT, 1),
+        ]
+        + [(1, user_id, user_id * 3, TIMEOUT, 0) for user_id in range(11, 200)],
+    )
+    conn.executemany(
+        "INSERT INTO rewards VALUES(1, 7, ?)", [(level,) for level in (2, 9, 4)]
+    )
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def database(tmp_path):
+    baseline(tmp_path / "anubis.db")
+    config = ConfigParser()
+    config.read_dict(
+        {
+            "log": {"level": "WARNING"},
+            "database": {
+                "path": str(tmp_path / "anubis.db"),
+                "migrations": str(MIGRATIONS),
+                # Every read goes through the writer, which is the connection traced below.
+                "readers": "0",
+            },
+        }
+    )
+    database = Database(config)
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def unindexed(tmp_path):
+    """A connection to the schema as it was before migration 003."""
+    baseline(tmp_path / "baseline.db")
+    conn = sqlite3.connect(tmp_path / "baseline.db")
+    yield conn
+    conn.close()
+
+
+def query_plans(database: Database, call, on: sqlite3.Connection = None) -> list:
+    """
+    EXPLAIN QUERY PLAN of every user_levels SELECT run by call, one string of steps each.
+    The plans are made on the given connection, the database's own by default.
+    """
+    statements = []
+    database.conn.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        database.conn.set_trace_callback(None)
+    selects = [
+        sql
+        for sql in statements
+        if sql.lstrip().upper().startswith("SELECT") and "user_levels" in sql
+    ]
+    assert selects
+    on = on or database.conn
+    return [
+        "\n".join(row[3] for row in on.execute("EXPLAIN QUERY PLAN " + sql))
+        for sql in selects
+    ]
+
+
+def assert_indexed(plans: list) -> None:
+    for plan in plans:
+        assert "SCAN user_levels" not in plan, plan
+        assert "USING" in plan, plan
+
+
+def test_migrations_applied(database):
+    numbers = [
+        row[0] for row in database.conn.execute("SELECT number FROM applied_migrations")
+    ]
+    assert numbers == sorted(int(path.stem) for path in MIGRATIONS.glob("*.sql"))
+
+
+def test_dedupe_keeps_highest_xp(database):
+    rows = database.conn.execute(
+        "SELECT xp FROM user_levels WHERE guild_id=1 AND user_id=10"
+    ).fetchall()
+    assert [row["xp"] for row in rows] == [900]
+    user = database.users.get(10, 1)
+    assert (user.xp, user.timeout, user.ignore_xp_gain) == (900, TIMEOUT, False)
+    rewards = database.conn.execute(
+        "SELECT reward_level FROM rewards WHERE guild_id=1 AND reward_role=7"
+    ).fetchall()
+    assert [row["reward_level"] for row in rewards] == [9]
+
+
+def leaderboard_calls(database: Database) -> dict:
+    """The Users methods whose queries the migrations index, by name."""
+    user = database.users.get(50, 1)
+    return {
+        "get": lambda: database.users.get(10, 1),
+        "get_ranked_users": lambda: database.users.get_ranked_users(1),
+        "get_ranked_page": lambda: database.users.get_ranked_page(1, 10, 20),
+        "get_rank": lambda: database.users.get_rank(user),
+        "count": lambda: database.users.count(1),
+    }
+
+
+@pytest.mark.parametrize(
+    "name", ["get", "get_ranked_users", "get_ranked_page", "get_rank", "count"]
+)
+def test_queries_scan_before_migrations(database, unindexed, name):
+    call = leaderboard_calls(database)[name]
+    plans = query_plans(database, call, on=unindexed)
+    assert all("SCAN user_levels" in plan for plan in plans), plans
+
+
+def test_users_get_uses_primary_key(database):
+    assert_indexed(query_plans(database, lambda: database.users.get(10, 1)))
+
+
+def test_get_ranked_page_uses_leaderboard_index(database):
+    plans = query_plans(database, lambda: database.users.get_ranked_page(1, 10, 20))
+    assert_indexed(plans)
+    assert all("user_levels_guild_xp" in plan for plan in plans)
+    assert not any("TEMP B-TREE" in plan for plan in plans)
+
+
+def test_get_ranked_users_uses_leaderboard_index(database):
+    plans = query_plans(database, lambda: database.users.get_ranked_users(1))
+    assert_indexed(plans)
+    assert all("user_levels_guild_xp" in plan for plan in plans)
+    assert not any("TEMP B-TREE" in plan for plan in plans)
+
+
+def test_get_rank_uses_leaderboard_index(database):
+    user = database.users.get(50, 1)
+    plans = query_plans(database, lambda: database.users.get_rank(user))
+    assert_indexed(plans)
+    assert all("user_levels_guild_xp" in plan for plan in plans)
+    assert database.users.get_rank(user) == 150
+
+
+def test_count_uses_index(database):
+    assert_indexed(query_plans(database, lambda: database.users.count(1)))
+    assert database.users.count(1) == 190
@@ -0,0 +1,229 @@
+import importlib.util
+import os
+import random
+from configparser import ConfigParser
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+from anubis.models import IgnoredChannel, IgnoredRole, Reward
+from anubis.storage import open_storage
+
+MIGRATIONS = Path(__file__).parent.parent / "anubis" / "migrations"
+# A server to run the PostgreSQL backend against, e.g. postgresql://postgres@localhost/anubis.
+# Its tables are emptied before every test.
+DSN = os.environ.get("ANUBIS_TEST_DSN")
+
+BACKENDS = [
+    "memory",
+    pytest.param(
+        "postgresql",
+        marks=pytest.mark.skipif(
+            not DSN or importlib.util.find_spec("psycopg") is None,
+            reason="needs ANUBIS_TEST_DSN and psycopg",
+        ),
+    ),
+]
+NOW = datetime(2026, 1, 1, 0, 0, 0, 1, tzinfo=timezone.utc)
+
+
+def open_backend(backend: str, tmp_path: Path):
+    config = ConfigParser()
+    config.read_dict(
+        {
+            "log": {"level": "WARNING"},
+            "database": {
+                "backend": backend,
+                "path": str(tmp_path / f"{backend}.db"),
+                "migrations": str(MIGRATIONS),
+                "dsn": DSN or "",
+            },
+        }
+    )
+    storage = open_storage(config)
+    if backend == "postgresql":
+        with storage.connection() as conn:
+            conn.execute(
+                "TRUNCATE level_settings, user_levels, rewards, ignored_channels, "
+                "ignored_roles"
+            )
+    return storage
+
+
+@pytest.fixture(params=BACKENDS)
+def backends(request, tmp_path):
+    """SQLite and the backend it is compared against, both empty."""
+    sqlite = open_backend("sqlite", tmp_path)
+    other = open_backend(request.param, tmp_path)
+    yield sqlite, other
+    other.close()
+    sqlite.close()
+
+
+def same(backends, scenario):
+    """Run scenario against both backends and return its result, which must match."""
+    sqlite, other = backends
+    expected = scenario(sqlite)
+    assert scenario(other) == expected
+    return expected
+
+
+def seeded(storage):
+    """Guild 1 without a cooldown and 20 users with random XP."""
+    storage.guilds.ensure_defaults([1])
+    guild = storage.guilds.get_settings(1)
+    guild.set_text_timeout(0)
+    storage.guilds.save(guild)
+    rng = random.Random(1)
+    for user_id in range(20):
+        storage.users.grant_xp(user_id, 1, NOW)
+        storage.users.adjust_xp(user_id, 1, rng.randrange(1000))
+    return storage
+
+
+def test_ensure_defaults(backends):
+    def scenario(storage):
+        missing = storage.guilds.ensure_defaults([1, 2, 2])
+        guild = storage.guilds.get_settings(2)
+        guild.reward_amount = 9
+        storage.guilds.save(guild)
+        return (
+            missing,
+            storage.guilds.ensure_defaults([2, 3]),
+            storage.guilds.get_settings(2),
+            storage.guilds.get_settings(3),
+        )
+
+    assert same(backends, scenario)[:2] == (2, 1)
+
+
+def test_grant_xp(backends):
+    def scenario(storage):
+        storage.guilds.ensure_defaults([1])
+        rng = random.Random(2)
+        now = NOW
+        results = []
+        for _ in range(300):
+            now += timedelta(seconds=rng.choice([1, 90, 200]))
+            user_id = rng.randrange(10)
+            results.append(storage.users.grant_xp(user_id, 1, now))
+            results.append(storage.users.on_cooldown(user_id, 1, now))
+        user = storage.users.get(3, 1)
+        user.ignore_xp_gain = True
+        storage.users.save(user)
+        results.append(storage.users.grant_xp(3, 1, now + timedelta(days=1)))
+        results.append([user.id for user in storage.users.get_all_ignored(1)])
+        return results
+
+    results = same(backends, scenario)
+    assert any(result is None for result in results[::2])
+    assert results[-2] is None
+
+
+def test_adjust_xp(backends):
+    def scenario(storage):
+        storage.guilds.ensure_defaults([1])
+        storage.users.grant_xp(6, 1, NOW)
+        return [
+            storage.users.adjust_xp(5, 1, 40),
+            storage.users.adjust_xp(6, 1, None),
+            storage.users.adjust_xp(6, 1, 120),
+            storage.users.adjust_xp(6, 1, -70),
+            storage.users.adjust_xp(6, 1, -500),
+            storage.users.adjust_xp(6, 1, 30),
+            storage.users.adjust_xp(6, 1, None),
+        ]
+
+    results = same(backends, scenario)
+    assert results[0] is None
+    assert [(previous, user.xp) for previous, user in results[1:]] == [
+        (0, 0),
+        (0, 120),
+        (120, 50),
+        (50, 0),
+        (0, 30),
+        (30, 0),
+    ]
+
+
+def test_adjust_xp_many(backends):
+    def scenario(storage):
+        seeded(storage)
+        return [
+            storage.users.adjust_xp_many([1, 2, 3, 40, 41], 1, 25),
+            storage.users.adjust_xp_many(range(0, 20, 2), 1, -300),
+            storage.users.adjust_xp_many([5, 6, 99], 1, None),
+            [storage.users.get(user_id, 1).xp for user_id in range(20)],
+        ]
+
+    results = same(backends, scenario)
+    assert results[0] == (3, 75)
+
+
+def test_ranking(backends):
+    def scenario(storage):
+        seeded(storage)
+        ranked = storage.users.get_ranked_users(1)
+        page = storage.users.get_ranked_page(1, 5, 3)
+        return (
+            [(user.id, user.xp) for user in ranked],
+            [(user.id, user.xp) for user in page],
+            [
+                storage.users.get_rank(user)
+                for user in storage.users.get_ranked_page(1, 20)
+            ],
+            storage.users.count(1),
+            storage.users.count(2),
+        )
+
+    ranked, page, ranks, count, empty = same(backends, scenario)
+    assert page == ranked[3:8]
+    assert ranks == list(range(20))
+    assert (count, empty) == (20, 0)
+
+
+def test_rewards(backends):
+    def scenario(storage):
+        storage.guilds.ensure_defaults([1])
+        guild = storage.guilds.get_settings(1)
+        empty = storage.rewards.get_index(1)
+        storage.rewards.save(Reward(guild, 10, 3))
+        storage.rewards.save(Reward(guild, 11, 1))
+        storage.rewards.save(Reward(guild, 12, 7))
+        storage.rewards.save(Reward(guild, 10, 5))
+        storage.rewards.delete(1, 11)
+        return (
+            empty,
+            storage.rewards.get_index(1),
+            storage.rewards.get(1, 10).level,
+            sorted(
+                (reward.role, reward.level) for reward in storage.rewards.get_all(1)
+            ),
+        )
+
+    results = same(backends, scenario)
+    assert results[1] == ((5, 7), (10, 12))
+
+
+def test_ignored_ids(backends):
+    def scenario(storage):
+        storage.guilds.ensure_defaults([1])
+        guild = storage.guilds.get_settings(1)
+        empty = (storage.ignored_channels.get_ids(1), storage.ignored_roles.get_ids(1))
+        storage.ignored_channels.save(IgnoredChannel(guild, 5))
+        storage.ignored_channels.save(IgnoredChannel(guild, 8))
+        storage.ignored_channels.delete(8, 1)
+        storage.ignored_roles.save(IgnoredRole(guild, 6))
+        storage.ignored_roles.save(IgnoredRole(guild, 7))
+        storage.ignored_roles.delete(6, 1)
+        return (
+            empty,
+            storage.ignored_channels.get_ids(1),
+            storage.ignored_roles.get_ids(1),
+            storage.ignored_channels.get(5, 1).channel,
+            storage.ignored_roles.get(6, 1),
+        )
+
+    results = same(backends, scenario)
+    assert results[1:] == (frozenset({5}), frozenset({7}), 5, None)